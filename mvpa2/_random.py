@@ -38,3 +38,20 @@ def seed(random_seed=_random_seed):
     random.seed(random_seed)
 
 seed(_random_seed)
+
+
+def call_seeded(random_seed, fn, *args, **kwargs):
+    """Call `fn` with all RNGs seeded with `random_seed`
+
+    States of the RNGs are restored upon return, so random numbers drawn
+    afterwards do not depend on how many of them were consumed by `fn`.
+    Since the RNGs are global, it must not be used while other threads
+    might draw random numbers.
+    """
+    np_state, py_state = np.random.get_state(), random.getstate()
+    seed(random_seed)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        np.random.set_state(np_state)
+        random.setstate(py_state)
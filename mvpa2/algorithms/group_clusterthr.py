@@ -11,7 +11,8 @@
 __docformat__ = 'restructuredtext'
 
 __all__ = ['GroupClusterThreshold', 'get_thresholding_map',
-           'get_cluster_sizes', 'get_cluster_pvals']
+           'get_cluster_sizes', 'get_cluster_pvals', 'get_feature_adjacency',
+           'get_batch_cluster_sizes']
 
 if __debug__:
     from mvpa2.base import debug
@@ -22,11 +23,13 @@ from collections import Counter
 import numpy as np
 
 from scipy.ndimage import measurements
-from scipy.sparse import dok_matrix
+from scipy.sparse import csr_matrix, coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 from mvpa2.mappers.base import IdentityMapper, _verified_reverse1
 from mvpa2.datasets import Dataset
 from mvpa2.base.learner import Learner
+from mvpa2.base.parallel import get_executor, iter_results
 from mvpa2.base.param import Parameter
 from mvpa2.base.constraints import \
     EnsureInt, EnsureFloat, EnsureRange, EnsureChoice
@@ -74,7 +77,11 @@ class GroupClusterThreshold(Learner):
 
     Moreover, this implementation minimizes the required memory demands and
     allows for computing large numbers of bootstrap samples without
-    significant increase in memory demand (CPU time trade-off).
+    significant increase in memory demand. Bootstrap maps are never stored,
+    but recomputed in batches as the product of a sparse selection matrix
+    with the input samples. Clusters are labeled directly in feature space,
+    using a feature adjacency that is determined once from the dataset's
+    mapper.
 
     Instances of this class must be trained before than can be used to
     threshold accuracy maps. The training dataset must match the following
@@ -206,8 +213,18 @@ class GroupClusterThreshold(Learner):
 
     n_proc = Parameter(
         1, constraints=EnsureInt() & EnsureRange(min=1),
-        doc="""Number of parallel processes to use for computation.
-            Requires `joblib` external module.""")
+        doc="""Number of parallel processes to use for computation.""")
+
+    executor = Parameter(
+        None,
+        doc="""Backend to use for parallel computation: 'process', 'thread',
+            'joblib', 'serial', or an instance of a `concurrent.futures`-style
+            executor. If None, computation is done serially if ``n_proc`` is
+            1, and in parallel processes otherwise.""")
+
+    _batch_nelements = 2**22
+    """Maximal number of elements in a batch of bootstrap maps that are
+    thresholded and labeled at once"""
 
     def __init__(self, **kwargs):
         # force disable auto-train: would make no sense
@@ -242,6 +259,9 @@ class GroupClusterThreshold(Learner):
         bcombos = [[random.sample(v, 1)[0] for v in chunk_samples.values()]
                    for i in xrange(self.params.n_bootstrap)]
         bcombos = np.array(bcombos, dtype=int)
+        # every bootstrap map is the mean of its drawn samples, i.e. a row of
+        # a sparse selection matrix multiplied with the samples
+        bmat = _get_bootstrap_matrix(bcombos, len(ds))
         #
         # Step 1: find the per-feature threshold that corresponds to some p
         # in the NULL
@@ -254,84 +274,52 @@ class GroupClusterThreshold(Learner):
                   % (self.params.n_blocks, segwidth))
         # Execution can be done in parallel as the estimation is independent
         # across features
-
-        def featuresegment_producer(ncols):
-            for segstart in xrange(0, ds.nfeatures, ncols):
-                # one average map for every stored bcombo
-                # this also slices the input data into feature subsets
-                # for the compute blocks
-                yield [np.mean(
-                       # get a view to a subset of the features
-                       # -- should be somewhat efficient as feature axis is
-                       # sliced
-                       ds_samples[sidx, segstart:segstart + ncols],
-                       axis=0)
-                       for sidx in bcombos]
-        if self.params.n_proc == 1:
-            # Serial execution
+        executor, own_executor = get_executor(self.params.executor,
+                                              self.params.n_proc)
+        try:
             thrmap = np.hstack(  # merge across compute blocks
-                [get_thresholding_map(d, self.params.feature_thresh_prob)
-                 # compute a partial threshold map for as many features
-                 # as fit into a compute block
-                 for d in featuresegment_producer(segwidth)])
-        else:
-            # Parallel execution
-            verbose_level_parallel = 50 \
-                if (__debug__ and 'GCTHR' in debug.active) else 0
-            # local import as only parallel execution needs this
-            from joblib import Parallel, delayed
-            # same code as above, just in parallel with joblib's Parallel
-            thrmap = np.hstack(
-                Parallel(n_jobs=self.params.n_proc,
-                         pre_dispatch=self.params.n_proc,
-                         verbose=verbose_level_parallel)(
-                             delayed(get_thresholding_map)
-                        (d, self.params.feature_thresh_prob)
-                             for d in featuresegment_producer(segwidth)))
-        # store for later thresholding of input data
-        self._thrmap = thrmap
-        #
-        # Step 2: threshold all NULL maps and build distribution of NULL cluster
-        #         sizes
-        #
-        cluster_sizes = Counter()
-        # recompute the bootstrap average maps to threshold them and determine
-        # cluster sizes
-        dsa = dict(mapper=ds.a.mapper) if 'mapper' in ds.a else {}
-        if __debug__:
-            debug('GCTHR', 'Estimating NULL distribution of cluster sizes')
-        # this step can be computed in parallel chunks to speeds things up
-        if self.params.n_proc == 1:
-            # Serial execution
-            for sidx in bcombos:
-                avgmap = np.mean(ds_samples[sidx], axis=0)[None]
-                # apply threshold
-                clustermap = avgmap > thrmap
-                # wrap into a throw-away dataset to get the reverse mapping right
-                bds = Dataset(clustermap, a=dsa)
-                # this function reverse-maps every sample one-by-one, hence no need
-                # to collect chunks of bootstrapped maps
-                cluster_sizes = get_cluster_sizes(bds, cluster_sizes)
-        else:
-            # Parallel execution
-            # same code as above, just restructured for joblib's Parallel
-            for jobres in Parallel(n_jobs=self.params.n_proc,
-                                   pre_dispatch=self.params.n_proc,
-                                   verbose=verbose_level_parallel)(
-                                       delayed(get_cluster_sizes)
-                                  (Dataset(np.mean(ds_samples[sidx],
-                                           axis=0)[None] > thrmap,
-                                           a=dsa))
-                                       for sidx in bcombos):
+                list(iter_results(
+                    executor,
+                    # compute a partial threshold map for as many features
+                    # as fit into a compute block
+                    ((_get_segment_thresholding_map,
+                      (ds_samples, bmat, segstart, segwidth,
+                       self.params.feature_thresh_prob), {})
+                     for segstart in xrange(0, ds.nfeatures, segwidth)))))
+            # store for later thresholding of input data
+            self._thrmap = thrmap
+            #
+            # Step 2: threshold all NULL maps and build distribution of NULL
+            #         cluster sizes
+            #
+            # neighboring features in the reverse-mapped space -- determined
+            # once instead of reverse-mapping every bootstrap map
+            mapper = ds.a.mapper if 'mapper' in ds.a else IdentityMapper()
+            edges = get_feature_adjacency(mapper, ds.nfeatures)
+            # recompute the bootstrap average maps in batches to threshold
+            # them and determine cluster sizes
+            batchsize = max(1, self._batch_nelements / ds.nfeatures)
+            if __debug__:
+                debug('GCTHR', 'Estimating NULL distribution of cluster sizes '
+                               'in batches of %i maps' % batchsize)
+            cluster_sizes = np.zeros(ds.nfeatures + 1, dtype=int)
+            # this step can be computed in parallel chunks to speeds things up
+            for jobres in iter_results(
+                    executor,
+                    ((_get_null_cluster_sizes,
+                      (ds_samples, bmat[rows[0]:rows[-1] + 1], thrmap, edges,
+                       batchsize), {})
+                     for rows in np.array_split(
+                         np.arange(len(bcombos)),
+                         min(len(bcombos), self.params.n_proc)))):
                 # aggregate
                 cluster_sizes += jobres
+        finally:
+            if own_executor:
+                executor.shutdown()
         # store cluster size histogram for later p-value evaluation
-        # use a sparse matrix for easy consumption (max dim is the number of
-        # features, i.e. biggest possible cluster)
-        scl = dok_matrix((1, ds.nfeatures + 1), dtype=int)
-        for s in cluster_sizes:
-            scl[0, s] = cluster_sizes[s]
-        self._null_cluster_sizes = scl
+        # (max dim is the number of features, i.e. biggest possible cluster)
+        self._null_cluster_sizes = cluster_sizes[None]
 
     def _call(self, ds):
         if len(ds) > 1:
@@ -390,7 +378,7 @@ class GroupClusterThreshold(Learner):
 
         # update cluster size histogram with the actual result to get a
         # proper lower bound for p-values
-        # this will make a copy, because the original matrix is int
+        # this will make a copy, because the original histogram is int
         cluster_probs_raw = _transform_to_pvals(
             area, self._null_cluster_sizes.astype('float'))
 
@@ -462,6 +450,122 @@ def get_thresholding_map(data, p=0.001):
     return data[thridx, np.arange(data.shape[1])]
 
 
+def _get_bootstrap_matrix(bcombos, nsamples):
+    """Sparse matrix that yields bootstrapped average maps when applied to samples
+
+    Parameters
+    ----------
+    bcombos : array
+      (n_bootstrap x nchunks) array with the indices of the samples drawn
+      for each bootstrap map.
+    nsamples : int
+      Total number of samples.
+    """
+    nmaps, nchunks = bcombos.shape
+    return csr_matrix(
+        (np.repeat(1. / nchunks, bcombos.size),
+         bcombos.ravel(),
+         np.arange(0, bcombos.size + 1, nchunks)),
+        shape=(nmaps, nsamples))
+
+
+def _get_segment_thresholding_map(samples, bmat, segstart, ncols, p):
+    """Thresholding map for a segment of features of bootstrapped average maps
+    """
+    # one average map for every bootstrap sample, computed for a slice of the
+    # features that make up this compute block
+    return get_thresholding_map(
+        bmat.dot(samples[:, segstart:segstart + ncols]), p)
+
+
+def _get_null_cluster_sizes(samples, bmat, thrmap, edges, batchsize):
+    """Cluster size histogram for thresholded bootstrapped average maps"""
+    cluster_sizes = np.zeros(samples.shape[1] + 1, dtype=int)
+    for start in xrange(0, bmat.shape[0], batchsize):
+        avgmaps = bmat[start:start + batchsize].dot(samples)
+        cluster_sizes += get_batch_cluster_sizes(avgmaps > thrmap, edges)
+    return cluster_sizes
+
+
+def get_feature_adjacency(mapper, nfeatures):
+    """Pairs of features that are direct neighbors in the mapper's input space
+
+    Features are considered neighbors if they are adjacent along any axis of
+    the reverse-mapped space, matching the default connectivity used by
+    ``scipy.ndimage.measurements.label``.
+
+    Parameters
+    ----------
+    mapper : Mapper
+      Mapper to reverse-map a single sample into the space where clusters are
+      formed.
+    nfeatures : int
+      Number of features in a sample.
+
+    Returns
+    -------
+    tuple
+      Two arrays with the indices of the first and second feature of each
+      pair.
+    """
+    # reverse-map feature ids (offset by one to leave zero for the background)
+    fids = _verified_reverse1(mapper, np.arange(1, nfeatures + 1))
+    if np.any(np.sort(fids[fids > 0]) != np.arange(1, nfeatures + 1)):
+        raise ValueError("cannot determine feature neighbors: mapper does not "
+                         "reverse-map features to unique locations")
+    src, dst = [], []
+    for axis in xrange(fids.ndim):
+        lower = fids[(slice(None),) * axis + (slice(None, -1),)].ravel()
+        upper = fids[(slice(None),) * axis + (slice(1, None),)].ravel()
+        neighbors = np.logical_and(lower > 0, upper > 0)
+        src.append(lower[neighbors] - 1)
+        dst.append(upper[neighbors] - 1)
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def get_batch_cluster_sizes(data, edges):
+    """Histogram of cluster sizes across all samples of a boolean array
+
+    Parameters
+    ----------
+    data : 2D-array
+      Boolean array with one map per row.
+    edges : tuple
+      Pairs of neighboring features, as returned by `get_feature_adjacency`.
+
+    Returns
+    -------
+    array
+      Number of clusters (across all maps) for each cluster size, starting
+      with size zero. Maps without any non-zero feature are counted as one
+      cluster of size zero.
+    """
+    data = np.asanyarray(data, dtype=bool)
+    nmaps, nfeatures = data.shape
+    src, dst = edges
+    # each non-zero feature in each map is a node in a graph...
+    nodes = data.ravel()
+    nnodes = np.sum(nodes)
+    node_ids = np.cumsum(nodes) - 1
+    # ... with edges between neighbors that are both non-zero
+    mapidx, eidx = np.nonzero(np.logical_and(data[:, src], data[:, dst]))
+    offset = mapidx * nfeatures
+    graph = coo_matrix(
+        (np.ones(len(eidx), dtype=bool),
+         (node_ids[offset + src[eidx]], node_ids[offset + dst[eidx]])),
+        shape=(nnodes, nnodes))
+    if nnodes:
+        # a cluster is a connected component in this graph
+        labels = connected_components(graph, directed=False)[1]
+        sizes = np.bincount(labels)
+    else:
+        sizes = np.array([], dtype=int)
+    cluster_sizes = np.bincount(sizes, minlength=nfeatures + 1)
+    # empty maps
+    cluster_sizes[0] = np.sum(~data.any(axis=1))
+    return cluster_sizes
+
+
 def _get_map_cluster_sizes(map_):
     labels, num = measurements.label(map_)
     area = measurements.sum(map_, labels, index=np.arange(1, num + 1))
@@ -22,6 +22,7 @@ from mvpa2.algorithms.hyperalignment import Hyperalignment
 from mvpa2.mappers.staticprojection import StaticProjectionMapper
 from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
 from mvpa2.base.progress import ProgressBar
+from mvpa2.base.parallel import get_executor, get_nproc, iter_results
 from mvpa2.base import externals, warning
 from mvpa2.support import copy
 from mvpa2.featsel.helpers import FixedNElementTailSelector
@@ -247,6 +248,12 @@ class SearchlightHyperalignment(ClassWithCollections):
         constraints=EnsureInt() & EnsureRange(min=1) | EnsureNone(),
         doc="""Number of cores to use.""")
 
+    executor = Parameter(
+        None,
+        doc="""Backend to use for parallel computation: 'process', 'thread',
+            'joblib', 'serial', or an instance of a `concurrent.futures`-style
+            executor. See Searchlight documentation.""")
+
     nblocks = Parameter(
         None,
         constraints=EnsureInt() & EnsureRange(min=1) | EnsureNone(),
@@ -341,13 +348,9 @@ class SearchlightHyperalignment(ClassWithCollections):
         self.projections = None
         # This option makes the roi_seed in each SL to be selected during feature selection
         self.force_roi_seed = True
-        if self.params.nproc is not None and self.params.nproc > 1 \
-                and not externals.exists('pprocess'):
-            raise RuntimeError("The 'pprocess' module is required for "
-                               "multiprocess searchlights. Please either "
-                               "install python-pprocess, or reduce `nproc` "
-                               "to 1 (got nproc=%i) or set to default None"
-                               % self.params.nproc)
+        if isinstance(self.params.executor, basestring):
+            # verify early that the backend is known and usable
+            get_executor(self.params.executor, 1)[0].shutdown()
         if not externals.exists('scipy'):
             raise RuntimeError("The 'scipy' module is required for "
                                "searchlight hyperalignment.")
@@ -543,15 +546,10 @@ class SearchlightHyperalignment(ClassWithCollections):
 
         # Performing SL processing manually
         _shpaldebug("Setting up for searchlights")
-        if params.nproc is None and externals.exists('pprocess'):
-            import pprocess
-            try:
-                params.nproc = pprocess.get_number_of_cores() or 1
-            except AttributeError:
-                warning("pprocess version %s has no API to figure out maximal "
-                        "number of cores. Using 1"
-                        % externals.versions['pprocess'])
-                params.nproc = 1
+        if params.nproc is None:
+            params.nproc = get_nproc(
+                getattr(params.executor, 'max_workers',
+                        getattr(params.executor, '_max_workers', None)))
 
         # XXX I think this class should already accept a single dataset only.
         # It should have a ``space`` setting that names a sample attribute that
@@ -602,32 +600,34 @@ class SearchlightHyperalignment(ClassWithCollections):
             for isub in range(self.ndatasets)]
 
         # compute
-        if params.nproc is not None and params.nproc > 1:
+        if params.nproc > 1 or params.executor is not None:
             # split all target ROIs centers into `nproc` equally sized blocks
             nproc_needed = min(len(roi_ids), params.nproc)
             params.nblocks = nproc_needed \
                 if params.nblocks is None else params.nblocks
             params.nblocks = min(len(roi_ids), params.nblocks)
             node_blocks = np.array_split(roi_ids, params.nblocks)
-            # the next block sets up the infrastructure for parallel computing
-            # this can easily be changed into a ParallelPython loop, if we
-            # decide to have a PP job server in PyMVPA
-            import pprocess
-            p_results = pprocess.Map(limit=nproc_needed)
+            executor, own_executor = get_executor(params.executor,
+                                                  nproc_needed)
             if __debug__:
-                debug('SLC', "Starting off %s child processes for nblocks=%i"
-                      % (nproc_needed, params.nblocks))
-            compute = p_results.manage(
-                        pprocess.MakeParallel(self._proc_block))
-            seed = mvpa2.get_random_seed()
-            for iblock, block in enumerate(node_blocks):
-                # should we maybe deepcopy the measure to have a unique and
-                # independent one per process?
-                compute(block, datasets, copy.copy(hmeasure), queryengines,
-                        seed=seed, iblock=iblock)
+                debug('SLC', "Starting off %s workers of %s for nblocks=%i"
+                      % (nproc_needed, executor.__class__.__name__,
+                         params.nblocks))
+            # threads share the RNG, so it must not be reseeded from them
+            isolated = getattr(executor, 'isolated', False)
+            copy_measure = copy.copy if isolated else copy.deepcopy
+            seed = mvpa2.get_random_seed() if isolated else None
+            p_results = iter_results(
+                executor,
+                ((self._proc_block,
+                  (block, datasets, copy_measure(hmeasure), queryengines),
+                  dict(seed=seed, iblock=iblock))
+                 for iblock, block in enumerate(node_blocks)),
+                limit=nproc_needed)
         else:
             # otherwise collect the results in an 1-item list
             _shpaldebug('Using 1 process to compute mappers.')
+            executor = own_executor = None
             if params.nblocks is None:
                 params.nblocks = 1
             params.nblocks = min(len(roi_ids), params.nblocks)
@@ -635,8 +635,12 @@ class SearchlightHyperalignment(ClassWithCollections):
             p_results = [self._proc_block(block, datasets, hmeasure, queryengines)
                          for block in node_blocks]
         results_ds = self.__handle_all_results(p_results)
-        # Dummy iterator for, you know, iteration
-        list(results_ds)
+        try:
+            # Dummy iterator for, you know, iteration
+            list(results_ds)
+        finally:
+            if own_executor:
+                executor.shutdown()
 
         _shpaldebug('Wrapping projection matrices into StaticProjectionMappers')
         self.projections = [
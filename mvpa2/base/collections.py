@@ -225,6 +225,36 @@ class SequenceCollectable(Collectable):
 
     def _reset_unique(self):
         self._unique_values = None
+        self._factorization = None
+        self._group_indices = None
+
+
+    def _share_unique(self, other, key=None):
+        """Take over cached unique values and factorization of another one
+
+        Parameters
+        ----------
+        other : SequenceCollectable
+          Collectable the value of this one was derived from.
+        key : slicing argument or None
+          If None, both values are identical. Otherwise this value has to be
+          ``other.value[key]``, and the factorization (if present) is sliced
+          accordingly.
+        """
+        if key is None:
+            self._unique_values = other._unique_values
+            self._factorization = other._factorization
+            self._group_indices = other._group_indices
+        elif other._factorization is not None:
+            uniques, codes = other._factorization
+            codes = codes[key]
+            # some values might not be present anymore
+            present = np.bincount(codes, minlength=len(uniques)) > 0
+            if not np.all(present):
+                codes = (np.cumsum(present) - 1)[codes]
+                uniques = uniques[present]
+            self._unique_values = uniques
+            self._factorization = (uniques, codes)
 
 
     @property
@@ -256,6 +286,55 @@ class SequenceCollectable(Collectable):
         return self._unique_values
 
 
+    @property
+    def factorized(self):
+        """Return unique values and the position of each value among them
+
+        The factorization is computed once, and shared with shallow copies
+        and slices of this collectable. Only one-dimensional sequences are
+        supported.
+
+        Returns
+        -------
+        tuple
+          Unique values (same as ``unique``) and an integer array with the
+          index of each value in the unique values.
+        """
+        if self.value is None:
+            return None
+        if self._factorization is None:
+            value = self.value
+            if np.ndim(value) != 1:
+                raise ValueError("Only one-dimensional sequences can be "
+                                 "factorized (got %i-dimensional '%s')."
+                                 % (np.ndim(value), str(self.name)))
+            try:
+                uniques, codes = np.unique(value, return_inverse=True)
+                self._unique_values = uniques
+            except TypeError:
+                # same as for unique -- go through a lookup
+                uniques = self.unique
+                positions = dict([(u, i) for i, u in enumerate(uniques)])
+                codes = np.array([positions[v] for v in value], dtype=int)
+            self._factorization = (uniques, codes)
+        return self._factorization
+
+
+    @property
+    def groups(self):
+        """Return indices of the elements for each unique value
+
+        List of (sorted) index arrays -- one per unique value in the order
+        of ``unique``.
+        """
+        if self.value is None:
+            return None
+        if self._group_indices is None:
+            uniques, codes = self.factorized
+            self._group_indices = _get_group_indices(codes, len(uniques))
+        return self._group_indices
+
+
     def set_length_check(self, value):
         """Set a target length of the value in this collectable.
 
@@ -281,6 +360,8 @@ class ArrayCollectable(SequenceCollectable):
                                 length=self._target_length)
         # just get a view of the old data!
         copied.value = self.value.view()
+        # same data -- same unique values
+        copied._share_unique(self)
         return copied
 
 
@@ -317,6 +398,18 @@ class DatasetAttribute(ArrayCollectable):
 
 
 
+def _get_group_indices(codes, ngroups):
+    """Sorted indices of the elements of each group given integer group codes
+    """
+    if not ngroups:
+        return []
+    # stable sort keeps indices within each group in ascending order
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.cumsum(np.bincount(codes, minlength=ngroups))[:-1]
+    return np.split(order, bounds)
+
+
+
 class Collection(dict):
     """Container of some Collectables.
     """
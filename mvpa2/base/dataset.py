@@ -404,95 +404,17 @@ class AttrDataset(object):
     def __getitem__(self, args):
         """
         """
-        # uniformize for checks below; it is not a tuple if just single slicing
-        # spec is passed
-        if not isinstance(args, tuple):
-            args = (args,)
-
-        if len(args) > 2:
-            raise ValueError("Too many arguments (%i). At most there can be "
-                             "two arguments, one for samples selection and one "
-                             "for features selection" % len(args))
-
-        # simplify things below and always have samples and feature slicing
-        if len(args) == 1:
-            args = [args[0], slice(None)]
-        else:
-            args = [a for a in args]
-
-        samples = None
-
-        # get the intended subset of the samples array
-        #
-        # need to deal with some special cases to ensure proper behavior
-        #
-        # ints need to become lists to prevent silent dimensionality changes
-        # of the arrays when slicing
-        for i, a in enumerate(args):
-            if isinstance(a, int):
-                args[i] = [a]
-
-        # for simultaneous slicing of numpy arrays we should
-        # distinguish the case when one of the args is a slice, so no
-        # ix_ is needed
+        args = _get_slicing_args(args)
         if __debug__:
             debug('DS_', "Selecting feature/samples of %s" % str(self.samples.shape))
-        if isinstance(self.samples, np.ndarray):
-            if np.any([isinstance(a, slice) for a in args]):
-                samples = self.samples[args[0], args[1]]
-            else:
-                # works even with bool masks (although without
-                # assurance/checking if mask is of actual length as
-                # needed, so would work with bogus shorter
-                # masks). TODO check in __debug__? or may be just do
-                # enforcing of proper dimensions and order manually?
-                samples = self.samples[np.ix_(*args)]
-        else:
-            # in all other cases we have to do the selection sequentially
-            #
-            # samples subset: only alter if subset is requested
-            samples = self.samples[args[0]]
-            # features subset
-            if not args[1] is slice(None):
-                samples = samples[:, args[1]]
+        samples = _slice_samples(self.samples, args)
         if __debug__:
             debug('DS_', "Selected feature/samples %s" % str(self.samples.shape))
         # and now for the attributes -- we want to maintain the type of the
         # collections
-        sa = self.sa.__class__(length=samples.shape[0])
-        fa = self.fa.__class__(length=samples.shape[1])
-        a = self.a.__class__()
-
-        # per-sample attributes; always needs to run even if slice(None), since
-        # we need fresh SamplesAttributes even if they share the data
-        for attr in self.sa.values():
-            # preserve attribute type
-            newattr = attr.__class__(doc=attr.__doc__)
-            # slice
-            newattr.value = attr.value[args[0]]
-            # assign to target collection
-            sa[attr.name] = newattr
-
-        # per-feature attributes; always needs to run even if slice(None),
-        # since we need fresh SamplesAttributes even if they share the data
-        for attr in self.fa.values():
-            # preserve attribute type
-            newattr = attr.__class__(doc=attr.__doc__)
-            # slice
-            newattr.value = attr.value[args[1]]
-            # assign to target collection
-            fa[attr.name] = newattr
-
-        # and finally dataset attributes: this time copying
-        for attr in self.a.values():
-            # preserve attribute type
-            newattr = attr.__class__(name=attr.name, doc=attr.__doc__)
-            # do a shallow copy here
-            # XXX every DatasetAttribute should have meaningful __copy__ if
-            # necessary -- most likely all mappers need to have one
-            newattr.value = copy.copy(attr.value)
-            # assign to target collection
-            a[attr.name] = newattr
+        sa = _slice_attributes(self.sa, args[0], samples.shape[0])
+        fa = _slice_attributes(self.fa, args[1], samples.shape[1])
+        a = _copy_dataset_attributes(self.a)
 
         # and after a long way instantiate the new dataset of the same type
         return self.__class__(samples, sa=sa, fa=fa, a=a)
@@ -542,7 +464,7 @@ class AttrDataset(object):
         return self.shape[0]
 
     @classmethod
-    def from_hdf5(cls, source, name=None):
+    def from_hdf5(cls, source, name=None, mmap_mode=None):
         """Load a Dataset from HDF5 file
 
         Parameters
@@ -553,6 +475,10 @@ class AttrDataset(object):
           If file contains multiple entries at the 1st level, if
           provided, `name` specifies the group to be loaded as the
           AttrDataset.
+        mmap_mode : {None, 'r', 'r+', 'c'}, optional
+          If not None, samples (and attributes) that have been stored
+          uncompressed are memory-mapped from the file instead of being
+          loaded into memory (see `mvpa2.base.hdf5.hdf2obj`).
 
         Returns
         -------
@@ -586,7 +512,7 @@ class AttrDataset(object):
 
             # access the group that should contain the dataset
             dsgrp = hdf[name]
-            res = hdf2obj(dsgrp)
+            res = hdf2obj(dsgrp, mmap_mode=mmap_mode)
             if not isinstance(res, AttrDataset):
                 # TODO: unittest before committing
                 raise ValueError("%r in %s contains %s not a dataset.  "
@@ -594,7 +520,7 @@ class AttrDataset(object):
                                  % (name, source, type(res), hdf.keys()))
         else:
             # just consider the whole file
-            res = hdf2obj(hdf)
+            res = hdf2obj(hdf, mmap_mode=mmap_mode)
             if not isinstance(res, AttrDataset):
                 # TODO: unittest before committing
                 raise ValueError("Failed to load a dataset from %s.  "
@@ -678,6 +604,91 @@ class AttrDataset(object):
     shape = property(fget=lambda self: self.samples.shape)
 
 
+def _get_slicing_args(args):
+    """Uniformize a selection into a [samples, features] list of selectors"""
+    # uniformize for checks below; it is not a tuple if just single slicing
+    # spec is passed
+    if not isinstance(args, tuple):
+        args = (args,)
+
+    if len(args) > 2:
+        raise ValueError("Too many arguments (%i). At most there can be "
+                         "two arguments, one for samples selection and one "
+                         "for features selection" % len(args))
+
+    # simplify things below and always have samples and feature slicing
+    if len(args) == 1:
+        args = [args[0], slice(None)]
+    else:
+        args = [a for a in args]
+
+    # need to deal with some special cases to ensure proper behavior
+    #
+    # ints need to become lists to prevent silent dimensionality changes
+    # of the arrays when slicing
+    for i, a in enumerate(args):
+        if isinstance(a, int):
+            args[i] = [a]
+    return args
+
+
+def _slice_samples(samples, args):
+    """Select the intended subset of a samples array"""
+    # for simultaneous slicing of numpy arrays we should
+    # distinguish the case when one of the args is a slice, so no
+    # ix_ is needed
+    if isinstance(samples, np.ndarray):
+        if np.any([isinstance(a, slice) for a in args]):
+            return samples[args[0], args[1]]
+        else:
+            # works even with bool masks (although without
+            # assurance/checking if mask is of actual length as
+            # needed, so would work with bogus shorter
+            # masks). TODO check in __debug__? or may be just do
+            # enforcing of proper dimensions and order manually?
+            return samples[np.ix_(*args)]
+    # in all other cases we have to do the selection sequentially
+    #
+    # samples subset: only alter if subset is requested
+    samples = samples[args[0]]
+    # features subset
+    if not args[1] is slice(None):
+        samples = samples[:, args[1]]
+    return samples
+
+
+def _slice_attributes(col, arg, length):
+    """Fresh collection of the same type with all attributes sliced"""
+    out = col.__class__(length=length)
+    # always needs to run even if slice(None), since we need fresh
+    # attributes even if they share the data
+    for attr in col.values():
+        # preserve attribute type
+        newattr = attr.__class__(doc=attr.__doc__)
+        # slice
+        newattr.value = attr.value[arg]
+        if hasattr(newattr, '_share_unique'):
+            newattr._share_unique(attr, arg)
+        # assign to target collection
+        out[attr.name] = newattr
+    return out
+
+
+def _copy_dataset_attributes(col):
+    """Fresh collection with shallow copies of all dataset attributes"""
+    out = col.__class__()
+    for attr in col.values():
+        # preserve attribute type
+        newattr = attr.__class__(name=attr.name, doc=attr.__doc__)
+        # do a shallow copy here
+        # XXX every DatasetAttribute should have meaningful __copy__ if
+        # necessary -- most likely all mappers need to have one
+        newattr.value = copy.copy(attr.value)
+        # assign to target collection
+        out[attr.name] = newattr
+    return out
+
+
 def datasetmethod(func):
     """Decorator to easily bind functions to an AttrDataset class
     """
@@ -737,24 +748,9 @@ def vstack(datasets, a=None, fa='drop_nonunique'):
     if not is_datasetlike(datasets[0]):
         return AttrDataset(np.vstack(datasets))
 
-    if __debug__:
-        target = sorted(datasets[0].sa.keys())
-        if not np.all([sorted(ds.sa.keys()) == target for ds in datasets]):
-            raise ValueError("Sample attributes collections of to be stacked "
-                             "datasets have varying attributes.")
-    # will puke if not equal number of features
-    stacked_samp = np.concatenate([ds.samples for ds in datasets], axis=0)
-
-    stacked_sa = {}
-    for attr in datasets[0].sa:
-        stacked_sa[attr] = np.concatenate(
-            [ds.sa[attr].value for ds in datasets], axis=0)
-    # create the dataset
-    merged = datasets[0].__class__(stacked_samp, sa=stacked_sa)
-
-    _stack_add_equal_attributes(merged, datasets, fa, 'fa')
-    _stack_add_equal_dataset_attributes(merged, datasets, a)
-    return merged
+    stacker = DatasetStacker(axis=0, a=a, strategy=fa)
+    stacker.extend(datasets)
+    return stacker.get()
 
 
 def hstack(datasets, a=None, sa='drop_nonunique'):
@@ -808,63 +804,239 @@ def hstack(datasets, a=None, sa='drop_nonunique'):
         # turned into a dict (would run along samples-axis)
         return AttrDataset(np.atleast_2d(np.hstack(datasets)))
 
-    if __debug__:
-        target = sorted(datasets[0].fa.keys())
-        if not np.all([sorted(ds.fa.keys()) == target for ds in datasets]):
-            raise ValueError("Feature attributes collections of to be stacked "
-                             "datasets have varying attributes.")
-    # will puke if not equal number of samples
-    stacked_samp = np.concatenate([ds.samples for ds in datasets], axis=1)
-
-    stacked_fa = {}
-    for attr in datasets[0].fa:
-        stacked_fa[attr] = np.concatenate(
-            [ds.fa[attr].value for ds in datasets], axis=0)
-    # create the dataset
-    merged = datasets[0].__class__(stacked_samp, fa=stacked_fa)
+    stacker = DatasetStacker(axis=1, a=a, strategy=sa)
+    stacker.extend(datasets)
+    return stacker.get()
 
-    _stack_add_equal_attributes(merged, datasets, sa, 'sa')
-    _stack_add_equal_dataset_attributes(merged, datasets, a)
 
-    return merged
+class DatasetStacker(object):
+    """Stacks datasets along samples or features, one dataset at a time.
 
+    This is the engine behind `vstack()` and `hstack()`. Samples, and the
+    attributes along the stacking axis, are written into output arrays that
+    are allocated only once if all datasets are known in advance
+    (`extend()`), or that grow geometrically if datasets are added one by
+    one (`append()`), e.g. by a producer that yields results incrementally.
+    Attributes along the other axis are merged in a single pass, while
+    datasets are added.
 
-def _stack_add_equal_attributes(merged, datasets, strategy, colname):
-    """Helper function for vstack and hstack to perform update of the
-    corresponding collection according to the strategy
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from mvpa2.datasets import Dataset
+    >>> stacker = DatasetStacker(axis=0)
+    >>> for i in range(3):
+    ...     stacker.append(Dataset(np.ones((2, 4)) * i, sa={'targets': [i, i]}))
+    >>> stacker.get().shape
+    (6, 4)
     """
-    mergedcol = getattr(merged, colname)
 
-    if strategy == 'update':
-        for ds in datasets:
-            mergedcol.update(getattr(ds, colname))
-
-    elif strategy == 'drop_nonunique':
-        # discover those attributes which differ
-        drop = set()
-        ds0 = datasets[0]
-        ds0col = getattr(ds0, colname)
-        for ds in datasets[1:]:
-            dscol = getattr(ds, colname)
-            for attr, v in dscol.iteritems():
-                if ((attr not in ds0col) or
-                        np.any(ds0col[attr].value != v.value)):
-                    drop.add(attr)
-            # and ds0 might have some attributes which others don't
-            for attr in ds0col:
-                if attr not in dscol:
-                    drop.add(attr)
-
-        # now update but only those which to not drop
+    def __init__(self, axis=0, a=None, strategy='drop_nonunique'):
+        """
+        Parameters
+        ----------
+        axis : {0, 1}
+          Stack along samples (0, as `vstack()` does) or along features (1,
+          as `hstack()` does).
+        a : {'unique','drop_nonunique','uniques','all'} or True or False or None
+          Indicates which dataset attributes are stored in the stacked
+          dataset. See `vstack()` for details.
+        strategy : {'update', 'drop_nonunique'}
+          How attributes along the other axis (feature attributes when
+          stacking samples, and vice versa) are merged. If 'update', the
+          attributes of later datasets replace earlier ones. If
+          'drop_nonunique', attributes that differ in any dataset are
+          dropped.
+        """
+        if not axis in (0, 1):
+            raise ValueError("Datasets can only be stacked along samples (0) "
+                             "or features (1), got axis=%r" % (axis,))
+        self._colnames = ('sa', 'fa') if axis == 0 else ('fa', 'sa')
+        if not strategy in ('update', 'drop_nonunique'):
+            raise ValueError("Unknown strategy %s on how to deal with %s "
+                             "collection" % (strategy, self._colnames[1]))
+        self._axis = axis
+        self._a = a
+        self._strategy = strategy
+        self.reset()
+
+    def reset(self):
+        """Remove all datasets from the stack"""
+        self._cls = None
+        self._samples = None
+        # stacked attributes: name -> _StackBuffer
+        self._stacked = None
+        # merged attributes of the other axis: name -> collectable
+        self._merged = None
+        self._reference = None
+        self._drop = set()
+        # dataset attributes of all datasets, in case they are merged
+        self._acols = []
+        self._ndatasets = 0
+
+    def __len__(self):
+        return self._ndatasets
+
+    def _check_attributes(self, col):
+        if sorted(col.keys()) != sorted(self._stacked.keys()):
+            raise ValueError("%s attributes collections of to be stacked "
+                             "datasets have varying attributes."
+                             % ('Sample', 'Feature')[self._axis])
+
+    def _start(self, ds):
+        self._cls = ds.__class__
+        self._samples = _StackBuffer(self._axis)
+        self._stacked = dict([(k, _StackBuffer(0))
+                              for k in getattr(ds, self._colnames[0]).keys()])
+
+    def append(self, ds):
+        """Add a dataset to the stack"""
+        col = getattr(ds, self._colnames[0])
+        if self._cls is None:
+            self._start(ds)
+        elif __debug__:
+            self._check_attributes(col)
+        # will puke if the other dimension doesn't match
+        self._samples.append(ds.samples)
+        for k, buf in self._stacked.iteritems():
+            buf.append(col[k].value)
+
+        ocol = getattr(ds, self._colnames[1])
+        if self._merged is None:
+            self._merged = dict(ocol)
+            self._reference = ocol
+        else:
+            if self._strategy == 'drop_nonunique':
+                # discover those attributes which differ
+                reference = self._reference
+                for attr, v in ocol.iteritems():
+                    if ((attr not in reference) or
+                            np.any(reference[attr].value != v.value)):
+                        self._drop.add(attr)
+                # and the first dataset might have some attributes which
+                # others don't
+                for attr in reference:
+                    if attr not in ocol:
+                        self._drop.add(attr)
+            # the last dataset provides the values
+            self._merged.update(ocol)
+
+        if not (self._a is None or self._a is False):
+            self._acols.append(ds.a)
+        self._ndatasets += 1
+
+    def extend(self, datasets):
+        """Add a sequence (e.g. a list) of datasets to the stack
+
+        Output arrays are allocated for all datasets at once.
+        """
+        if not len(datasets):
+            return
+        if self._cls is None:
+            self._start(datasets[0])
+        colname = self._colnames[0]
+        if __debug__:
+            for ds in datasets:
+                self._check_attributes(getattr(ds, colname))
+        self._samples.reserve([ds.samples for ds in datasets])
+        for k, buf in self._stacked.iteritems():
+            buf.reserve([getattr(ds, colname)[k].value for ds in datasets])
         for ds in datasets:
-            mergedcol.update(
-                {attr: v for attr, v in getattr(ds, colname).items()
-                 if attr not in drop}
-            )
+            self.append(ds)
 
-    else:
-        raise ValueError("Unknown strategy %s on how to deal with %s collection"
-                         % (strategy, colname))
+    def get(self):
+        """Return the stacked dataset
+
+        More datasets can be added afterwards, without affecting the
+        returned dataset.
+        """
+        if self._cls is None:
+            raise ValueError('concatenation of zero-length sequences is '
+                             'impossible')
+        stacked = dict([(k, buf.get()) for k, buf in self._stacked.iteritems()])
+        merged = self._cls(self._samples.get(), **{self._colnames[0]: stacked})
+        getattr(merged, self._colnames[1]).update(
+            dict([(attr, v) for attr, v in self._merged.iteritems()
+                  if attr not in self._drop]))
+        _stack_add_equal_dataset_attributes(merged, self._acols, self._a)
+        return merged
+
+
+class _StackBuffer(object):
+    """Array growing along one axis, with spare room for appending arrays"""
+
+    def __init__(self, axis=0):
+        self._axis = axis
+        self._data = None
+        # number of elements along the axis that are filled
+        self._length = 0
+
+    def _get_index(self, start, stop):
+        index = [slice(None)] * self._data.ndim
+        index[self._axis] = slice(start, stop)
+        return tuple(index)
+
+    def _resize(self, capacity, dtype):
+        shape = list(self._data.shape)
+        shape[self._axis] = capacity
+        data = np.empty(shape, dtype=dtype)
+        index = self._get_index(0, self._length)
+        data[index] = self._data[index]
+        self._data = data
+
+    def _check_shape(self, arr):
+        shape = list(arr.shape)
+        ref_shape = list(self._data.shape)
+        if len(shape) != len(ref_shape):
+            raise ValueError("Cannot stack arrays with different number of "
+                             "dimensions (%s and %s)"
+                             % (self._data.shape, arr.shape))
+        del shape[self._axis], ref_shape[self._axis]
+        if shape != ref_shape:
+            raise ValueError("Array dimensions except for the stacking axis "
+                             "must match (got %s and %s)"
+                             % (self._data.shape, arr.shape))
+
+    def reserve(self, arrays):
+        """Make room for stacking the given arrays"""
+        if not len(arrays):
+            return
+        arrays = [np.asanyarray(arr) for arr in arrays]
+        dtype = reduce(np.promote_types, [arr.dtype for arr in arrays])
+        capacity = self._length + sum([arr.shape[self._axis] for arr in arrays])
+        if self._data is None:
+            # shaped like the first array
+            shape = list(arrays[0].shape)
+            shape[self._axis] = capacity
+            self._data = np.empty(shape, dtype=dtype)
+            return
+        dtype = np.promote_types(self._data.dtype, dtype)
+        if capacity > self._data.shape[self._axis] \
+                or dtype != self._data.dtype:
+            self._resize(max(capacity, self._data.shape[self._axis]), dtype)
+
+    def append(self, arr):
+        """Stack an array"""
+        arr = np.asanyarray(arr)
+        if self._data is None:
+            self._data = np.empty(arr.shape, dtype=arr.dtype)
+        else:
+            self._check_shape(arr)
+        length = self._length + arr.shape[self._axis]
+        capacity = self._data.shape[self._axis]
+        dtype = np.promote_types(self._data.dtype, arr.dtype)
+        if length > capacity or dtype != self._data.dtype:
+            # grow geometrically for amortized constant cost of appending
+            self._resize(max(length, 2 * capacity), dtype)
+        self._data[self._get_index(self._length, length)] = arr
+        self._length = length
+
+    def get(self):
+        """Return the stacked array"""
+        if self._length == self._data.shape[self._axis]:
+            # any further append will reallocate
+            return self._data
+        return self._data[self._get_index(0, self._length)].copy()
 
 
 def all_equal(x, y):
@@ -932,7 +1104,7 @@ def all_equal(x, y):
     return all(all_equal(xx, yy) for (xx, yy) in zip(x, y))
 
 
-def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
+def _stack_add_equal_dataset_attributes(merged_dataset, collections, a=None):
     """Helper function for vstack and hstack to find dataset
     attributes common to a set of datasets, and at them to the output.
     Note:by default this function does nothing because testing for equality
@@ -943,9 +1115,9 @@ def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
     ----------
     merged_dataset: Dataset
         the output dataset to which attributes are added
-    datasets: tuple of Dataset
-        Sequence of datasets to be stacked. Only attributes present
-        in all datasets and with identical values are put in
+    collections: sequence of DatasetAttributesCollection
+        Dataset attributes of the datasets to be stacked. Only attributes
+        present in all datasets and with identical values are put in
         merged_dataset
     a: {'unique','drop_nonunique','uniques','all'} or True or False or None (default: None).
         Indicates which dataset attributes from datasets are stored
@@ -967,15 +1139,15 @@ def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
     elif a is True:
         a = 'drop_nonunique'
 
-    if not datasets:
+    if not collections:
         # empty - so nothing to do
         return
 
     if type(a) is int:
-        base_dataset = datasets[a]
+        base_col = collections[a]
 
-        for key in base_dataset.a.keys():
-            merged_dataset.a[key] = base_dataset.a[key].value
+        for key in base_col.keys():
+            merged_dataset.a[key] = base_col[key].value
 
         return
 
@@ -985,7 +1157,7 @@ def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
                          "%r" % allowed_values)
 
     # consider all keys that are present in at least one dataset
-    all_keys = set.union(*[set(dataset.a.keys()) for dataset in datasets])
+    all_keys = set.union(*[set(col.keys()) for col in collections])
 
     def _contains(xs, y, comparator=all_equal):
         for x in xs:
@@ -996,13 +1168,13 @@ def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
     for key in all_keys:
         add_key = True
         values = []
-        for i, dataset in enumerate(datasets):
-            if not key in dataset.a:
+        for col in collections:
+            if not key in col:
                 if a == 'all':
                     values.append(None)
                 continue
 
-            value = dataset.a[key].value
+            value = col[key].value
 
             if a in ('drop_nonunique', 'unique'):
                 if not values:
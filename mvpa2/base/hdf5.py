@@ -49,6 +49,19 @@ from mvpa2.misc.support import builtins_mod
 if __debug__:
     from mvpa2.base import debug
 
+# key of the memory-mapping mode in the memo of hdf2obj()
+_MMAP_MODE = '__mmap_mode__'
+
+# key of the packing flag in the memo of obj2hdf()
+_PACKED = '__packed__'
+
+# larger arrays keep their own HDF5 dataset instead of being packed
+_PACKED_MAX_NELEMENTS = 2 ** 16
+
+# create_dataset() arguments that require chunked storage
+_CHUNKED_STORAGE_KWARGS = ('chunks', 'compression', 'compression_opts',
+                           'shuffle', 'fletcher32', 'scaleoffset')
+
 # don't ask -- makes history re-education a breeze
 universal_classname_remapper = {
     ('mvpa2.mappers.base', 'FeatureSliceMapper'): ('mvpa2.featsel.base',
@@ -63,7 +76,7 @@ class HDF5ConversionError(Exception):
     pass
 
 
-def hdf2obj(hdf, memo=None):
+def hdf2obj(hdf, memo=None, mmap_mode=None):
     """Convert an HDF5 group definition into an object instance.
 
     Obviously, this function assumes the conventions implemented in the
@@ -77,6 +90,11 @@ def hdf2obj(hdf, memo=None):
     memo : dict
       Dictionary tracking reconstructed objects to prevent recursions (analog to
       deepcopy).
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+      If not None, arrays that are stored contiguously and uncompressed are
+      not read into memory, but memory-mapped from the file with the given
+      mode (see `numpy.memmap`). Other arrays are loaded as usual. The setting
+      is kept in ``memo`` and applies to all nested objects.
 
     Notes
     -----
@@ -94,6 +112,8 @@ def hdf2obj(hdf, memo=None):
     if memo is None:
         # init object tracker
         memo = {}
+    if mmap_mode is not None:
+        memo[_MMAP_MODE] = mmap_mode
     # note, older file formats did not store objrefs
     if 'objref' in hdf.attrs:
         objref = hdf.attrs['objref']
@@ -124,7 +144,7 @@ def hdf2obj(hdf, memo=None):
             # extract the scalar from the 0D array as is
             obj = hdf[()]
         else:
-            obj = _hdf_to_ndarray(hdf)
+            obj = _hdf_to_ndarray(hdf, mmap_mode=memo.get(_MMAP_MODE))
 
     else:
         # check if we have a class instance definition here
@@ -340,7 +360,7 @@ def _recon_customobj_defaultrecon(hdf, memo):
     _update_obj_state_from_hdf(obj, hdf, memo)
 
     # do we process a container?
-    if 'items' in hdf:
+    if 'items' in hdf or 'packed' in hdf:
         try:
             # charge the items -- handling depends on the parent class
             pcls, umeth, cfunc = _get_subclass_entry(
@@ -369,6 +389,10 @@ def _recon_customobj_defaultrecon(hdf, memo):
 def _hdf_dict_to_obj(hdf, memo, skip=None):
     if skip is None:
         skip = []
+    if 'packed' in hdf:
+        keys = _hdf_packed_to_list(hdf['packed_keys'], memo)
+        values = _hdf_packed_to_list(hdf['packed'], memo)
+        return dict([(k, v) for k, v in zip(keys, values) if not k in skip])
     # legacy compat code
     if not 'items' in hdf:
         items_container = hdf
@@ -444,6 +468,9 @@ def _hdf_list_to_obj(hdf, memo, target_container=None):
     to point to the actual data structure to be referenced, which
     later would get populated with list's items.
     """
+    if 'packed' in hdf:
+        # packed items cannot refer to anything
+        return _hdf_packed_to_list(hdf['packed'], memo)
     # new-style files have explicit length
     if 'length' in hdf.attrs:
         length = hdf.attrs['length']
@@ -484,20 +511,22 @@ def _hdf_list_to_obj(hdf, memo, target_container=None):
                 debug('HDF5', "Track provided target_container under objref '%s'",
                       objref)
             memo[objref] = target_container
+    # look up names and references of all items at once, instead of querying
+    # the file for each item
+    item_refs = dict(hdf_items.attrs.items())
+    item_names = set(hdf_items.keys())
     # for all expected items
     for i in xrange(length):
         if __debug__:
             debug('HDF5', "Item %i" % i)
         str_i = str(i)
         obj = None
-        objref = None
+        # do we have an item attribute for this item (which is the objref)
+        objref = item_refs.get(str_i)
         # we need a separate flag, see below
         got_obj = False
-        # do we have an item attribute for this item (which is the objref)
-        if str_i in hdf_items.attrs:
-            objref = hdf_items.attrs[str_i]
         # do we have an actual value for this item
-        if str_i in hdf_items:
+        if str_i in item_names:
             obj = hdf2obj(hdf_items[str_i], memo=memo)
             # we need to signal that we got something, since it could as well
             # be None
@@ -530,7 +559,11 @@ def _hdf_tupleitems_to_obj(hdf, memo):
     return tuple(_hdf_list_to_obj(hdf, memo))
 
 
-def _hdf_to_ndarray(hdf):
+def _hdf_to_ndarray(hdf, mmap_mode=None):
+    if mmap_mode is not None and not 'is_a_view' in hdf.attrs:
+        obj = _hdf_to_memmap(hdf, mmap_mode)
+        if obj is not None:
+            return obj
     # read array-dataset into an array
     obj = np.empty(hdf.shape, hdf.dtype)
 
@@ -557,6 +590,99 @@ def _hdf_to_ndarray(hdf):
     return obj
 
 
+def _hdf_to_memmap(hdf, mode):
+    """Memory-map an array-dataset from its file, or return None if impossible
+
+    Only non-empty datasets of a plain dtype, that are stored contiguously
+    and without any filter (e.g. compression), have a fixed location in the
+    file.
+    """
+    if not hdf.size or hdf.dtype.hasobject or hdf.chunks is not None:
+        return None
+    offset = hdf.id.get_offset()
+    if offset is None:
+        # storage was never allocated
+        return None
+    if __debug__:
+        debug('HDF5', "Memory-map %s array [%s] with mode '%s'"
+                      % (hdf.shape, hdf.name, mode))
+    return np.memmap(hdf.file.filename, dtype=hdf.dtype, mode=mode,
+                     offset=offset, shape=hdf.shape)
+
+
+def _hdf_to_dataset_selection(hdf, samples=slice(None),
+                              features=slice(None)):
+    """Load a selection of samples and features of a stored dataset
+
+    Only the selected part of the samples array is read from the file. All
+    attributes are loaded and sliced just like ``dataset[samples, features]``
+    would do.
+    """
+    from mvpa2.base.dataset import AttrDataset
+    from mvpa2.datasets.base import DatasetView
+
+    if not ('recon' in hdf.attrs and 'rcargs' in hdf):
+        raise ValueError("'%s' does not contain a stored dataset" % hdf.name)
+    mod, cls = _import_from_thin_air(hdf.attrs['module'].decode(),
+                                     hdf.attrs['recon'].decode())
+    if not (isinstance(cls, type) and issubclass(cls, AttrDataset)):
+        raise ValueError("'%s' contains %s not a dataset" % (hdf.name, cls))
+    hdf_samples = hdf['rcargs']['items']['0']
+    if not isinstance(hdf_samples, h5py.Dataset) \
+            or len(hdf_samples.shape) != 2 \
+            or 'is_a_view' in hdf_samples.attrs:
+        # cannot read partially
+        return hdf2obj(hdf)[samples, features]
+    # attributes are stored after the samples
+    try:
+        memo = {}
+        sa, fa, a = [hdf2obj(hdf['rcargs']['items'][str(i)], memo)
+                     for i in (1, 2, 3)]
+    except LookupError:
+        # some attribute refers to the samples array itself
+        return hdf2obj(hdf)[samples, features]
+    # a view (of a dataset with the stored array as samples) knows how to
+    # slice the attributes
+    view = DatasetView.from_dataset(cls(hdf_samples, sa=sa, fa=fa, a=a),
+                                    samples, features)
+    return cls(_read_hdf_selection(hdf_samples, view._selection),
+               sa=view.sa, fa=view.fa, a=view.a)
+
+
+def _read_hdf_selection(hdf, args):
+    """Read a selection along the first two axes of an HDF5 array
+
+    HDF5 can read at most one (increasing) list of indices at a time. Hence
+    a second one is read as the range it spans, and the final selection,
+    including any reordering or repetition, is done in memory.
+    """
+    idx_args = [np.arange(n)[arg] for arg, n in zip(args, hdf.shape)]
+    if not np.all([len(idx) for idx in idx_args]):
+        # nothing to read
+        return np.empty(tuple([len(idx) for idx in idx_args]) + hdf.shape[2:],
+                        dtype=hdf.dtype)
+    selection, subselection = [], []
+    for arg, idx in zip(args, idx_args):
+        if isinstance(arg, slice) and (arg.step is None or arg.step > 0):
+            selection.append(arg)
+            subselection.append(None)
+            continue
+        uidx, inverse = np.unique(idx, return_inverse=True)
+        if any([not isinstance(s, slice) for s in selection]):
+            # read the range
+            selection.append(slice(uidx[0], uidx[-1] + 1))
+            subselection.append(idx - uidx[0])
+        else:
+            selection.append(uidx)
+            subselection.append(None if len(uidx) == len(idx)
+                                and np.all(uidx == idx) else inverse)
+    data = hdf[tuple(selection)]
+    for axis, subsel in enumerate(subselection):
+        if subsel is not None:
+            data = data.take(subsel, axis=axis)
+    return data
+
+
 def _seqitems_to_hdf(obj, hdf, memo, noid=False, **kwargs):
     """Store a sequence as HDF item list"""
     hdf.attrs.create('length', len(obj))
@@ -567,7 +693,130 @@ def _seqitems_to_hdf(obj, hdf, memo, noid=False, **kwargs):
         obj2hdf(items, item, name=str(i), memo=memo, noid=noid, **kwargs)
 
 
-def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
+def _seqitems_to_packed_hdf(obj, hdf, memo, **kwargs):
+    """Store the items of a homogeneous sequence or dict as packed arrays
+
+    Returns
+    -------
+    bool
+      Whether the items could be packed. If not, nothing is stored.
+    """
+    if not memo.get(_PACKED, True):
+        return False
+    if isinstance(obj, dict):
+        items = obj.items()
+        seqs = [('packed_keys', [k for k, v in items]),
+                ('packed', [v for k, v in items])]
+    else:
+        seqs = [('packed', obj)]
+    packs = [(name, _pack_items(seq, memo)) for name, seq in seqs]
+    if np.any([pack is None for name, pack in packs]):
+        return False
+    hdf.attrs.create('length', len(obj))
+    for name, (kind, arrays) in packs:
+        if __debug__:
+            debug('HDF5', "Store %i items of kind '%s' packed in [%s/%s]"
+                          % (len(obj), kind, hdf.name, name))
+        grp = hdf.create_group(name)
+        grp.attrs.create('kind', kind.encode())
+        for key, value in arrays.iteritems():
+            obj2hdf(grp, value, name=key, memo=memo, noid=True, **kwargs)
+    return True
+
+
+def _pack_items(seq, memo):
+    """Pack a sequence of numeric arrays, numeric scalars or strings
+
+    All items need to be of the same type (and dtype). Arrays are stored as
+    the concatenation of all their elements, together with their dimensions
+    and shapes to split it up again.
+
+    Returns
+    -------
+    (str, dict) or None
+      The kind of items and the arrays to store, or None if the items cannot
+      be packed (e.g. if they are of different types, or any array occurs
+      repeatedly or has been stored before and needs to be referenced).
+    """
+    if len(seq) < 2:
+        return None
+    types = set([type(item) for item in seq])
+    if len(types) != 1:
+        return None
+    item_type = types.pop()
+    if item_type is np.ndarray:
+        if len(set([item.dtype for item in seq])) != 1 \
+                or not seq[0].dtype.kind in 'biufc' \
+                or max([item.size for item in seq]) > _PACKED_MAX_NELEMENTS \
+                or len(set([id(item) for item in seq])) != len(seq) \
+                or np.any([id(item) in memo for item in seq]):
+            return None
+        return 'array', dict(
+            data=np.concatenate([item.ravel() for item in seq]),
+            ndims=np.array([item.ndim for item in seq], dtype=np.int64),
+            shapes=np.array([n for item in seq for n in item.shape],
+                            dtype=np.int64))
+    if item_type is str:
+        data = [item if isinstance(item, bytes) else item.encode('utf-8')
+                for item in seq]
+        if np.any([item.endswith(b'\x00') for item in data]):
+            # would be lost in a fixed-length string array
+            return None
+        return 'str', dict(data=np.array(data))
+    if issubclass(item_type, np.generic):
+        kind = 'numpy_scalar'
+        data = np.array(seq, dtype=item_type)
+    elif item_type in (bool, int, float, complex):
+        kind = 'scalar'
+        data = np.array(seq)
+    else:
+        return None
+    if not data.dtype.kind in 'biufc':
+        return None
+    return kind, dict(data=data)
+
+
+def _hdf_packed_to_list(hdf, memo):
+    """Unpack a list of items stored by `_seqitems_to_packed_hdf()`"""
+    kind = hdf.attrs['kind'].decode()
+    data = hdf2obj(hdf['data'], memo)
+    if __debug__:
+        debug('HDF5', "Unpack items of kind '%s' [%s]" % (kind, hdf.name))
+    if kind == 'array':
+        ndims = hdf2obj(hdf['ndims'], memo)
+        shapes = hdf2obj(hdf['shapes'], memo)
+        shape_ends = np.cumsum(ndims)
+        shapes = [tuple(shapes[end - ndim:end])
+                  for ndim, end in zip(ndims, shape_ends)]
+        data_ends = np.cumsum([np.prod(shape, dtype=np.int64)
+                               for shape in shapes])
+        return [data[end - len_:end].reshape(shape)
+                for shape, len_, end in zip(
+                    shapes, np.diff(np.r_[0, data_ends]), data_ends)]
+    elif kind == 'numpy_scalar':
+        return list(data)
+    elif kind == 'scalar':
+        return data.tolist()
+    elif kind == 'str':
+        return [item if isinstance(item, str) else item.decode('utf-8')
+                for item in data.tolist()]
+    raise HDF5ConversionError("Unknown kind of packed items '%s' (at '%s')"
+                              % (kind, hdf.name))
+
+
+def _get_chunk_shape(chunks, shape):
+    """Adapt a chunk shape to an array of a given shape
+
+    The chunk shape is matched to the leading axes of the array (e.g. samples
+    and features of a dataset), and limited to the extent of each axis. Any
+    further axes are not split.
+    """
+    chunks = tuple(chunks[:len(shape)]) + tuple(shape[len(chunks):])
+    return tuple([max(1, min(c, n)) for c, n in zip(chunks, shape)])
+
+
+def obj2hdf(hdf, obj, name=None, memo=None, noid=False, packed=True,
+            **kwargs):
     """Store an object instance in an HDF5 group.
 
     A given object instance is (recursively) disassembled into pieces that are
@@ -595,12 +844,25 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
     noid : bool
       If True, the to be processed object has no usable id. Set if storing
       objects that were created temporarily, e.g. during type conversions.
+    packed : bool
+      If True, lists, tuples and dicts whose items are all numeric arrays of
+      the same dtype, all numeric scalars of the same type, or all strings,
+      are stored as a few concatenated arrays, instead of one HDF5 dataset
+      per item. This makes storing and loading of large containers (e.g.
+      neighborhoods of a searchlight) a lot faster. The identity of
+      packed items is not tracked, i.e. an array that is referenced elsewhere
+      is stored again.
     **kwargs
-      All additional arguments will be passed to `h5py.Group.create_dataset()`
+      All additional arguments will be passed to `h5py.Group.create_dataset()`.
+      A ``chunks`` shape is adapted to each array, e.g. ``chunks=(64, 1024)``
+      splits dataset samples into blocks of 64 samples and 1024 features,
+      while one-dimensional attribute arrays are stored in chunks of 64
+      values. Scalars and empty arrays are always stored unchunked.
     """
     if memo is None:
         # initialize empty recursion tracker
         memo = {}
+    memo.setdefault(_PACKED, packed)
 
     #
     # Catch recursions: just stored references to already known objects
@@ -659,13 +921,16 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
             debug('HDF5', "Store '%s' (ref: %i) in [%s/%s]"
                   % (type(obj), obj_id, hdf.name, name))
         # the real action is here
-        if 'compression' in kwargs \
-                and (is_scalar or (is_ndarray and not len(obj.shape))):
+        if is_scalar or (is_ndarray and (not len(obj.shape) or not obj.size)):
             # recent (>= 2.0.0) h5py is strict not allowing
-            # compression to be set for scalar types or anything with
-            # shape==() ... TODO: check about is_objarrays ;-)
+            # compression (or any other chunked storage) to be set for
+            # scalar types or anything with shape==() or no elements
+            # ... TODO: check about is_objarrays ;-)
             kwargs = dict([(k, v) for (k, v) in kwargs.iteritems()
-                           if k != 'compression'])
+                           if not k in _CHUNKED_STORAGE_KWARGS])
+        elif is_ndarray and isinstance(kwargs.get('chunks'), tuple):
+            kwargs = dict(kwargs, chunks=_get_chunk_shape(kwargs['chunks'],
+                                                          obj.shape))
 
         is_a_view = False
         try:
@@ -692,6 +957,10 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
                 obj_ = obj
             assert(obj_.flags.c_contiguous or obj_.flags.f_contiguous)
             obj_data = np.frombuffer(obj_.data, dtype=np.int8)
+            if isinstance(kwargs.get('chunks'), tuple):
+                kwargs = dict(kwargs,
+                              chunks=_get_chunk_shape(kwargs['chunks'],
+                                                      obj_data.shape))
             hdf.create_dataset(name, None, None, obj_data, **kwargs)
             hdf[name].attrs.create('is_a_view', True)
             hdf[name].attrs.create('c_order', obj_.flags.c_contiguous)
@@ -840,7 +1109,10 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
                 raise HDF5ConversionError(
                     "Can't obj2hdf lambda functions. Got %r" % (obj,))
             grp.attrs.create('name', oname.encode())
-        if isinstance(obj, (list, tuple)):
+        if isinstance(obj, (list, tuple, dict)) \
+                and _seqitems_to_packed_hdf(obj, grp, memo, **kwargs):
+            pass
+        elif isinstance(obj, (list, tuple)):
             _seqitems_to_hdf(obj, grp, memo, **kwargs)
         elif isinstance(obj, dict):
             if __debug__:
@@ -907,7 +1179,7 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
         if target_dir and not osp.exists(target_dir):
             os.makedirs(target_dir)
     hdf = h5py.File(filename, mode)
-    hdf.attrs.create('__pymvpa_hdf5_version__', '2'.encode())
+    hdf.attrs.create('__pymvpa_hdf5_version__', '3'.encode())
     hdf.attrs.create('__pymvpa_version__', mvpa2.__version__.encode())
     try:
         obj2hdf(hdf, data, name, **kwargs)
@@ -915,7 +1187,7 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
         hdf.close()
 
 
-def h5load(filename, name=None):
+def h5load(filename, name=None, mmap_mode=None, samples=None, features=None):
     """Loads the content of an HDF5 file that has been stored by `h5save()`.
 
     This is a convenience wrapper around `hdf2obj()`. Please see its
@@ -927,19 +1199,36 @@ def h5load(filename, name=None):
       Name of the file to open and load its content.
     name : str
       Name of a specific object to load from the file.
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+      If not None, arrays (e.g. the samples of a dataset) that have been
+      stored without compression or chunking are memory-mapped instead of
+      being read into memory (see `hdf2obj()`). Only the parts of them that
+      are actually accessed are read from the file.
+    samples, features : slice or array, optional
+      If given, the stored object has to be a dataset, and only this
+      selection of its samples and features is read from the file, as
+      in ``dataset[samples, features]``. This is most efficient if the
+      dataset has been stored with a matching ``chunks`` layout (see
+      `obj2hdf()`). `mmap_mode` is ignored in this case.
 
     Returns
     -------
     instance
       An object of whatever has been stored in the file.
     """
+    if samples is None and features is None:
+        load = lambda hdf: hdf2obj(hdf, mmap_mode=mmap_mode)
+    else:
+        samples = slice(None) if samples is None else samples
+        features = slice(None) if features is None else features
+        load = lambda hdf: _hdf_to_dataset_selection(hdf, samples, features)
     hdf = h5py.File(filename, 'r')
     try:
         if name is not None:
             if not name in hdf:
                 raise ValueError("No object of name '%s' in file '%s'."
                                  % (name, filename))
-            obj = hdf2obj(hdf[name])
+            obj = load(hdf[name])
         else:
             if not len(hdf) and not len(hdf.attrs):
                 # there is nothing
@@ -949,19 +1238,19 @@ def h5load(filename, name=None):
                 if isinstance(hdf, h5py.Dataset) \
                         or ('class' in hdf.attrs or 'recon' in hdf.attrs):
                     # this is an object stored at the toplevel
-                    obj = hdf2obj(hdf)
+                    obj = load(hdf)
                 else:
                     # no object into at the top-level, but maybe in the next one
                     # this would happen for plain mat files with arrays
                     if len(hdf) == 1 and '__unnamed__' in hdf:
                         # just a single with special name -> special case:
                         # return as is
-                        obj = hdf2obj(hdf['__unnamed__'])
+                        obj = load(hdf['__unnamed__'])
                     else:
                         # otherwise build dict with content
                         obj = {}
                         for k in hdf:
-                            obj[k] = hdf2obj(hdf[k])
+                            obj[k] = load(hdf[k])
     finally:
         hdf.close()
     return obj
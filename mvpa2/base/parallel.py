@@ -0,0 +1,457 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Pluggable backends for parallel execution of independent computations.
+
+All backends provide a minimal subset of the `concurrent.futures` executor
+interface, i.e. ``submit(fn, *args, **kwargs)`` returning an object with a
+``result()`` method, and ``shutdown(wait=True)``.  Therefore any
+`concurrent.futures`-style executor instance can be used interchangeably
+with the named backends provided here.  Executors with a true ``isolated``
+attribute guarantee that concurrent computations cannot interfere with each
+other via shared objects, so callers could avoid deep-copying their state.
+
+'serial'
+  Computation is done within the calling process at the time of submission.
+'thread'
+  A pool of threads.  Beneficial for computations which release the GIL
+  (e.g. NumPy-heavy measures).
+'process'
+  Each submitted computation runs in a forked child process (similar to the
+  former `pprocess`-based implementation).  Neither the callable nor its
+  arguments need to be picklable, only the results are sent back.
+'joblib'
+  Submitted computations are collected and dispatched via
+  `joblib.Parallel` as soon as any result is requested.  Its futures cannot
+  report whether they are done, hence computations kept in flight (see
+  `iter_results`) are run in batches, each waiting for its slowest
+  computation, i.e. only static scheduling is supported.
+"""
+
+from __future__ import absolute_import
+
+__docformat__ = 'restructuredtext'
+
+__all__ = ['get_executor', 'get_nproc', 'iter_results', 'executor_backends',
+           'get_shared_array', 'get_utilization']
+
+import os
+import sys
+import time
+import tempfile
+import traceback
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+from mvpa2.base import externals
+
+if __debug__:
+    from mvpa2.base import debug
+
+
+def get_nproc(nproc=None):
+    """Return number of processes to use, i.e. number of cores if None"""
+    if nproc is None:
+        try:
+            nproc = multiprocessing.cpu_count()
+        except NotImplementedError:
+            nproc = 1
+    return nproc
+
+
+class _Future(object):
+    """Minimalistic future for results computed by our own executors"""
+
+    def __init__(self, fx=None, poll=None):
+        self._fx = fx                   # to be called to obtain the result
+        self._poll = poll               # to check if result is available
+        self._done = False
+        self._result = None
+        self._exc_info = None
+
+    def _set(self, result=None, exc_info=None):
+        self._result = result
+        self._exc_info = exc_info
+        self._done = True
+        self._fx = None
+
+    def done(self):
+        if not self._done and self._poll is not None and self._poll():
+            self._fx()
+        return self._done
+
+    pollable = property(fget=lambda self: self._done or self._poll is not None,
+                        doc="Either done() could report completion")
+
+    def result(self, timeout=None):
+        if not self._done:
+            self._fx()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class SerialExecutor(object):
+    """Executes all submitted computations immediately in the same process"""
+
+    max_workers = 1
+    isolated = True
+
+    def submit(self, fn, *args, **kwargs):
+        future = _Future()
+        try:
+            future._set(result=fn(*args, **kwargs))
+        except Exception:
+            future._set(exc_info=sys.exc_info())
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ThreadExecutor(object):
+    """Executes submitted computations within a pool of threads"""
+
+    isolated = False
+
+    def __init__(self, max_workers=None):
+        # local import to not spawn anything unless needed
+        from multiprocessing.pool import ThreadPool
+        self.max_workers = get_nproc(max_workers)
+        self._pool = ThreadPool(self.max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        async_result = self._pool.apply_async(_call_with_exc_info,
+                                              (fn, args, kwargs))
+        future = _Future(poll=async_result.ready)
+        future._fx = lambda: future._set(*async_result.get())
+        return future
+
+    def shutdown(self, wait=True):
+        self._pool.close()
+        if wait:
+            self._pool.join()
+
+
+def _call_with_exc_info(fn, args, kwargs, traceback=True):
+    """Helper to return (result, exc_info) of a call
+
+    Tracebacks could be stripped (if `traceback` is False) from `exc_info` to
+    allow for its pickling.
+    """
+    try:
+        return fn(*args, **kwargs), None
+    except Exception:
+        exc_info = sys.exc_info()
+        if not traceback:
+            exc_info = exc_info[:2] + (None,)
+        return None, exc_info
+
+
+class ForkExecutor(object):
+    """Executes each submitted computation in a forked child process
+
+    The callable and its arguments are inherited by the child process, and
+    only the result is pickled and sent back to the parent.  At most
+    `max_workers` children are running at a time -- submission blocks until
+    the oldest running computation has finished otherwise.
+    """
+
+    isolated = True
+
+    def __init__(self, max_workers=None):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("'process' backend requires os.fork() which is "
+                               "not available on this platform. Use 'thread' "
+                               "or 'joblib' backend instead")
+        self.max_workers = get_nproc(max_workers)
+        self._mp = multiprocessing.get_context('fork') \
+            if hasattr(multiprocessing, 'get_context') else multiprocessing
+        self._running = deque()
+
+    def submit(self, fn, *args, **kwargs):
+        while len(self._running) >= self.max_workers:
+            self._collect(*self._running.popleft())
+        parent_conn, child_conn = self._mp.Pipe(duplex=False)
+        proc = self._mp.Process(target=_child_call,
+                                args=(child_conn, fn, args, kwargs))
+        proc.daemon = True
+        proc.start()
+        child_conn.close()
+        if __debug__:
+            debug('PAR', "Started child process %i" % proc.pid)
+        # data (or EOF if child died) becomes available upon completion
+        future = _Future(poll=parent_conn.poll)
+        entry = (future, proc, parent_conn)
+        future._fx = lambda: self._collect_entry(entry)
+        self._running.append(entry)
+        return future
+
+    def _collect_entry(self, entry):
+        try:
+            self._running.remove(entry)
+        except ValueError:
+            pass
+        self._collect(*entry)
+
+    def _collect(self, future, proc, conn):
+        if future._done:
+            return
+        try:
+            status, value = conn.recv()
+        except EOFError:
+            status, value = 'error', "Child process %i died unexpectedly " \
+                                     "(exit code %s)" % (proc.pid,
+                                                         proc.exitcode)
+        conn.close()
+        proc.join()
+        if status == 'ok':
+            future._set(result=value)
+        else:
+            if not isinstance(value, Exception):
+                value = RuntimeError(value)
+            future._set(exc_info=(type(value), value, None))
+
+    def shutdown(self, wait=True):
+        while self._running:
+            entry = self._running.popleft()
+            if wait:
+                self._collect(*entry)
+            else:
+                entry[1].terminate()
+
+
+def _child_call(conn, fn, args, kwargs):
+    """Body of a child process of the ForkExecutor"""
+    try:
+        out = ('ok', fn(*args, **kwargs))
+    except Exception, e:
+        out = ('error', "%s\n%s" % (e, traceback.format_exc()))
+    try:
+        conn.send(out)
+    except Exception, e:
+        # result might be not picklable
+        conn.send(('error', "Failed to send results back: %s" % e))
+    conn.close()
+
+
+class JoblibExecutor(object):
+    """Collects submitted computations and runs them via `joblib.Parallel`
+
+    All computations which were submitted so far get dispatched at once as
+    soon as a result of any of them is requested, and the next batch of
+    computations is dispatched only once all of them are done.  Thus dynamic
+    scheduling (e.g. ``iter_results(..., ordered=False)``) degrades to
+    static one.
+    """
+
+    isolated = True
+
+    def __init__(self, max_workers=None):
+        externals.exists('joblib', raise_=True)
+        self.max_workers = get_nproc(max_workers)
+        self._pending = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = _Future(self._flush)
+        self._pending.append((future, fn, args, kwargs))
+        return future
+
+    def _flush(self):
+        from joblib import Parallel, delayed
+        pending, self._pending = self._pending, []
+        verbose = 50 if (__debug__ and 'PAR' in debug.active) else 0
+        results = Parallel(n_jobs=self.max_workers, verbose=verbose)(
+            delayed(_call_with_exc_info)(fn, args, kwargs, traceback=False)
+            for future, fn, args, kwargs in pending)
+        for (future, _, _, _), (result, exc_info) in zip(pending, results):
+            future._set(result, exc_info)
+
+    def shutdown(self, wait=True):
+        if wait and self._pending:
+            self._flush()
+
+
+executor_backends = {
+    'serial': SerialExecutor,
+    'thread': ThreadExecutor,
+    'process': ForkExecutor,
+    'joblib': JoblibExecutor,
+    }
+
+
+def get_executor(executor=None, nproc=None):
+    """Return an executor given its name or an instance
+
+    Parameters
+    ----------
+    executor : None or str or executor
+      Name of a backend (see `executor_backends`), or an instance of
+      a `concurrent.futures`-style executor which would be returned as is.
+      If None, the 'serial' backend is used for ``nproc == 1`` and 'process'
+      (or 'thread' on platforms without ``fork()``) otherwise.
+    nproc : None or int
+      Maximal number of workers.  If None -- all available cores.
+
+    Returns
+    -------
+    executor, bool
+      Executor instance and a flag either it was created here (and hence
+      should be shut down by the caller upon completion).
+    """
+    if executor is not None and not isinstance(executor, basestring):
+        if not hasattr(executor, 'submit'):
+            raise ValueError("Executor %r provides no submit() method"
+                             % (executor,))
+        return executor, False
+    nproc = get_nproc(nproc)
+    if executor is None:
+        if nproc == 1:
+            executor = 'serial'
+        else:
+            executor = 'process' if hasattr(os, 'fork') else 'thread'
+    try:
+        backend = executor_backends[executor.lower()]
+    except KeyError:
+        raise ValueError("Unknown executor backend %r. Known are: %s"
+                         % (executor, ', '.join(sorted(executor_backends))))
+    if backend is SerialExecutor:
+        return backend(), True
+    return backend(nproc), True
+
+
+def iter_results(executor, calls, limit=None, ordered=True):
+    """Submit calls to the executor and yield their results
+
+    Only up to `limit` computations are kept in flight, so subsequent calls
+    get submitted only as results of the preceding ones are consumed.  It
+    allows for consumers to process results as soon as they become available
+    without piling up all of them in memory.
+
+    Parameters
+    ----------
+    executor : executor
+      `concurrent.futures`-style executor.
+    calls : iterable
+      Of (fn, args, kwargs) tuples.
+    limit : None or int
+      Maximal number of submitted but not yet consumed computations.  If
+      None, ``max_workers`` of the executor is used (if known), or all
+      calls get submitted at once.
+    ordered : bool
+      If True, results are yielded in the order of `calls`.  Otherwise
+      in the order of completion, so that a new computation gets submitted
+      as soon as any worker gets idle.  Completion order could only be
+      determined for futures which provide ``done()``, otherwise they are
+      waited for in order.
+    """
+    if limit is None:
+        limit = getattr(executor, 'max_workers',
+                        getattr(executor, '_max_workers', None))
+    pending = deque()
+    for fn, args, kwargs in calls:
+        pending.append(executor.submit(fn, *args, **kwargs))
+        if limit is not None and len(pending) >= limit:
+            yield _pop_result(pending, ordered)
+    while pending:
+        yield _pop_result(pending, ordered)
+
+
+def _pop_result(pending, ordered):
+    """Remove a future from the deque and return its result"""
+    if ordered:
+        return pending.popleft().result()
+    while True:
+        for i, future in enumerate(pending):
+            if future.done():
+                del pending[i]
+                return future.result()
+        if not all(getattr(f, 'pollable', True) for f in pending):
+            # we cannot tell when they complete -- wait for the oldest
+            return pending.popleft().result()
+        time.sleep(0.01)
+
+
+def get_utilization(timings, nworkers):
+    """Estimate utilization of workers given timings of computations
+
+    Computations are assigned to (virtual) worker slots in the order of
+    their start, each to the slot which became idle the earliest.  Since the
+    actual assignment of computations to workers is not known, it is only an
+    estimate, which is exact if there were no more workers than `nworkers`
+    and each worker started a new computation as soon as it became idle.
+
+    Parameters
+    ----------
+    timings : list of tuple
+      (start, end) wall-clock times of all computations.
+    nworkers : int
+      Number of workers which were available.
+
+    Returns
+    -------
+    array
+      Fraction of the total wall-clock time (from the earliest start to the
+      latest end of any computation) each worker was busy.
+    """
+    busy = np.zeros(nworkers)
+    if not len(timings):
+        return busy
+    timings = sorted(timings)
+    idle_since = np.repeat(float(timings[0][0]), nworkers)
+    for start, end in timings:
+        iworker = np.argmin(idle_since)
+        idle_since[iworker] = end
+        busy[iworker] += end - start
+    wall = max([end for start, end in timings]) - timings[0][0]
+    return busy / wall if wall > 0 else np.ones(nworkers)
+
+
+def get_shared_array(shape=None, dtype=None, data=None, prefix='tmp',
+                     readonly=False):
+    """Return an array backed by a temporary file in shared memory
+
+    The array is an `np.memmap` of a file in ``/dev/shm`` (if available,
+    regular temporary directory otherwise), so that forked processes and
+    threads access the same memory without copying, and `joblib` workers
+    attach to it by the filename.  The caller is responsible for removing
+    the file (``os.unlink(array.filename)``) whenever it is no longer needed.
+
+    Parameters
+    ----------
+    shape : tuple, optional
+      Shape of a new array. Ignored if `data` is provided.
+    dtype : dtype, optional
+      Data type of a new array. Ignored if `data` is provided.
+    data : array, optional
+      Data to be copied into the shared array.
+    prefix : str, optional
+      Prefix for the temporary file name (could contain a directory).
+    readonly : bool, optional
+      Either array should be mapped read-only.
+    """
+    if data is not None:
+        data = np.asanyarray(data)
+        shape, dtype = data.shape, data.dtype
+    tmpdir = '/dev/shm' if os.path.isdir('/dev/shm') \
+             and os.access('/dev/shm', os.W_OK) else None
+    fd, filename = tempfile.mkstemp(prefix=prefix, suffix='.shm', dir=tmpdir)
+    os.close(fd)
+    if __debug__:
+        debug('PAR', "Allocating shared array of shape %s in %s"
+              % (shape, filename))
+    array = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    if data is not None:
+        array[:] = data
+        if readonly:
+            array.flush()
+            del array
+            array = np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+    return array
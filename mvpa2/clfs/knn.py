@@ -65,6 +65,9 @@ class kNN(Classifier):
 
     __tags__ = ['knn', 'non-linear', 'binary', 'multiclass', 'oneclass']
 
+    _batch_nelements = 2**22
+    """Maximal number of distances to compute at once during prediction"""
+
     def __init__(self, k=2, dfx=squared_euclidean_distance,
                  voting='weighted', **kwargs):
         """
@@ -92,6 +95,7 @@ class kNN(Classifier):
         self.__voting = voting
         self.__data = None
         self.__weights = None
+        self.__codes = None
 
 
     def __repr__(self, prefixes=None): # pylint: disable-msg=W0102
@@ -116,9 +120,8 @@ class kNN(Classifier):
         For kNN it is degenerate -- just stores the data.
         """
         self.__data = data
-        labels = data.sa[self.get_space()].value
-        uniquelabels = data.sa[self.get_space()].unique
-        Nuniquelabels = len(uniquelabels)
+        # integer codes of the labels allow for voting by counting
+        uniquelabels, codes = data.sa[self.get_space()].factorized
 
         if __debug__:
             if str(data.samples.dtype).startswith('uint') \
@@ -128,25 +131,16 @@ class kNN(Classifier):
                         " errors. Please convert dataset's samples into" +\
                         " floating datatype if any error is reported.")
         if self.__voting == 'weighted':
-            self.__labels = labels.copy()
-            Nlabels = len(labels)
-
-            # TODO: To get proper speed up for the next line only,
-            #       histogram should be computed
-            #       via sorting + counting "same" elements while reducing.
-            #       Guaranteed complexity is NlogN whenever now it is N^2
+            Nlabels = len(codes)
             # compute the relative proportion of samples belonging to each
-            # class (do it in one loop to improve speed and reduce readability
-            weights = \
-                [ 1.0 - ((labels == label).sum() / Nlabels) \
-                    for label in uniquelabels ]
-            self.__weights = dict(zip(uniquelabels, weights))
+            # class
+            self.__weights = \
+                1.0 - (np.bincount(codes, minlength=len(uniquelabels))
+                       / Nlabels)
         else:
             self.__weights = None
 
-        # create dictionary with an item for each condition
-        self.__votes_init = dict(zip(uniquelabels,
-                                     [0] * Nuniquelabels))
+        self.__codes = codes
 
 
     @accepts_dataset_as_samples
@@ -158,11 +152,6 @@ class kNN(Classifier):
         # make sure we're talking about arrays
         data = np.asanyarray(data)
 
-        targets_sa_name = self.get_space()
-        targets_sa = self.__data.sa[targets_sa_name]
-        labels = targets_sa.value
-        uniquelabels = targets_sa.unique
-
         # checks only in debug mode
         if __debug__:
             if not data.ndim == 2:
@@ -172,78 +161,125 @@ class kNN(Classifier):
                 raise ValueError, "Length of data samples (features) does " \
                                   "not match the classifier."
 
-        # compute the distance matrix between training and test data with
-        # distances stored row-wise, i.e. distances between test sample [0]
-        # and all training samples will end up in row 0
-        dists = self.__dfx(self.__data.samples, data).T
-        if self.ca.is_enabled('distances'):
-            # .sa.copy() now does deepcopying by default
-            self.ca.distances = Dataset(dists, fa=self.__data.sa.copy())
+        if not self.__voting in ('majority', 'weighted'):
+            raise ValueError, "kNN told to perform unknown voting '%s'." \
+                  % self.__voting
+
+        uniquelabels = self.__data.sa[self.get_space()].unique
+        store_dists = self.ca.is_enabled('distances')
+        ntrain = len(self.__codes)
+
+        # distances are computed for chunks of test samples to keep the
+        # memory footprint bounded for large test sets
+        step = max(1, self._batch_nelements // max(ntrain, 1))
+        all_dists, all_votes, winners = [], [], []
+        for start in xrange(0, len(data), step):
+            # compute the distance matrix between training and test data with
+            # distances stored row-wise, i.e. distances between test sample [0]
+            # and all training samples will end up in row 0
+            dists = self.__dfx(self.__data.samples,
+                               data[start:start + step]).T
+            if store_dists:
+                all_dists.append(dists)
+            votes, winner = self._vote(dists)
+            all_votes.append(votes)
+            winners.append(winner)
 
-        # determine the k nearest neighbors per test sample
-        knns = dists.argsort(axis=1)[:, :self.__k]
-
-        # predictions and votes for all samples
-        all_votes, predictions = [], []
-        for inns, nns in enumerate(knns):
-            votes = self.__votes_init.copy()
-            # TODO: optimize!
-            for nn in nns:
-                votes[labels[nn]] += 1
-
-            # optionally weight votes
-            if self.__voting == 'majority':
-                pass
-            elif self.__voting == 'weighted':
-                # TODO: optimize!
-                for ul in uniquelabels:
-                    votes[ul] *= self.__weights[ul]
-            else:
-                raise ValueError, "kNN told to perform unknown voting '%s'." \
-                      % self.__voting
-
-            # reverse dictionary items and sort them to get the
-            # winners
-            # It would be more expensive than just to look for
-            # the maximum, but this piece should be the least
-            # cpu-intensive while distances computation should consume
-            # the most. Also it would allow to look and break the ties
-            votes_reversed = sorted([(v, k) for k, v in votes.iteritems()],
-                                    reverse=True)
-            # check for ties
-            max_vote, max_vote_label = votes_reversed[0]
-
-            if len(votes_reversed) > 1 and max_vote == votes_reversed[1][0]:
-                # figure out all ties and break them based on the mean
-                # distance
-                # TODO: theoretically we could break out of the loop earlier
-                ties = [x[1] for x in votes_reversed if x[0] == max_vote]
-
-                # compute mean distances to the corresponding clouds
-                # restrict analysis only to k-nn's
-                nns_labels = labels[nns]
-                nns_dists = dists[inns][nns]
-                ties_dists = [np.mean(nns_dists[nns_labels == t]) for t in ties]
-                max_vote_label = ties[np.argmin(ties_dists)]
-                if __debug__:
-                    debug('KNN',
-                          'Ran into the ties: %s with votes: %s, dists: %s, max_vote %r',
-                          (ties, votes_reversed, ties_dists, max_vote_label))
+        if len(winners):
+            votes = np.vstack(all_votes)
+            winners = np.concatenate(winners)
+        else:
+            votes = np.zeros((0, len(uniquelabels)))
+            winners = np.zeros(0, dtype='int')
 
-            all_votes.append(votes)
-            predictions.append(max_vote_label)
+        if store_dists:
+            if len(all_dists):
+                dists = np.vstack(all_dists)
+            else:
+                dists = np.zeros((0, ntrain))
+            # .sa.copy() now does deepcopying by default
+            self.ca.distances = Dataset(dists, fa=self.__data.sa.copy())
 
+        predictions = [uniquelabels[i] for i in winners]
         # store the predictions in the state. Relies on State._setitem to do
         # nothing if the relevant state member is not enabled
         self.ca.predictions = predictions
-        self.ca.estimates = all_votes # np.array([r[1] for r in results])
+        self.ca.estimates = [dict(zip(uniquelabels, v)) for v in votes]
 
         return predictions
 
+
+    def _vote(self, dists):
+        """Votes of the k nearest neighbors for a set of test samples
+
+        Parameters
+        ----------
+        dists : array
+          Distances between test samples (rows) and training samples
+          (columns).
+
+        Returns
+        -------
+        votes : array
+          (Weighted) votes for each label (columns) per test sample.
+        winners : array
+          Index of the winning label per test sample.
+        """
+        codes = self.__codes
+        nlabels = codes.max() + 1 if len(codes) else 0
+        nsamples, ntrain = dists.shape
+        k = min(self.__k, ntrain)
+
+        # determine the k nearest neighbors per test sample
+        if k < ntrain:
+            knns = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        else:
+            knns = np.tile(np.arange(ntrain), (nsamples, 1))
+        # one bin per test sample and label
+        bins = (np.arange(nsamples)[:, None] * nlabels
+                + codes[knns]).ravel()
+        votes = np.bincount(bins, minlength=nsamples * nlabels) \
+                  .reshape(nsamples, nlabels)
+
+        # optionally weight votes
+        if self.__voting == 'weighted':
+            votes = votes * self.__weights
+
+        max_votes = votes.max(axis=1)
+        # labels with the maximal number of votes
+        ties = votes == max_votes[:, None]
+        # in the absence of ties it is the only one, otherwise it is
+        # broken based on the mean distance of the k-nns of each label;
+        # equal mean distances (and votes) are resolved in favor of the
+        # largest label
+        tied = ties.sum(axis=1) > 1
+        winners = nlabels - 1 - ties[:, ::-1].argmax(axis=1)
+        if np.any(tied):
+            itied = np.where(tied)[0]
+            knns_tied = knns[itied]
+            nns_dists = dists[itied[:, None], knns_tied]
+            tbins = bins.reshape(nsamples, k)[itied].ravel()
+            sums = np.bincount(tbins, weights=nns_dists.ravel(),
+                               minlength=nsamples * nlabels)
+            counts = np.bincount(tbins, minlength=nsamples * nlabels)
+            sums = sums.reshape(nsamples, nlabels)[itied]
+            counts = counts.reshape(nsamples, nlabels)[itied]
+            ties_dists = np.where(ties[itied],
+                                  sums / np.maximum(counts, 1), np.inf)
+            winners[itied] = \
+                nlabels - 1 - ties_dists[:, ::-1].argmin(axis=1)
+            if __debug__:
+                debug('KNN',
+                      'Ran into the ties for %d samples with votes: %s, '
+                      'dists: %s, max_vote %r',
+                      (len(itied), votes[itied], ties_dists, winners[itied]))
+        return votes, winners
+
     def _untrain(self):
         """Reset trained state"""
         self.__data = None
         self.__weights = None
+        self.__codes = None
         super(kNN, self)._untrain()
 
     dfx = property(fget=lambda self: self.__dfx)
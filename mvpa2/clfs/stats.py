@@ -13,14 +13,21 @@ from __future__ import with_statement   # Let's start using with
 __docformat__ = 'restructuredtext'
 
 import warnings
+import itertools
 
 import numpy as np
 
+import mvpa2
+from mvpa2._random import call_seeded
 from mvpa2.base import externals, warning
+from mvpa2.base.dochelpers import _repr_attrs
+from mvpa2.base.parallel import get_executor, get_nproc, iter_results
 from mvpa2.base.state import ClassWithCollections, ConditionalAttribute
 from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.base.types import is_datasetlike
 from mvpa2.datasets import Dataset
+from mvpa2.kernels.base import cache_learner_kernel
+from mvpa2.support import copy
 
 if __debug__:
     from mvpa2.base import debug
@@ -120,6 +127,132 @@ class Nonparametric(object):
                          np.vectorize(lambda v: (self._dist_samples >= v).mean()))
 
 
+class NonparametricArray(object):
+    """Non-parametric 1d distributions of many elements at once
+
+    Array-backed alternative to a list of `Nonparametric` instances: samples
+    of all elements are sorted once, and cdf values for all elements are
+    found by a vectorized binary search.  Results are identical to the ones
+    of `Nonparametric` with the same `correction`.
+
+    Indexing or iterating provides `Nonparametric` instances for the
+    individual elements.
+    """
+
+    def __init__(self, dist_samples, nsamples=None, correction='clip',
+                 inplace=False):
+        """
+        Parameters
+        ----------
+        dist_samples : ndarray, shape (nelements, nsamples)
+          Samples of the distribution of each element (row).
+        nsamples : None or ndarray of int
+          Number of samples for each element, if they differ.  Only the
+          first `nsamples` values of each row are used then.
+        correction : {'clip'} or None, optional
+          See `Nonparametric`.
+        inplace : bool
+          Either `dist_samples` could be sorted in place.
+        """
+        dist_samples = np.asanyarray(dist_samples)
+        if nsamples is None:
+            nsamples = np.repeat(dist_samples.shape[1], len(dist_samples))
+        else:
+            nsamples = np.asanyarray(nsamples)
+            # ignore everything beyond the samples of each element
+            dist_samples = np.array(dist_samples, dtype=float,
+                                    copy=not inplace)
+            dist_samples[np.arange(dist_samples.shape[1])[None]
+                         >= nsamples[:, None]] = np.nan
+            inplace = True
+        if not inplace:
+            dist_samples = dist_samples.copy()
+        # NaNs get sorted to the end, and are not counted in either tail
+        dist_samples.sort(axis=1)
+        self._dist_samples = dist_samples
+        self._nsamples = nsamples
+        if dist_samples.dtype.kind == 'f':
+            self._nvalid = np.sum(~np.isnan(dist_samples), axis=1)
+        else:
+            self._nvalid = nsamples
+        self._correction = correction
+
+    def __repr__(self):
+        return '%s(<%d elements>%s)' % (
+            self.__class__.__name__, len(self),
+            ('', ', correction=%r' % self._correction)
+              [int(self._correction != 'clip')])
+
+    def __len__(self):
+        return len(self._dist_samples)
+
+    def __getitem__(self, i):
+        return Nonparametric(self._dist_samples[i, :self._nsamples[i]],
+                             correction=self._correction)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _count(self, x, strict):
+        """Count samples of each element below (or equal to) `x`
+        """
+        samples, nvalid = self._dist_samples, self._nvalid
+        rows = np.arange(len(samples))
+        lo = np.zeros(len(samples), dtype=int)
+        hi = nvalid.copy()
+        active = lo < hi
+        while np.any(active):
+            mid = (lo + hi) // 2
+            v = samples[rows, np.minimum(mid, samples.shape[1] - 1)]
+            below = (v < x) if strict else (v <= x)
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid, hi)
+            active = lo < hi
+        return lo
+
+    def _cdf(self, x, counts):
+        """Helper to turn counts into (clipped) cdf values"""
+        res = counts / self._nsamples.astype(float)
+        if self._correction == 'clip':
+            nsamples = self._nsamples
+            res = np.clip(res, 1.0/(nsamples+2), (nsamples+1.0)/(nsamples+2))
+        elif self._correction is None:
+            pass
+        else:
+            raise ValueError, \
+                  '%r is incorrect value for correction parameter of %s' \
+                  % (self._correction, self.__class__.__name__)
+        return res.reshape(x.shape)
+
+    def _prepare(self, x):
+        x = np.asanyarray(x)
+        if x.size == 1 and len(self) != 1:
+            x = np.repeat(x.ravel(), len(self))
+        if x.size != len(self):
+            raise ValueError('Distributions were fit for %d elements, '
+                             'whenever now queried with %d elements'
+                             % (len(self), x.size))
+        return x
+
+    def cdf(self, x):
+        """Returns the cdf value at `x` for each element.
+        """
+        x = self._prepare(x)
+        return self._cdf(x, self._count(x.ravel(), strict=False))
+
+    def rcdf(self, x):
+        """Returns cdf of reversed distribution for each element.
+
+        See `Nonparametric.rcdf`.
+        """
+        x = self._prepare(x)
+        counts = self._nvalid - self._count(x.ravel(), strict=True)
+        # nothing is greater or equal to NaN
+        counts[np.isnan(x.ravel())] = 0
+        return self._cdf(x, counts)
+
+
 def _pvalue(x, cdf_func, rcdf_func, tail, return_tails=False, name=None):
     """Helper function to return p-value(x) given cdf and tail
 
@@ -326,7 +459,7 @@ class MCNullDist(NullDist):
                       'measure has failed to evaluated at them')
 
     def __init__(self, permutator, dist_class=Nonparametric, measure=None,
-                 **kwargs):
+                 nproc=1, executor=None, **kwargs):
         """Initialize Monte-Carlo Permutation Null-hypothesis testing
 
         Parameters
@@ -341,12 +474,26 @@ class MCNullDist(NullDist):
         measure : Measure or None
           Optional measure that is used to compute results on permuted
           data. If None, a measure needs to be passed to ``fit()``.
+        nproc : None or int
+          How many processes to use for computing the measure on permuted
+          datasets.  If None -- all available cores will be used.
+          Permuted datasets are generated in the main process, while the
+          measure is computed with RNG seeded differently for each
+          permutation, so results do not depend on the number of processes.
+          Since threads share the RNG with the main process, it is not
+          reseeded with a thread-based executor, hence results are then
+          reproducible only for measures which do not draw random numbers.
+        executor : None or str or executor
+          Backend to use for parallel computation (see
+          :func:`~mvpa2.base.parallel.get_executor`).
         """
         NullDist.__init__(self, **kwargs)
 
         self._dist_class = dist_class
         self._dist = []                 # actual distributions
         self._measure = measure
+        self.nproc = nproc
+        self.executor = executor
 
         self.__permutator = permutator
 
@@ -357,13 +504,55 @@ class MCNullDist(NullDist):
         if self._dist_class != Nonparametric:
             prefixes_.insert(0, 'dist_class=%r' % (self._dist_class,))
         return super(MCNullDist, self).__repr__(
-            prefixes=prefixes_ + prefixes)
+            prefixes=prefixes_ + prefixes
+            + _repr_attrs(self, ['nproc'], default=1)
+            + _repr_attrs(self, ['executor']))
+
+
+    def _iter_results(self, measure, datasets):
+        """Yield results of the measure (or the exception if it failed)
+        """
+        nproc = self.nproc
+        if nproc is None:
+            nproc = get_nproc(getattr(self.executor, 'max_workers', None))
+        if nproc == 1 and self.executor is None:
+            for permuted_ds in datasets:
+                yield _call_permuted(measure, permuted_ds,
+                                     seed=mvpa2.get_random_seed())
+            return
+        executor, own_executor = get_executor(self.executor, nproc)
+        # workers which could run concurrently within the same process
+        # need independent copies of the measure, and must not reseed
+        # the RNG while permutations are drawn from it
+        isolated = getattr(executor, 'isolated', False)
+        copy_measure = copy.copy if isolated else copy.deepcopy
+
+        def calls():
+            for permuted_ds in datasets:
+                # seed is drawn regardless to keep the sequence of
+                # permutations the same for any executor
+                seed = mvpa2.get_random_seed()
+                yield (_call_permuted,
+                       (copy_measure(measure), permuted_ds),
+                       dict(seed=seed if isolated else None))
+        try:
+            for res in iter_results(
+                    executor, calls(),
+                    limit=getattr(executor, 'max_workers', nproc)):
+                yield res
+        finally:
+            if own_executor:
+                executor.shutdown()
 
 
     def fit(self, measure, ds):
         """Fit the distribution by performing multiple cycles which repeatedly
         permuted labels in the training dataset.
 
+        Results of all permutations are stored as they come into a single
+        (nelements x npermutations) buffer, rows of which are then used to
+        fit the distribution for each element of the measure.
+
         Parameters
         ----------
         measure: Measure or None
@@ -372,9 +561,6 @@ class MCNullDist(NullDist):
         ds: `Dataset` which gets permuted and used to compute the
           measure/transfer error multiple times.
         """
-        # TODO: place exceptions separately so we could avoid circular imports
-        from mvpa2.base.learner import LearnerError
-
         # prefer the already assigned measure over anything the was passed to
         # the function.
         # XXX that is a bit awkward but is necessary to keep the code changes
@@ -383,8 +569,14 @@ class MCNullDist(NullDist):
             measure = self._measure
             measure.untrain()
 
-        dist_samples = []
+        # permuting labels does not change a kernel among samples, hence a
+        # cached one is computed only once for all permutations
+        ds = cache_learner_kernel(getattr(measure, 'learner', measure), ds)
+
+        dist_samples = None
         """Holds the values for randomized labels."""
+        nperms = 0                      # # of stored permutations
+        count = getattr(self.__permutator, 'count', None) or 16
 
         # estimate null-distribution
         # TODO this really needs to be more clever! If data samples are
@@ -393,61 +585,71 @@ class MCNullDist(NullDist):
         # null-distribution of transfer errors can be reduced dramatically
         # when the *right* permutations (the ones that matter) are done.
         skipped = 0                     # # of skipped permutations
-        for p, permuted_ds in enumerate(self.__permutator.generate(ds)):
+        for p, res in enumerate(self._iter_results(
+                measure, self.__permutator.generate(ds))):
             # new permutation all the time
             # but only permute the training data and keep the testdata constant
             #
             if __debug__:
                 debug('STATMC', "Doing %i permutations: %i" \
-                      % (self.__permutator.count, p+1), cr=True)
+                      % (count, p+1), cr=True)
 
-            # compute and store the measure of this permutation
-            # assume it has `TransferError` interface
-            try:
-                res = measure(permuted_ds)
-                dist_samples.append(res.samples)
-            except LearnerError, e:
+            if isinstance(res, Exception):
                 if __debug__:
                     debug('STATMC', " skipped", cr=True)
                 warning('Failed to obtain value from %s due to %s.  Measurement'
                         ' was skipped, which could lead to unstable and/or'
-                        ' incorrect assessment of the null_dist' % (measure, e))
+                        ' incorrect assessment of the null_dist' % (measure, res))
                 skipped += 1
                 continue
+            samples = np.asanyarray(res.samples)
+            if dist_samples is None:
+                res_shape = samples.shape
+                # floating point, so later results would not get truncated
+                # if the first one happened to be of an integer dtype
+                dist_samples = np.empty(
+                    (samples.size, count),
+                    dtype=np.result_type(samples.dtype, float))
+            elif nperms == dist_samples.shape[1]:
+                # permutator provided more than it announced
+                dist_samples = np.hstack((dist_samples,
+                                          np.empty_like(dist_samples)))
+            dist_samples[:, nperms] = samples.ravel()
+            nperms += 1
 
         self.ca.skipped = skipped
 
         if __debug__:
             debug('STATMC', ' Skipped: %d permutations' % skipped)
 
-        if not len(dist_samples) and skipped > 0:
+        if not nperms and skipped > 0:
             raise RuntimeError(
                 'Failed to obtain any value from %s. %d measurements were '
                 'skipped. Check above warnings, and your code/data'
                 % (measure, skipped))
-        # store samples as (npermutations x nsamples x nfeatures)
-        dist_samples = np.asanyarray(dist_samples)
+        if dist_samples is None:
+            # nothing was computed at all
+            res_shape = (0,)
+            dist_samples = np.empty((0, 0))
+        if nperms < dist_samples.shape[1]:
+            # compact, so rows stay contiguous
+            dist_samples = dist_samples[:, :nperms].copy()
         # for the ca storage use a dataset with
         # (nsamples x nfeatures x npermutations) to make it compatible with the
         # result dataset of the measure
-        self.ca.dist_samples = Dataset(np.rollaxis(dist_samples,
-                                       0, len(dist_samples.shape)))
-
-        # fit distribution per each element
+        self.ca.dist_samples = Dataset(
+            dist_samples.reshape(res_shape + (nperms,)))
 
-        # to decide either it was done on scalars or vectors
-        shape = dist_samples.shape
-        nshape = len(shape)
-        # if just 1 dim, original data was scalar, just create an
-        # artif dimension for it
-        if nshape == 1:
-            dist_samples = dist_samples[:, np.newaxis]
+        if self._dist_class is Nonparametric:
+            # all at once, sorting in place unless samples are exposed
+            self._dist = NonparametricArray(
+                dist_samples,
+                inplace=not self.ca.is_enabled('dist_samples'))
+            return
 
         # fit per each element.
-        # XXX could be more elegant? may be use np.vectorize?
-        dist_samples_rs = dist_samples.reshape((shape[0], -1))
         dist = []
-        for samples in dist_samples_rs.T:
+        for samples in dist_samples:
             params = self._dist_class.fit(samples)
             if __debug__ and 'STAT__' in debug.active:
                 debug('STAT', 'Estimated parameters for the %s are %s'
@@ -479,6 +681,10 @@ class MCNullDist(NullDist):
                   ' elements, whenever now queried with %d elements' \
                   % (len(self._dist), len(x))
 
+        if isinstance(self._dist, NonparametricArray):
+            # vectorized for all elements
+            return getattr(self._dist, cdf_func)(x).reshape(xshape)
+
         # extract cdf values per each element
         if cdf_func == 'cdf':
             cdfs = [ dist.cdf(v) for v, dist in zip(x, self._dist) ]
@@ -507,6 +713,197 @@ class MCNullDist(NullDist):
         """
         self._dist = []
 
+    permutator = property(fget=lambda self: self.__permutator)
+
+
+
+class SequentialMCNullDist(MCNullDist):
+    """Monte-Carlo null distribution with sequential stopping per element
+
+    Permutations are done in rounds of `step` permutations, and an element
+    (e.g. a feature) is no longer permuted after the round in which
+    `nexceedances` of its null samples were found at least as extreme as the
+    observed value, i.e. as soon as it is evidently not significant (Besag &
+    Clifford, 1991, Biometrika 78(2), 301-304).  All values computed within
+    that round are still used for the distribution, so `npermutations`
+    reflects exactly what was computed for each element.  Only elements
+    close to or beyond the threshold get all the permutations provided by
+    the permutator.  The observed value is computed in `fit()` by calling
+    the measure on the original dataset.
+
+    The number of computations gets reduced only if the measure could be
+    computed for a subset of features: `FeaturewiseMeasure` gets the
+    dataset with only the features still being permuted, and searchlights
+    get their `roi_ids` restricted to those centers.  Any other measure
+    still gets computed for all features, and permutations stop only
+    once all of the elements are settled.
+    """
+
+    npermutations = ConditionalAttribute(enabled=False,
+        doc='Number of permutations done for each element')
+
+    def __init__(self, permutator, nexceedances=10, step=10, **kwargs):
+        """
+        Parameters
+        ----------
+        permutator : Node
+          Node instance that generates permuted datasets.  Its `count`
+          determines the maximal number of permutations.
+        nexceedances : int
+          Number of null samples at least as extreme as the observed value
+          (in the tail of interest, the smaller of the two for 'any' and
+          'both' tails) for an element to stop being permuted.
+        step : int
+          Number of permutations done (possibly in parallel) between checks
+          which elements are settled.
+        """
+        MCNullDist.__init__(self, permutator, **kwargs)
+        self.nexceedances = nexceedances
+        self.step = step
+
+    def __repr__(self, prefixes=None):
+        if prefixes is None:
+            prefixes = []
+        return super(SequentialMCNullDist, self).__repr__(
+            prefixes=prefixes
+            + _repr_attrs(self, ['nexceedances', 'step'], default=10))
+
+
+    def _get_restricted(self, measure, observed, fids):
+        """Return measure, dataset transformation and feature ids of results
+
+        to compute the measure only for the features `fids` of its results.
+        """
+        # TODO: place FeaturewiseMeasure separately to avoid circular imports
+        from mvpa2.measures.base import FeaturewiseMeasure
+        identity = lambda ds: ds
+        if len(fids) == observed.nfeatures:
+            pass
+        elif isinstance(measure, FeaturewiseMeasure):
+            return measure, lambda ds: ds[:, fids], fids
+        elif hasattr(measure, 'roi_ids') and 'center_ids' in observed.fa:
+            # searchlight -- just limit it to the centers of interest
+            measure = copy.copy(measure)
+            measure.roi_ids = observed.fa.center_ids[fids]
+            return measure, identity, fids
+        return measure, identity, np.arange(observed.nfeatures)
+
+
+    def fit(self, measure, ds):
+        """Fit the distribution by permuting labels until values are settled
+
+        Parameters
+        ----------
+        measure: Measure or None
+          A measure used to compute the results from shuffled data. Can be None
+          if a measure instance has been provided to the constructor.
+        ds: `Dataset` which gets permuted and used to compute the
+          measure/transfer error multiple times.
+        """
+        if self._measure is not None:
+            measure = self._measure
+            measure.untrain()
+
+        observed = measure(ds)
+        if not is_datasetlike(observed):
+            observed = Dataset(np.atleast_2d(observed))
+        if self._measure is not None:
+            measure.untrain()
+        obs = np.asanyarray(observed.samples, dtype=float).ravel()
+        nsamples, nfeatures = observed.shape
+        nelements = len(obs)
+        count = self.permutator.count
+
+        # null samples of each element in the first npermutations columns
+        dist_samples = np.empty((nelements, count))
+        dist_samples.fill(np.nan)
+        npermutations = np.zeros(nelements, dtype=int)
+        nright = np.zeros(nelements, dtype=int)
+        nleft = np.zeros(nelements, dtype=int)
+        active = np.ones(nelements, dtype=bool)
+        skipped = 0
+        permutations = self.permutator.generate(ds)
+        while np.any(active):
+            datasets = list(itertools.islice(permutations, self.step))
+            if not len(datasets):
+                break
+            measure_, restrict, fids = self._get_restricted(
+                measure, observed,
+                np.where(active.reshape(nsamples, nfeatures).any(axis=0))[0])
+            if __debug__:
+                debug('STATMC', "Permuting %i out of %i features after %i "
+                      "permutations"
+                      % (len(fids), nfeatures, npermutations.max()), cr=True)
+            # elements of the results of the restricted measure
+            elements = (np.arange(nsamples)[:, None] * nfeatures
+                        + fids[None]).ravel()
+            for res in self._iter_results(
+                    measure_, (restrict(d) for d in datasets)):
+                if isinstance(res, Exception):
+                    warning('Failed to obtain value from %s due to %s.  '
+                            'Measurement was skipped, which could lead to '
+                            'unstable and/or incorrect assessment of the '
+                            'null_dist' % (measure, res))
+                    skipped += 1
+                    continue
+                # keep all computed values, even for elements settled
+                # within this round
+                values = np.asanyarray(res.samples).ravel()
+                ids = elements
+                dist_samples[ids, npermutations[ids]] = values
+                npermutations[ids] += 1
+                nright[ids] += values >= obs[ids]
+                nleft[ids] += values <= obs[ids]
+                if self.tail == 'right':
+                    nexceeded = nright[ids]
+                elif self.tail == 'left':
+                    nexceeded = nleft[ids]
+                else:
+                    nexceeded = np.minimum(nright[ids], nleft[ids])
+                active[ids[nexceeded >= self.nexceedances]] = False
+
+        self.ca.skipped = skipped
+        if not npermutations.max() and skipped > 0:
+            raise RuntimeError(
+                'Failed to obtain any value from %s. %d measurements were '
+                'skipped. Check above warnings, and your code/data'
+                % (measure, skipped))
+        if __debug__:
+            debug('STATMC', ' Done %d permutations in total instead of %d'
+                  % (npermutations.sum(), nelements * count))
+        self.ca.npermutations = npermutations.reshape(observed.shape)
+        # missing values are NaNs
+        self.ca.dist_samples = Dataset(
+            dist_samples.reshape(observed.shape + (count,)))
+
+        if self._dist_class is Nonparametric:
+            self._dist = NonparametricArray(
+                dist_samples, nsamples=npermutations,
+                inplace=not self.ca.is_enabled('dist_samples'))
+            return
+
+        dist = []
+        for samples, n in zip(dist_samples, npermutations):
+            params = self._dist_class.fit(samples[:n])
+            dist.append(self._dist_class(*params))
+        self._dist = dist
+
+
+def _call_permuted(measure, ds, seed=None):
+    """Compute the measure on a permuted dataset
+
+    Returns the exception instead of the result if the measure failed to be
+    computed, so the permutation could be skipped.  If `seed` is provided,
+    the measure is computed with RNGs seeded with it.
+    """
+    # TODO: place exceptions separately so we could avoid circular imports
+    from mvpa2.base.learner import LearnerError
+    if seed is not None:
+        return call_seeded(seed, _call_permuted, measure, ds)
+    try:
+        return measure(ds)
+    except LearnerError, e:
+        return e
 
 
 class FixedNullDist(NullDist):
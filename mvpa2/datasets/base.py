@@ -15,7 +15,8 @@ import copy
 
 from mvpa2.base import warning
 from mvpa2.base.dataset import AttrDataset
-from mvpa2.base.dataset import _expand_attribute
+from mvpa2.base.dataset import _expand_attribute, _get_slicing_args, \
+     _slice_samples, _slice_attributes, _copy_dataset_attributes
 from mvpa2.misc.support import idhash as idhash_
 from mvpa2.mappers.base import ChainMapper
 from mvpa2.featsel.base import StaticFeatureSelection
@@ -109,7 +110,8 @@ class Dataset(AttrDataset):
             return self[self.sa.match(sadict, strict=strict),
                         self.fa.match(fadict, strict=strict)]
 
-    def __getitem__(self, args):
+    def _resolve_slicing_args(self, args):
+        """Turn selection dicts and multi-dimensional masks into selectors"""
         # uniformize for checks below; it is not a tuple if just single slicing
         # spec is passed
         if not isinstance(args, tuple):
@@ -130,7 +132,10 @@ class Dataset(AttrDataset):
                 args_.append(col.match(arg))
             else:
                 args_.append(arg)
-        args = tuple(args_)
+        return tuple(args_)
+
+    def __getitem__(self, args):
+        args = self._resolve_slicing_args(args)
 
         # let the base do the work
         ds = super(Dataset, self).__getitem__(args)
@@ -145,15 +150,7 @@ class Dataset(AttrDataset):
             # slice samples and feature axis at the same time. Moreover, the
             # mvpa2.base.dataset.Dataset has no clue about mappers and should
             # be fully functional without them.
-            subsetmapper = StaticFeatureSelection(
-                args[1],
-                dshape=self.samples.shape[1:])
-            # do not-act forward mapping to charge the output shape of the
-            # slice mapper without having it to train on a full dataset (which
-            # is most likely more expensive)
-            subsetmapper.forward(np.zeros((1,) + self.shape[1:], dtype='bool'))
-            # mapper is ready to use -- simply store
-            ds._append_mapper(subsetmapper)
+            ds._append_mapper(_get_subset_mapper(args[1], self.shape[1:]))
 
         return ds
 
@@ -448,6 +445,159 @@ class Dataset(AttrDataset):
 dataset_wizard = Dataset.from_wizard
 
 
+def _get_subset_mapper(featsel, dshape):
+    """Mapper for a selection of features from samples of a given shape"""
+    subsetmapper = StaticFeatureSelection(featsel, dshape=dshape)
+    # do not-act forward mapping to charge the output shape of the
+    # slice mapper without having it to train on a full dataset (which
+    # is most likely more expensive)
+    subsetmapper.forward(np.zeros((1,) + dshape, dtype='bool'))
+    return subsetmapper
+
+
+class DatasetView(Dataset):
+    """Lazy selection of samples and features of a dataset.
+
+    A view only stores the selection of samples and features of a parent
+    dataset. The samples, and each of the attribute collections (``sa``,
+    ``fa``, ``a``), are sliced from the parent upon their first access --
+    in the same way as ``dataset[samples, features]`` would do. Hence a view
+    created for just querying its shape, or a subset of its collections, is
+    almost free. Otherwise a view behaves like any other dataset, and slicing
+    it yields another view of the same parent.
+
+    As for any slicing, changes to the parent that are done after the view
+    was created, but before the respective part was materialized, will be
+    visible in the view.
+
+    Views are created with `DatasetView.from_dataset()`. Instantiating this
+    class with samples and attributes (e.g. when copying a view) yields a
+    regular, fully materialized dataset.
+    """
+    def __init__(self, samples, sa=None, fa=None, a=None):
+        self._dataset = None
+        self._selection = None
+        self._samples = self._sa = self._fa = self._a = None
+        Dataset.__init__(self, samples, sa=sa, fa=fa, a=a)
+
+    @classmethod
+    def from_dataset(cls, dataset, samples=slice(None), features=slice(None)):
+        """Create a view for a selection of samples and features of a dataset
+
+        Parameters
+        ----------
+        dataset : Dataset
+          Parent dataset.
+        samples : slice or array or int, optional
+          Selection of samples (anything suitable for slicing a dataset).
+        features : slice or array or int, optional
+          Selection of features (anything suitable for slicing a dataset).
+        """
+        args = (samples, features)
+        if isinstance(dataset, Dataset):
+            args = dataset._resolve_slicing_args(args)
+        selection = _get_slicing_args(args)
+        if isinstance(dataset, DatasetView) and dataset._is_lazy():
+            # refer to the origin to avoid chains of views
+            shape = dataset._dataset.shape
+            selection = [_compose_selection(sel, subsel, n)
+                         for sel, subsel, n in zip(dataset._selection,
+                                                   selection, shape)]
+            dataset = dataset._dataset
+        view = cls.__new__(cls)
+        view._dataset = dataset
+        view._selection = selection
+        view._samples = view._sa = view._fa = view._a = None
+        return view
+
+    def _is_lazy(self):
+        """Whether nothing of the view has been materialized yet"""
+        return self._dataset is not None \
+               and self._samples is None and self._sa is None \
+               and self._fa is None and self._a is None
+
+    def __getitem__(self, args):
+        return self.from_dataset(self, *_get_slicing_args(args))
+
+    def __reduce__(self):
+        # store as a plain dataset
+        return (Dataset,
+                (self.samples, dict(self.sa), dict(self.fa), dict(self.a)))
+
+    def _get_samples(self):
+        if self._samples is None:
+            self._samples = _slice_samples(self._dataset.samples,
+                                           self._selection)
+        return self._samples
+
+    def _set_samples(self, samples):
+        self._samples = samples
+
+    def _get_sa(self):
+        if self._sa is None:
+            self._sa = _slice_attributes(self._dataset.sa, self._selection[0],
+                                         self.shape[0])
+        return self._sa
+
+    def _set_sa(self, sa):
+        self._sa = sa
+
+    def _get_fa(self):
+        if self._fa is None:
+            self._fa = _slice_attributes(self._dataset.fa, self._selection[1],
+                                         self.shape[1])
+        return self._fa
+
+    def _set_fa(self, fa):
+        self._fa = fa
+
+    def _get_a(self):
+        if self._a is None:
+            self._a = _copy_dataset_attributes(self._dataset.a)
+            featsel = self._selection[1]
+            if 'mapper' in self._a and not (isinstance(featsel, slice)
+                                            and featsel == slice(None)):
+                # same as for slicing: record the feature selection
+                self._append_mapper(
+                    _get_subset_mapper(featsel, self._dataset.shape[1:]))
+        return self._a
+
+    def _set_a(self, a):
+        self._a = a
+
+    def _get_shape(self):
+        if self._samples is None:
+            return tuple(_get_selection_length(sel, n)
+                         for sel, n in zip(self._selection,
+                                           self._dataset.shape))
+        return self._samples.shape
+
+    samples = property(fget=_get_samples, fset=_set_samples)
+    sa = property(fget=_get_sa, fset=_set_sa)
+    fa = property(fget=_get_fa, fset=_set_fa)
+    a = property(fget=_get_a, fset=_set_a)
+    shape = property(fget=_get_shape)
+
+
+def _get_selection_length(sel, n):
+    """Number of elements a selector picks from a sequence of length n"""
+    if isinstance(sel, slice):
+        return len(xrange(*sel.indices(n)))
+    sel = np.asanyarray(sel)
+    if sel.dtype == np.bool:
+        return int(np.sum(sel))
+    return len(sel)
+
+
+def _compose_selection(sel, subsel, n):
+    """Selector equivalent to applying subsel after sel"""
+    if isinstance(subsel, slice) and subsel == slice(None):
+        return sel
+    if isinstance(sel, slice) and sel == slice(None):
+        return subsel
+    return np.arange(n)[sel][subsel]
+
+
 class HollowSamples(object):
     """Samples container that doesn't store samples.
 
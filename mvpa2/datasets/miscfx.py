@@ -263,13 +263,12 @@ def get_samples_by_attr(dataset, attr, values, sort=True):
            or isinstance(values, basestring):
         values = [ values ]
 
-    # TODO: compare to plain for loop through the targets
-    #       on a real data example
-    sel = np.array([], dtype=np.int16)
-    sa = dataset.sa
-    for value in values:
-        sel = np.concatenate((
-            sel, np.where(sa[attr].value == value)[0]))
+    # sample indices for each unique value are determined only once
+    col = dataset.sa[attr]
+    groups = dict(zip(col.unique, col.groups))
+    none = np.array([], dtype=int)
+    sel = np.concatenate([none] + [groups.get(value, none)
+                                   for value in values])
 
     if sort:
         # place samples in the right order
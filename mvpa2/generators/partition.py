@@ -16,6 +16,7 @@ from mvpa2.base.dochelpers import _repr_attrs
 from mvpa2.support.utils import deprecated
 
 from mvpa2.base.node import Node
+from mvpa2.base.collections import _get_group_indices
 from mvpa2.datasets.miscfx import coarsen_chunks
 import mvpa2.misc.support as support
 
@@ -34,6 +35,8 @@ class Partitioner(Node):
     Partitioning is done by adding a sample attribute that assigns samples to an
     arbitrary number of partitions. Subclasses offer a variety of partitioning
     technique that are useful in e.g. cross-validation procedures.
+    Alternatively, `generate_indices()` yields the sample indices of each
+    partition, without creating any dataset.
 
     it is important to note that other than adding a new sample attribute input
     datasets are not modified. In particular, there is no splitting of datasets
@@ -132,6 +135,33 @@ class Partitioner(Node):
             yield pds
 
 
+    def generate_indices(self, ds):
+        """Yield the sample indices of all partitions for each partition set.
+
+        This is the index-only counterpart of `generate()`: no dataset copies
+        are made, and no attribute is added. The indices can be used to slice
+        the input dataset, or to create a `DatasetView` of it, only when and
+        where the samples are actually needed.
+
+        Parameters
+        ----------
+        ds : Dataset
+          Input dataset
+
+        Returns
+        -------
+        generator
+          For each partition set a list of sorted integer index arrays is
+          yielded. The array at position ``i`` contains the indices of all
+          samples that `generate()` would assign the partition value ``i``,
+          i.e. the first array holds the samples that are not part of any
+          partition.
+        """
+        for parts in self.get_partition_specs(ds):
+            pattr = self.get_partitions_attr(ds, parts)
+            yield _get_group_indices(pattr, len(parts) + 1)
+
+
     def get_partitions_attr(self, ds, specs):
         """Create a partition attribute array for a particular partition spec.
 
@@ -152,15 +182,17 @@ class Partitioner(Node):
         none_specs = 0
         cum_filter = None
 
-        splitattr_data = ds.sa[self.__attr].value
+        # membership is determined per unique value, and then expanded to
+        # all samples
+        uniques, codes = ds.sa[self.__attr].factorized
         # for each partition in this set
         for spec in specs:
             if spec is None:
                 filters.append(None)
                 none_specs += 1
             else:
-                filter_ = np.array([ i in spec \
-                                    for i in splitattr_data], dtype='bool')
+                filter_ = np.array([ i in spec for i in uniques],
+                                   dtype='bool')[codes]
                 filters.append(filter_)
                 if cum_filter is None:
                     cum_filter = filter_
@@ -616,6 +648,13 @@ class FactorialPartitioner(Partitioner):
             yield pds
 
 
+    def generate_indices(self, ds):
+        # partitions are only known after combining the subordinate ones
+        for pds in self.generate(ds):
+            pattr = pds.sa[self.space].value
+            yield _get_group_indices(pattr, pattr.max() + 1)
+
+
 class ExcludeTargetsCombinationsPartitioner(Node):
     """Exclude combinations for a given partition from other partitions
 
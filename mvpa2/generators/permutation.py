@@ -129,7 +129,7 @@ class AttributePermutator(Node):
             raise ValueError("Unknown permutation strategy %r" % self.strategy)
 
         if self.chunk_attr is not None:
-            permute_kwargs['chunks'] = ds.sa[self.chunk_attr].value
+            permute_kwargs['chunks'] = ds.sa[self.chunk_attr]
 
         for i in xrange(10):  # for the case of assure_permute
             # shallow copy of the dataset for output
@@ -218,14 +218,14 @@ class AttributePermutator(Node):
                 pa.value[i] = out_v
 
     @staticmethod
-    def _permute_chunks_sanity_check(in_pattrs, chunks, uniques):
+    def _permute_chunks_sanity_check(in_pattrs, groups):
         #  Verify that we are not dealing with some degenerate scenario
 
         for in_pattr in in_pattrs:
-            sample_targets = in_pattr.value[np.where(chunks == uniques[0])]
+            sample_targets = in_pattr.value[groups[0]]
 
-            for orig in uniques[1:]:
-                chunk_targets = in_pattr.value[np.where(chunks == orig)]
+            for group in groups[1:]:
+                chunk_targets = in_pattr.value[group]
                 # must be of the same length
                 if np.any(chunk_targets != sample_targets):
                     # Escape as early as possible
@@ -241,20 +241,20 @@ class AttributePermutator(Node):
         if chunks is None:
             raise ValueError("Missing 'chunk_attr' for strategy='chunk'")
 
-        uniques = np.unique(chunks)
+        # sample indices of each chunk
+        groups = chunks.groups
 
-        if __debug__ and len(uniques):
+        if __debug__ and len(groups):
             # Somewhat a duplication, since could be checked within the loop,
             # but IMHO makes it cleaner and shouldn't be that big of an impact
-            self._permute_chunks_sanity_check(in_pattrs, chunks, uniques)
+            self._permute_chunks_sanity_check(in_pattrs, groups)
 
         for in_pattr, out_pattr in zip(in_pattrs, out_pattrs):
-            shuffled = uniques.copy()
+            shuffled = np.arange(len(groups))
             rng.shuffle(shuffled)
 
-            for orig, new in zip(uniques, shuffled):
-                out_pattr.value[np.where(chunks == orig)] = \
-                    in_pattr.value[np.where(chunks == new)]
+            for orig, new in zip(groups, shuffled):
+                out_pattr.value[orig] = in_pattr.value[groups[new]]
 
     def generate(self, ds):
         """Generate the desired number of permuted datasets."""
@@ -33,7 +33,7 @@ class Splitter(Node):
     may be provided.
     """
     def __init__(self, attr, attr_values=None, count=None, noslicing=False,
-                 reverse=False, ignore_values=None, **kwargs):
+                 reverse=False, ignore_values=None, view=False, **kwargs):
         """
         Parameters
         ----------
@@ -62,6 +62,11 @@ class Splitter(Node):
           If not None, this is a list of value of the ``attr`` the shall be
           ignored when determining the splits. This settings also affects
           any specified ``attr_values``.
+        view : bool
+          If True, splits are yielded as `DatasetView` instances that only
+          store the selection of samples (or features). Samples and attributes
+          are copied from the input dataset only when first accessed, e.g.
+          by a learner that needs the actual data.
         """
         Node.__init__(self, space=attr, **kwargs)
         self.__splitattr_values = attr_values
@@ -69,6 +74,7 @@ class Splitter(Node):
         self.__count = count
         self.__noslicing = noslicing
         self.__reverse = reverse
+        self.__view = view
 
 
     def generate(self, ds):
@@ -89,6 +95,10 @@ class Splitter(Node):
         """
         # localbinding
         noslicing = self.__noslicing
+        view = self.__view
+        if view:
+            # avoid circular import
+            from mvpa2.datasets.base import DatasetView
         count = self.__count
         splattr = self.get_space()
         ignore = self.__splitattr_ignore
@@ -143,11 +153,17 @@ class Splitter(Node):
             if collection is ds.sa:
                 if __debug__:
                     debug('SPL', 'Split along samples axis')
-                split_ds = ds[filter_]
+                if view:
+                    split_ds = DatasetView.from_dataset(ds, samples=filter_)
+                else:
+                    split_ds = ds[filter_]
             elif collection is ds.fa:
                 if __debug__:
                     debug('SPL', 'Split along feature axis')
-                split_ds = ds[:, filter_]
+                if view:
+                    split_ds = DatasetView.from_dataset(ds, features=filter_)
+                else:
+                    split_ds = ds[:, filter_]
             else:
                 RuntimeError("This should never happen.")
 
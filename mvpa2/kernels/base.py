@@ -31,7 +31,7 @@ if __debug__:
     from mvpa2.base import debug
 
 __all__ = ['Kernel', 'NumpyKernel', 'CustomKernel', 'PrecomputedKernel',
-           'CachedKernel']
+           'CachedKernel', 'cache_learner_kernel']
 
 class Kernel(ClassWithCollections):
     """Abstract class which calculates a kernel function between datasets
@@ -283,10 +283,11 @@ class CachedKernel(NumpyKernel):
 
     The cache is asymmetric for lhs and rhs, so compute(d1, d2) does not create
     a cache usable for compute(d2, d1).
-    """
 
-    # TODO: Figure out how to design objects like CrossValidation etc to
-    # precompute this kernel automatically, making it transparent to the user
+    `CrossValidation` and `MCNullDist` cache the kernel of a learner on the
+    entire input dataset automatically (see `cache_learner_kernel`), hence
+    all folds and all permutations of the labels reuse the same cache.
+    """
 
     @property
     def __kernel_name__(self):
@@ -331,6 +332,18 @@ class CachedKernel(NumpyKernel):
         self.params.reset()
         # TODO: store params representation for later comparison
 
+    def is_cached(self, ds):
+        """Whether the kernel among all samples of a dataset is cached
+        """
+        if self._lhsids is None or not self._rhsids is self._lhsids \
+           or len(self.params.which_set()):
+            return False
+        try:
+            self._lhsids(ds)
+        except (KeyError, AttributeError):
+            return False
+        return True
+
     def compute(self, ds1, ds2=None, force=False):
         """Automatically computes and caches the kernel or extracts the
         relevant part of a precached kernel into self._k
@@ -378,6 +391,42 @@ class CachedKernel(NumpyKernel):
                   % dict(inst=self, ds1=ds1, ds2=ds2))
 
 
+def cache_learner_kernel(learner, ds):
+    """Cache the kernel of a learner among all samples of a dataset
+
+    Only learners with a `CachedKernel` as their ``kernel`` parameter are
+    affected. If the kernel is not cached for ``ds`` yet, it is computed on a
+    shallow copy of ``ds`` that receives the sample ids (and the dataset id)
+    used to look up cached values -- the input dataset is not modified.
+
+    Parameters
+    ----------
+    learner : Learner
+      Any learner, or measure.
+    ds : Dataset
+      Dataset which (parts of) will be passed to the learner later on.
+
+    Returns
+    -------
+    Dataset
+      The dataset that should be used with the learner, i.e. ``ds``, or the
+      copy the kernel was cached for. Subsets (and shallow copies, e.g. with
+      permuted labels) of it hit the cache.
+    """
+    params = getattr(learner, 'params', None)
+    if params is None or not 'kernel' in params:
+        return ds
+    kernel = params.kernel
+    if not isinstance(kernel, CachedKernel) or kernel.is_cached(ds):
+        return ds
+    if __debug__:
+        debug('KRN', "Caching kernel of %(learner)s on %(ds)s"
+              % dict(learner=learner, ds=ds))
+    ds = ds.copy(deep=False)
+    kernel.compute(ds, force=True)
+    return ds
+
+
 __BOGUS_NOTES__ = """
 if ds1 is the "derived" dataset as it was computed on:
     * ds2 is None
@@ -85,6 +85,10 @@ class PolyDetrendMapper(Mapper):
     >>> np.sum(np.abs(mds)) < 0.00001
     True
     """
+
+    _batch_nelements = 2**22
+    """Maximal number of sample values to detrend at once"""
+
     polyord = Parameter(1, doc=
           """Order of the Legendre polynomial to remove from the data.  This
           will remove every polynomial up to and including the provided
@@ -321,25 +325,43 @@ class PolyDetrendMapper(Mapper):
                 # let's put that information into the output dataset
                 mds.sa[inspace] = self._polycoords
 
-        # regression for each feature
-        fit = np.linalg.lstsq(regs, ds.samples)
-        # actually we are only interested in the solution
-        # res[0] is (nregr x nfeatures)
-        y = fit[0]
-        # remove all and keep only the residuals
-        if self._secret_inplace_detrend:
-            # if we are in evil mode do evil
-
-            # cast the data to float, since in-place operations below do not
-            # upcast!
-            if np.issubdtype(mds.samples.dtype, np.integer):
-                mds.samples = mds.samples.astype('float')
+        samples = ds.samples
+        nfeatures = samples.shape[1]
+        # features are detrended in blocks to keep the memory footprint
+        # bounded (e.g. for memory-mapped samples)
+        step = max(1, self._batch_nelements // max(1, len(samples)))
+        if nfeatures <= step:
+            # regression for each feature
+            fit = np.linalg.lstsq(regs, samples)
+            # actually we are only interested in the solution
+            # res[0] is (nregr x nfeatures)
+            y = fit[0]
+            # remove all and keep only the residuals
+            if self._secret_inplace_detrend:
+                # if we are in evil mode do evil
+
+                # cast the data to float, since in-place operations below do
+                # not upcast!
+                if np.issubdtype(mds.samples.dtype, np.integer):
+                    mds.samples = mds.samples.astype('float')
+
+                mds.samples -= np.dot(regs, y)
+            else:
+                # important to assign to ensure COW behavior
+                mds.samples = samples - np.dot(regs, y)
+            return mds
 
-            mds.samples -= np.dot(regs, y)
+        if self._secret_inplace_detrend \
+                and not np.issubdtype(samples.dtype, np.integer):
+            residuals = samples
         else:
-            # important to assign to ensure COW behavior
-            mds.samples = ds.samples - np.dot(regs, y)
-
+            residuals = np.empty(samples.shape,
+                                 dtype=np.result_type(samples.dtype, regs.dtype))
+        for i in xrange(0, nfeatures, step):
+            block = slice(i, i + step)
+            y = np.linalg.lstsq(regs, samples[:, block])[0]
+            residuals[:, block] = samples[:, block] - np.dot(regs, y)
+        mds.samples = residuals
         return mds
 
 
@@ -20,7 +20,7 @@ from mvpa2.base.constraints import *
 from mvpa2.datasets import Dataset
 from mvpa2.base.dochelpers import _str, _repr_attrs
 from mvpa2.mappers.base import Mapper
-from mvpa2.misc.support import array_whereequal
+from mvpa2.base.collections import _get_group_indices
 from mvpa2.base.dochelpers import borrowdoc
 
 from mvpa2.misc.transformers import sum_of_abs, max_of_abs, subtract_mean
@@ -218,17 +218,33 @@ class FxMapper(Mapper):
 
         attrs = dict(zip(col.keys(), [[] for i in col]))
 
-        # create a dictionary for all unique elements in all attribute this
-        # mapper should operate on
+        # factorize all attributes this mapper should operate on, and
+        # create a dictionary for all their unique elements
+        factorized = [col[attr].factorized for attr in self.__uattrs]
         self.__attrcombs = dict(zip(self.__uattrs,
-                                [col[attr].unique for attr in self.__uattrs]))
+                                    [f[0] for f in factorized]))
+        # assign each element a code for the combination of its values in
+        # all attributes, and group elements by code -- all in one pass
+        groupcodes = np.zeros(ds.shape[axis], dtype=int)
+        for uniques, codes in factorized:
+            groupcodes = groupcodes * len(uniques) + codes
+        groupcodes, groupidx = np.unique(groupcodes, return_inverse=True)
+        groups = dict(zip(groupcodes,
+                          _get_group_indices(groupidx, len(groupcodes))))
+        nouniques = np.array([], dtype=int)
         # let it generate all combinations of unique elements in any attr
         order = self.order
         order_keys = []
-        for comb in _orthogonal_permutations(self.__attrcombs):
-            selector = reduce(np.multiply,
-                                [array_whereequal(col[attr].value, value)
-                                 for attr, value in comb.iteritems()])
+        for icomb in _orthogonal_permutations(
+                dict([(attr, range(len(self.__attrcombs[attr])))
+                      for attr in self.__uattrs])):
+            comb = dict([(attr, self.__attrcombs[attr][i])
+                         for attr, i in icomb.iteritems()])
+            groupcode = 0
+            for attr in self.__uattrs:
+                groupcode = groupcode * len(self.__attrcombs[attr]) \
+                            + icomb[attr]
+            selector = groups.get(groupcode, nouniques)
 
             # process the samples
             if axis == 0:
@@ -259,7 +275,7 @@ class FxMapper(Mapper):
             elif order == 'occurrence':
                 # First index should be sufficient since we are dealing
                 # with unique non-overlapping groups here (AFAIK ;) )
-                order_keys.append(np.where(selector)[0][0])
+                order_keys.append(selector[0])
 
         if order:
             # reorder our groups using collected "order_keys"
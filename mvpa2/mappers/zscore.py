@@ -47,7 +47,14 @@ class ZScoreMapper(Mapper):
     to perform chunk-wise Z-scoring of plain data arrays.
 
     Reverse-mapping is currently not implemented.
+
+    Parameter estimation and Z-scoring are done for blocks of samples at a
+    time, hence memory-mapped samples are never loaded into memory at once.
     """
+
+    _batch_nelements = 2**22
+    """Maximal number of sample values to process at once"""
+
     def __init__(self, params=None, param_est=None, chunks_attr='chunks',
                  dtype='float64', **kwargs):
         """
@@ -231,33 +238,56 @@ class ZScoreMapper(Mapper):
         return mdata
 
 
+    def _get_block_length(self, samples):
+        """Number of samples to process at once"""
+        return max(1, self._batch_nelements
+                      // max(1, int(np.prod(samples.shape[1:]))))
+
+
     def _compute_params(self, samples):
-        return (np.mean(samples, axis=0), np.std(samples, axis=0))
+        nsamples = samples.shape[0]
+        step = self._get_block_length(samples)
+        if nsamples <= step:
+            return (np.mean(samples, axis=0), np.std(samples, axis=0))
+        # two passes over blocks of samples (same as np.std)
+        if np.issubdtype(samples.dtype, np.integer):
+            dtype = np.float64
+        else:
+            dtype = samples.dtype
+        blocks = xrange(0, nsamples, step)
+        mean = sum([np.sum(samples[i:i + step], axis=0, dtype=dtype)
+                    for i in blocks]) / nsamples
+        var = sum([np.sum((samples[i:i + step] - mean) ** 2, axis=0)
+                   for i in blocks]) / nsamples
+        return (mean, np.sqrt(var))
 
 
     def _zscore(self, samples, mean, std):
-        # de-mean
-        if np.isscalar(mean) or samples.shape[1] == len(mean):
-            mean = np.asanyarray(mean)  # assure array
-            samples -= mean
-        else:
+        if not (np.isscalar(mean) or samples.shape[1] == len(mean)):
             raise RuntimeError("mean should be a per-feature vector. Got: %r"
                                % (mean,))
-
-        # scale
-        if np.isscalar(std):
-            if std == 0:
-                samples[:] = 0
-            else:
-                samples /= std
-        else:
+        mean = np.asanyarray(mean)  # assure array
+        if not np.isscalar(std):
             std = np.asanyarray(std)
             if samples.shape[1] != len(std):
                 raise RuntimeError("std should be a per-feature vector.")
+            # check for invariant features
+            std_nz = std != 0
+            std = std[std_nz]
+
+        step = self._get_block_length(samples)
+        for i in xrange(0, samples.shape[0], step):
+            block = samples[i:i + step]
+            # de-mean
+            block -= mean
+            # scale
+            if np.isscalar(std):
+                if std == 0:
+                    block[:] = 0
+                else:
+                    block /= std
             else:
-                # check for invariant features
-                std_nz = std != 0
-                samples[:, std_nz] /= np.asanyarray(std)[std_nz]
+                block[:, std_nz] /= std
         return samples
 
     params = property(fget=lambda self:self.__params)
@@ -25,7 +25,8 @@ from mvpa2.generators.splitters import Splitter
 #from mvpa2.base.state import ConditionalAttribute
 #from mvpa2.measures.base import Sensitivity
 
-from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
+from mvpa2.misc.neighborhood import IndexQueryEngine, SparseQueryEngine, \
+     Sphere
 
 if __debug__:
     from mvpa2.base import debug
@@ -131,7 +132,7 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
     """
 
     # TODO: implement parallelization (see #67) and then uncomment
-    __init__doc__exclude__ = ['nproc']
+    __init__doc__exclude__ = ['nproc', 'executor']
 
     def __init__(self, generator, queryengine, errorfx=mean_mismatch_error,
                  indexsum=None,
@@ -449,12 +450,18 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         # TODO: needs OPT since this is the step consuming 50% of time
         #       or more allow to cache them entirely so this would
         #       not be an unnecessary burden during permutation testing
+        indexsum = self._indexsum
         if not self.reuse_neighbors or self.__roi_fids is None:
             if __debug__:
                 debug('SLC',
                       'Phase 4. Deducing neighbors information for %i ROIs'
                       % (nrois,))
-            roi_fids = [qe.query_byid(f) for f in roi_ids]
+            if indexsum == 'sparse' and isinstance(qe, SparseQueryEngine):
+                # take precomputed neighborhoods directly, in the same
+                # (feature x roi) layout as produced by inds_to_coo below
+                roi_fids = qe.get_matrix(roi_ids).T
+            else:
+                roi_fids = [qe.query_byid(f) for f in roi_ids]
 
         else:
             if __debug__:
@@ -472,7 +479,10 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
                 roi_sizes = [len(x) for x in roi_fids]
         elif externals.exists('scipy') and isinstance(roi_fids, sps.spmatrix):
             nroi_fids = roi_fids.shape[1]
-            if self.ca.is_enabled('roi_sizes'):
+            if isinstance(roi_fids, sps.csc_matrix):
+                # precomputed by SparseQueryEngine -- sizes are for free
+                roi_sizes = np.diff(roi_fids.indptr).tolist()
+            elif self.ca.is_enabled('roi_sizes'):
                 # very expensive operation, so better not to ask over again
                 # roi_sizes = [roi_fids.getrow(r).nnz for r in range(nroi_fids)]
                 warning("Since 'sparse' trick is used, extracting sizes of "
@@ -486,9 +496,8 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         # those via ds.a  but rather assign directly to self.ca
         self.ca.roi_sizes = roi_sizes
 
-        indexsum = self._indexsum
         if indexsum == 'sparse':
-            if not self.reuse_neighbors or self.__roi_fids is None:
+            if not sps.isspmatrix(roi_fids):
                 if __debug__:
                     debug('SLC',
                           'Phase 4b. Converting neighbors to sparse matrix '
@@ -20,7 +20,9 @@ has to be in some iterable container.
 __docformat__ = 'restructuredtext'
 
 import numpy as np
+import mvpa2
 import mvpa2.support.copy as copy
+from mvpa2._random import call_seeded
 
 from mvpa2.base.node import Node
 from mvpa2.base.learner import Learner
@@ -32,11 +34,13 @@ from mvpa2.base.types import asobjarray
 
 from mvpa2.base.dochelpers import enhanced_doc_string, _str, _repr_attrs
 from mvpa2.base import externals, warning
+from mvpa2.base.parallel import get_executor, get_nproc, iter_results
 from mvpa2.clfs.stats import auto_null_dist
 from mvpa2.base.dataset import AttrDataset, vstack, hstack
 from mvpa2.datasets import Dataset
 from mvpa2.mappers.fx import BinaryFxNode
 from mvpa2.generators.splitters import Splitter
+from mvpa2.kernels.base import cache_learner_kernel
 
 if __debug__:
     from mvpa2.base import debug
@@ -178,6 +182,52 @@ class Measure(Learner):
         return result
 
 
+    def _is_batchable(self):
+        """Either `_call_batch()` is implemented for current parameters
+
+        To be overridden in sub-classes providing `_call_batch()`.
+        """
+        return False
+
+
+    def _call_batch(self, ds, roi_fids):
+        """Compute the measure for a number of ROIs of a dataset at once
+
+        Used by searchlights instead of calling the measure on each ROI
+        separately whenever `is_batchable` is True.
+
+        Parameters
+        ----------
+        ds : Dataset
+          Dataset with all features.
+        roi_fids : array, shape (nrois, max ROI size)
+          Indices of the features in each ROI, padded with -1 for ROIs
+          smaller than the largest one.
+
+        Returns
+        -------
+        list
+          Results for each ROI, as would be returned by calling the measure
+          on ``ds[:, fids]`` of the ROI.
+        """
+        raise NotImplementedError
+
+
+    @property
+    def is_batchable(self):
+        """Either the measure could be computed for many ROIs at once
+
+        Batched computation bypasses training, null distribution estimation,
+        post-processing and passing of attributes, so it is available only
+        if none of them is needed.
+        """
+        return self._is_batchable() \
+               and self.is_trained and not self.force_train \
+               and self.__null_dist is None \
+               and self.get_postproc() is None \
+               and self.pass_attr is None
+
+
     @property
     def null_dist(self):
         """Return Null Distribution estimator"""
@@ -263,6 +313,9 @@ class RepeatedMeasure(Measure):
                  generator=None,
                  callback=None,
                  concat_as='samples',
+                 nproc=1,
+                 executor=None,
+                 reseed=False,
                  **kwargs):
         """
         Parameters
@@ -285,6 +338,26 @@ class RepeatedMeasure(Measure):
           By default, results are 'vstacked' as multiple samples in the output
           dataset. Setting this argument to 'features' will change this to
           'hstacking' along the feature axis.
+        nproc : None or int
+          How many processes to use for running repetitions concurrently.  If
+          None -- all available cores will be used.  Each repetition is run
+          on a deep copy of the node.  Datasets are generated, and the
+          callback, summary statistics and results are collected in the main
+          process in the order of the generated datasets.  Only the values of
+          the conditional attributes of a node copy are sent back from the
+          worker, hence the node passed to the callback is the original
+          (untrained) node carrying the conditional attributes of the
+          respective repetition.  Results of nodes which draw random numbers
+          are reproduced only with `reseed`.
+        executor : None or str or executor
+          Backend to use for parallel computation (see
+          :func:`~mvpa2.base.parallel.get_executor`).
+        reseed : bool, optional
+          If True, RNGs are seeded with a new seed for each repetition and
+          restored afterwards, so results of nodes which draw random numbers
+          do not depend on `nproc` or `executor`, but differ from those
+          without reseeding.  Since threads share the RNG with the main
+          process, it is never reseeded with a thread-based executor.
         """
         Measure.__init__(self, **kwargs)
 
@@ -292,6 +365,9 @@ class RepeatedMeasure(Measure):
         self._generator = generator
         self._callback = callback
         self._concat_as = concat_as
+        self.nproc = nproc
+        self.executor = executor
+        self.reseed = reseed
 
     def __repr__(self, prefixes=None, exclude=None):
         if prefixes is None:
@@ -303,6 +379,9 @@ class RepeatedMeasure(Measure):
             + _repr_attrs(self, [x for x in ['node', 'generator', 'callback']
                                  if not x in exclude])
             + _repr_attrs(self, ['concat_as'], default='samples')
+            + _repr_attrs(self, ['nproc'], default=1)
+            + _repr_attrs(self, ['executor'])
+            + _repr_attrs(self, ['reseed'], default=False)
             )
 
 
@@ -324,17 +403,16 @@ class RepeatedMeasure(Measure):
 
         # run the node an all generated datasets
         results = []
-        for i, sds in enumerate(generator.generate(ds)
-                                if generator
-                                else [ds]):
+        for i, (sds, node, result) in enumerate(
+                self._iter_repetitions(generator.generate(ds)
+                                       if generator
+                                       else [ds])):
             if __debug__:
                 debug('REPM', "%d-th iteration of %s on %s",
                       (i, self, sds))
             if ca.is_enabled("datasets"):
                 # store dataset in ca
                 ca.datasets.append(sds)
-            # run the beast
-            result = node(sds)
             # callback
             if self._callback is not None:
                 self._callback(data=sds, node=node, result=result)
@@ -372,6 +450,56 @@ class RepeatedMeasure(Measure):
         return results
 
 
+    def _iter_repetitions(self, datasets):
+        """Yield (dataset, node, result) for every dataset in order
+
+        The node is the instance that has processed the respective dataset.
+        """
+        node = self._node
+        nproc = self.nproc
+        if nproc is None:
+            nproc = get_nproc(getattr(self.executor, 'max_workers', None))
+        reseed = self.reseed
+        if nproc == 1 and self.executor is None:
+            for sds in datasets:
+                if reseed:
+                    _, result = _call_repetition(
+                        node, sds, seed=mvpa2.get_random_seed())
+                else:
+                    # run the beast
+                    result = node(sds)
+                yield sds, node, result
+            return
+        executor, own_executor = get_executor(self.executor, nproc)
+        # threads must not reseed the RNG the datasets are generated with
+        isolated = getattr(executor, 'isolated', False)
+        # keep a reference to each dataset, while it is being processed
+        pending = []
+        def calls():
+            for sds in datasets:
+                pending.append(sds)
+                seed = None
+                if reseed:
+                    # seed is drawn also for threads to keep the sequence of
+                    # generated datasets the same for any executor
+                    seed = mvpa2.get_random_seed()
+                yield (_call_repetition,
+                       (copy.deepcopy(node), sds),
+                       dict(seed=seed if isolated else None, ca_only=True))
+        try:
+            for ca_values, result in iter_results(
+                    executor, calls(),
+                    limit=getattr(executor, 'max_workers', nproc)):
+                # trained nodes might not be picklable (e.g. libsvm's SVM),
+                # so the original node takes conditional attributes instead
+                for name, value in ca_values.iteritems():
+                    node.ca[name].value = value
+                yield pending.pop(0), node, result
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+
     def _repetition_postcall(self, ds, node, result):
         """Post-processing handler for each repetition.
 
@@ -406,6 +534,22 @@ class RepeatedMeasure(Measure):
     concat_as = property(fget=lambda self: self._concat_as)
 
 
+def _call_repetition(node, ds, seed=None, ca_only=False):
+    """Run a node on a dataset and return the node along with the result
+
+    If `seed` is provided, the node is run with RNGs seeded with it.  With
+    `ca_only`, a dict with the values of the conditional attributes which
+    were set is returned instead of the node.
+    """
+    if seed is not None:
+        return call_seeded(seed, _call_repetition, node, ds, ca_only=ca_only)
+    result = node(ds)
+    if ca_only:
+        return dict((name, node.ca[name].value)
+                    for name in node.ca.which_set()), result
+    return node, result
+
+
 class CrossValidation(RepeatedMeasure):
     """Cross-validate a learner's transfer on datasets.
 
@@ -511,6 +655,8 @@ class CrossValidation(RepeatedMeasure):
     def _call(self, ds):
         # always untrain to wipe out previous stats
         self.untrain()
+        # compute a cached kernel only once for all folds
+        ds = cache_learner_kernel(self.learner, ds)
         return super(CrossValidation, self)._call(ds)
 
 
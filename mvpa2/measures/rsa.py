@@ -22,6 +22,53 @@ from mvpa2.mappers.fx import mean_group_sample
 if externals.exists('scipy', raise_=True):
     from scipy.spatial.distance import pdist, squareform, cdist
     from scipy.stats import rankdata, pearsonr
+    from scipy.special import betainc
+
+# metrics for which dissimilarities could be computed for many ROIs at once
+_batched_metrics = ('correlation', 'cosine', 'euclidean', 'sqeuclidean')
+
+
+def _batched_pdist(data, roi_fids, metric='correlation'):
+    """Compute condensed dissimilarity matrices for many ROIs at once
+
+    Parameters
+    ----------
+    data : array, shape (nsamples, nfeatures)
+    roi_fids : array, shape (nrois, max ROI size)
+      Indices of features in each ROI, padded with -1.
+    metric : str
+      One of `_batched_metrics`, with the same meaning as in `pdist`.
+
+    Returns
+    -------
+    array, shape (nrois, nsamples * (nsamples - 1) / 2)
+      Dissimilarities ordered as in the output of `pdist` for each ROI.
+    """
+    if not metric in _batched_metrics:
+        raise ValueError("Metric %r is not supported for batched computation"
+                         % metric)
+    data = np.asanyarray(data, dtype=float)
+    mask = roi_fids >= 0
+    # nsamples x nrois x max ROI size with padding filled with 0s
+    roi_data = data[:, np.where(mask, roi_fids, 0)] * mask
+    if metric == 'correlation':
+        sizes = mask.sum(axis=1)
+        roi_data -= (roi_data.sum(axis=2) / sizes)[:, :, None]
+        roi_data *= mask
+    gram = np.einsum('irk,jrk->rij', roi_data, roi_data)
+    nsamples = len(data)
+    diag = gram[:, np.arange(nsamples), np.arange(nsamples)]
+    iu, ju = np.triu_indices(nsamples, 1)
+    if metric in ('correlation', 'cosine'):
+        norms = np.sqrt(diag)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosines = gram[:, iu, ju] / (norms[:, iu] * norms[:, ju])
+        # clipped as in pdist, so (anti)parallel vectors get exactly 0 (2)
+        return 1.0 - np.clip(cosines, -1.0, 1.0)
+    dsms = np.clip(diag[:, iu] + diag[:, ju] - 2 * gram[:, iu, ju], 0, None)
+    if metric == 'euclidean':
+        dsms = np.sqrt(dsms)
+    return dsms
 
 
 class CDist(Measure):
@@ -142,6 +189,19 @@ class PDist(Measure):
                           sa=dict(pairs=list(combinations(range(len(ds)), 2))))
         return out
 
+    def _is_batchable(self):
+        return self.params.pairwise_metric in _batched_metrics
+
+    def _call_batch(self, ds, roi_fids):
+        data = ds.samples
+        if self.params.center_data:
+            data = data - np.mean(data, 0)
+        dsms = _batched_pdist(data, roi_fids, self.params.pairwise_metric)
+        if self.params.square:
+            return [Dataset(squareform(dsm), sa=ds.sa) for dsm in dsms]
+        pairs = list(combinations(range(len(ds)), 2))
+        return [Dataset(dsm, sa=dict(pairs=pairs)) for dsm in dsms]
+
 
 class PDistConsistency(Measure):
     """Calculate the correlations of PDist measures across chunks
@@ -287,11 +347,40 @@ class PDistTargetSimilarity(Measure):
         if self.params.comparison_metric == 'spearman':
             dsm = rankdata(dsm)
         rho, p = pearsonr(dsm, self.target_dsm)
+        return self._get_result(rho, p)
+
+    def _get_result(self, rho, p):
         if self.params.corrcoef_only:
             return Dataset([rho], fa={'metrics': ['rho']})
         else:
             return Dataset([[rho, p]], fa={'metrics': ['rho', 'p']})
 
+    def _is_batchable(self):
+        return self.params.pairwise_metric in _batched_metrics
+
+    def _call_batch(self, dataset, roi_fids):
+        data = dataset.samples
+        if self.params.center_data:
+            data = data - np.mean(data, 0)
+        dsms = _batched_pdist(data, roi_fids, self.params.pairwise_metric)
+        if self.params.comparison_metric == 'spearman':
+            dsms = np.apply_along_axis(rankdata, 1, dsms)
+        # Pearson correlation of each DSM with the target one
+        dsms = dsms - dsms.mean(axis=1)[:, None]
+        target = np.asanyarray(self.target_dsm, dtype=float)
+        target = target - target.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rhos = np.dot(dsms, target) \
+                   / np.sqrt(np.sum(dsms ** 2, axis=1) * np.sum(target ** 2))
+        rhos = np.clip(rhos, -1.0, 1.0)
+        # two-sided p-values as computed by pearsonr
+        df = len(target) - 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_squared = rhos ** 2 * (df / ((1.0 - rhos) * (1.0 + rhos)))
+            ps = betainc(0.5 * df, 0.5, df / (df + t_squared))
+        ps[np.abs(rhos) == 1.0] = 0.0
+        return [self._get_result(rho, p) for rho, p in zip(rhos, ps)]
+
 
 class Regression(Measure):
     """
@@ -15,24 +15,30 @@ if __debug__:
 
 import numpy as np
 import tempfile, os
+import glob
 import time
 
 import mvpa2
+from mvpa2._random import call_seeded
 from mvpa2.base import externals, warning
 from mvpa2.base.types import is_datasetlike
 from mvpa2.base.dochelpers import borrowkwargs, _repr_attrs
 from mvpa2.base.progress import ProgressBar
+from mvpa2.base.parallel import get_executor, get_nproc, iter_results, \
+     get_shared_array, get_utilization
 if externals.exists('h5py'):
     # Is optionally required for passing searchlight
     # results via storing/reloading hdf5 files
     from mvpa2.base.hdf5 import h5save, h5load
 
 from mvpa2.datasets import hstack, Dataset
+from mvpa2.datasets.base import DatasetView
 from mvpa2.support import copy
 from mvpa2.featsel.base import StaticFeatureSelection
 from mvpa2.measures.base import Measure
 from mvpa2.base.state import ConditionalAttribute
-from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
+from mvpa2.misc.neighborhood import IndexQueryEngine, SparseQueryEngine, \
+     Sphere
 from mvpa2.mappers.base import ChainMapper
 
 from mvpa2.support.due import due, Doi
@@ -57,7 +63,7 @@ class BaseSearchlight(Measure):
     """Indicate that this measure is always trained."""
 
 
-    def __init__(self, queryengine, roi_ids=None, nproc=None,
+    def __init__(self, queryengine, roi_ids=None, nproc=None, executor=None,
                  **kwargs):
         """
         Parameters
@@ -71,28 +77,27 @@ class BaseSearchlight(Measure):
           feature attribute of the input dataset, whose non-zero values
           determine the feature ids. By default all features will be used.
         nproc : None or int
-          How many processes to use for computation.  Requires `pprocess`
-          external module.  If None -- all available cores will be used.
+          How many processes to use for computation.  If None -- all
+          available cores will be used.
+        executor : None or str or executor
+          Backend to use for parallel computation: 'process', 'thread',
+          'joblib', 'serial', or an instance of a `concurrent.futures`-style
+          executor (see :mod:`~mvpa2.base.parallel`).  If None, 'process'
+          backend is used whenever nproc > 1.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.base.Measure`.
       """
         Measure.__init__(self, **kwargs)
 
-        if nproc is not None and nproc > 1 and not externals.exists('pprocess'):
-            raise RuntimeError("The 'pprocess' module is required for "
-                               "multiprocess searchlights. Please either "
-                               "install python-pprocess, or reduce `nproc` "
-                               "to 1 (got nproc=%i) or set to default None"
-                               % nproc)
+        if isinstance(executor, basestring):
+            # verify early that the backend is known and usable
+            get_executor(executor, 1)[0].shutdown()
 
         self._queryengine = queryengine
-        if roi_ids is not None and not isinstance(roi_ids, str) \
-                and not len(roi_ids):
-            raise ValueError, \
-                  "Cannot run searchlight on an empty list of roi_ids"
-        self.__roi_ids = roi_ids
+        self._set_roi_ids(roi_ids)
         self.nproc = nproc
+        self.executor = executor
 
 
     def __repr__(self, prefixes=None):
@@ -104,7 +109,8 @@ class BaseSearchlight(Measure):
             prefixes = []
         return super(BaseSearchlight, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc']))
+            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc',
+                                 'executor']))
 
 
     @due.dcite(
@@ -121,15 +127,11 @@ class BaseSearchlight(Measure):
         # local binding
         nproc = self.nproc
 
-        if nproc is None and externals.exists('pprocess'):
-            import pprocess
-            try:
-                nproc = pprocess.get_number_of_cores() or 1
-            except AttributeError:
-                warning("pprocess version %s has no API to figure out maximal "
-                        "number of cores. Using 1"
-                        % externals.versions['pprocess'])
-                nproc = 1
+        if nproc is None:
+            # as many as executor instance has workers, or all cores
+            nproc = get_nproc(getattr(self.executor, 'max_workers',
+                                      getattr(self.executor, '_max_workers',
+                                              None)))
         # train the queryengine
         self._queryengine.train(dataset)
 
@@ -190,8 +192,15 @@ class BaseSearchlight(Measure):
         """
         raise NotImplementedError("Must be implemented in the derived classes")
 
+    def _set_roi_ids(self, roi_ids):
+        if roi_ids is not None and not isinstance(roi_ids, str) \
+                and not len(roi_ids):
+            raise ValueError, \
+                  "Cannot run searchlight on an empty list of roi_ids"
+        self.__roi_ids = roi_ids
+
     queryengine = property(fget=lambda self: self._queryengine)
-    roi_ids = property(fget=lambda self: self.__roi_ids)
+    roi_ids = property(fget=lambda self: self.__roi_ids, fset=_set_roi_ids)
 
 
 class Searchlight(BaseSearchlight):
@@ -203,6 +212,16 @@ class Searchlight(BaseSearchlight):
     interest, which is ran at each spatial location.
     """
 
+    worker_utilization = ConditionalAttribute(enabled=False,
+        doc="Estimated fraction of the wall-clock time of the computation "
+            "each worker was busy computing blocks of ROIs (estimated from "
+            "start and end times of the blocks, see "
+            "mvpa2.base.parallel.get_utilization).")
+
+    _batch_nelements = 2 ** 22
+    """Maximal number of elements (ROIs x ROI size x samples) of data to be
+    passed at once to measures supporting batched computation"""
+
     @staticmethod
     def _concat_results(sl=None, dataset=None, roi_ids=None, results=None):
         """The simplest implementation for collecting the results --
@@ -271,6 +290,8 @@ class Searchlight(BaseSearchlight):
                  results_fx=None,
                  tmp_prefix='tmpsl',
                  nblocks=None,
+                 schedule='static',
+                 checkpoint_dir=None,
                  **kwargs):
         """
         Parameters
@@ -288,11 +309,18 @@ class Searchlight(BaseSearchlight):
           Called with all the results computed in a block for possible
           post-processing which needs to be done in parallel instead of serial
           aggregation in results_fx.
-        results_backend : ('native', 'hdf5'), optional
+        results_backend : ('native', 'hdf5', 'shm'), optional
           Specifies the way results are provided back from a processing block
           in case of nproc > 1. 'native' is pickling/unpickling of results by
-          pprocess, while 'hdf5' would use h5save/h5load functionality.
+          the executor, while 'hdf5' would use h5save/h5load functionality.
           'hdf5' might be more time and memory efficient in some cases.
+          'shm' places dataset samples into read-only shared memory, and
+          workers store results of each ROI directly into a preallocated
+          shared output array.  It requires the measure to return a single
+          feature for each ROI, and an executor sharing memory with the
+          calling process ('process', 'thread', 'joblib' or 'serial').
+          Neither feature attributes of per-ROI results, nor custom
+          `results_fx` or `results_postproc_fx` are supported by 'shm'.
         results_fx : callable, optional
           Function to process/combine results of each searchlight
           block run.  By default it would simply append them all into
@@ -301,11 +329,39 @@ class Searchlight(BaseSearchlight):
           care of assigning roi_* ca's
         tmp_prefix : str, optional
           If specified -- serves as a prefix for temporary files storage
-          if results_backend == 'hdf5'.  Thus can specify the directory to use
+          if results_backend is 'hdf5' or 'shm'.  Thus can specify the
+          directory to use
           (trailing file path separator is not added automagically).
         nblocks : None or int
           Into how many blocks to split the computation (could be larger than
-          nproc).  If None -- nproc is used.
+          nproc).  If None -- nproc is used for 'static' `schedule`.
+        schedule : ('static', 'dynamic'), optional
+          How ROIs are distributed among workers.  'static' splits ROIs in
+          their original order into `nblocks` blocks of equal size, and
+          results are passed to `results_fx` block by block as they come.
+          'dynamic' orders ROIs by their estimated cost (number of features
+          in the ROI, known without querying only for precomputed
+          neighborhoods of a `SparseQueryEngine`, otherwise all ROIs are
+          assumed to be equally expensive) and hands out blocks on demand
+          to whichever worker becomes idle, most expensive ones first.
+          Unless `nblocks` is
+          specified, block sizes decrease towards the end of the computation
+          so that workers finish simultaneously even if costs of ROIs vary
+          considerably.  Results are passed to `results_fx` at once in the
+          original order of ROIs.  Handing out blocks on demand requires
+          an executor reporting completion of computations (e.g. 'process'
+          or 'thread'), while with 'joblib' blocks are still dispatched in
+          batches of `nproc`, each waiting for its slowest block.
+        checkpoint_dir : str, optional
+          If specified, results of each block are stored in this directory as
+          soon as the block is computed.  Results for ROIs found in the
+          checkpoints of a previous (e.g. interrupted) run on the same dataset
+          are loaded instead of being recomputed.  Hence `roi_ids` could also
+          be split across independent runs sharing the directory, and a final
+          run across all ROIs would merely merge their results.  Use
+          `nblocks` to control the granularity of checkpoints.  Requires
+          `h5py`, and results_postproc_fx (if any) must retain one result per
+          ROI.  Checkpoints are not removed automatically.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.searchlight.BaseSearchlight`.
@@ -317,10 +373,25 @@ class Searchlight(BaseSearchlight):
         if self.results_backend == 'hdf5':
             # Assure having hdf5
             externals.exists('h5py', raise_=True)
+        elif self.results_backend == 'shm':
+            if results_fx is not None or results_postproc_fx is not None:
+                raise ValueError("results_backend='shm' does not support "
+                                 "custom results_fx or results_postproc_fx")
+        elif self.results_backend != 'native':
+            raise ValueError("Unknown results_backend %r" % results_backend)
+        if checkpoint_dir is not None:
+            externals.exists('h5py', raise_=True)
+            if self.results_backend == 'shm':
+                raise ValueError("results_backend='shm' does not support "
+                                 "checkpointing")
+        self.checkpoint_dir = checkpoint_dir
         self.results_fx = Searchlight._concat_results \
                           if results_fx is None else results_fx
         self.tmp_prefix = tmp_prefix
         self.nblocks = nblocks
+        if not schedule in ('static', 'dynamic'):
+            raise ValueError("Unknown schedule %r" % schedule)
+        self.schedule = schedule
         if isinstance(add_center_fa, str):
             self.__add_center_fa = add_center_fa
         elif add_center_fa:
@@ -338,50 +409,97 @@ class Searchlight(BaseSearchlight):
             + _repr_attrs(self, ['results_postproc_fx'])
             + _repr_attrs(self, ['results_backend'], default='native')
             + _repr_attrs(self, ['results_fx', 'nblocks'])
+            + _repr_attrs(self, ['schedule'], default='static')
+            + _repr_attrs(self, ['checkpoint_dir'])
             )
 
 
     def _sl_call(self, dataset, roi_ids, nproc):
         """Classical generic searchlight implementation
         """
-        assert(self.results_backend in ('native', 'hdf5'))
+        assert(self.results_backend in ('native', 'hdf5', 'shm'))
+        if self.results_backend == 'shm':
+            return self._sl_call_shm(dataset, roi_ids, nproc)
+        done = None
+        todo_ids = roi_ids
+        if self.checkpoint_dir is not None:
+            # skip ROIs computed already
+            done = self._load_checkpoints(dataset, roi_ids)
+            todo_ids = [r for r in roi_ids if not r in done]
+            if __debug__:
+                debug('SLC', "Loaded results for %i out of %i ROIs from "
+                      "checkpoints in %s"
+                      % (len(done), len(roi_ids), self.checkpoint_dir))
+        dynamic = self.schedule == 'dynamic'
+        if dynamic and done is None:
+            # results come in the order of completion
+            done = {}
         # compute
-        if nproc is not None and nproc > 1:
-            # split all target ROIs centers into `nproc` equally sized blocks
-            nproc_needed = min(len(roi_ids), nproc)
-            nblocks = nproc_needed \
-                      if self.nblocks is None else self.nblocks
-            roi_blocks = np.array_split(roi_ids, nblocks)
-
-            # the next block sets up the infrastructure for parallel computing
-            # this can easily be changed into a ParallelPython loop, if we
-            # decide to have a PP job server in PyMVPA
-            import pprocess
-            p_results = pprocess.Map(limit=nproc_needed)
+        executor = own_executor = None
+        nproc_needed = 1
+        if not len(todo_ids):
+            p_results = []
+        elif nproc > 1 or self.executor is not None \
+                or self.nblocks is not None or dynamic:
+            nproc_needed = min(len(todo_ids), nproc)
+            if dynamic:
+                roi_blocks = self._get_cost_ordered_blocks(
+                    dataset, todo_ids, nproc_needed)
+            else:
+                # split all target ROIs centers into equally sized blocks
+                roi_blocks = np.array_split(
+                    todo_ids,
+                    nproc_needed if self.nblocks is None else self.nblocks)
+            nblocks = len(roi_blocks)
+
+            executor, own_executor = get_executor(self.executor, nproc_needed)
             if __debug__:
-                debug('SLC', "Starting off %s child processes for nblocks=%i"
-                      % (nproc_needed, nblocks))
-            compute = p_results.manage(
-                        pprocess.MakeParallel(self._proc_block))
-            for iblock, block in enumerate(roi_blocks):
-                # should we maybe deepcopy the measure to have a unique and
-                # independent one per process?
-                seed = mvpa2.get_random_seed()
-                compute(block, dataset, copy.copy(self.__datameasure),
-                        seed=seed, iblock=iblock)
+                debug('SLC', "Starting off %s workers of %s for nblocks=%i"
+                      % (nproc_needed, executor.__class__.__name__, nblocks))
+            # workers which could run concurrently within the same process
+            # need independent copies of the measure, and must not reseed
+            # the RNG shared with other workers
+            isolated = getattr(executor, 'isolated', False)
+            copy_measure = copy.copy if isolated else copy.deepcopy
+            # results get generated as blocks get computed, and new blocks
+            # get submitted as results get consumed
+            p_results = iter_results(
+                executor,
+                ((self._proc_block_timed,
+                  (block, dataset, copy_measure(self.__datameasure)),
+                  dict(seed=mvpa2.get_random_seed() if isolated else None,
+                       iblock=iblock))
+                 for iblock, block in enumerate(roi_blocks)),
+                limit=nproc_needed, ordered=not dynamic)
         else:
             # otherwise collect the results in an 1-item list
-            p_results = [
-                    self._proc_block(roi_ids, dataset, self.__datameasure)]
+            p_results = [self._proc_block_timed(todo_ids, dataset,
+                                                self.__datameasure)]
 
         # Finally collect and possibly process results
-        # p_results here is either a generator from pprocess.Map or a list.
-        # In case of a generator it allows to process results as they become
-        # available
-        result_ds = self.results_fx(sl=self,
-                                    dataset=dataset,
-                                    roi_ids=roi_ids,
-                                    results=self.__handle_all_results(p_results))
+        # p_results here is either a generator of results from an executor or
+        # a list. In case of a generator it allows to process results as they
+        # become available
+        timings = []
+        try:
+            results = self.__handle_all_results(p_results, timings)
+            if done is not None:
+                # merge with results from checkpoints (or out of order
+                # computed blocks) in the order of roi_ids
+                for block, block_results in results:
+                    done.update(zip(block, block_results))
+                results = [[done[r] for r in roi_ids]]
+            else:
+                results = (block_results for block, block_results in results)
+            result_ds = self.results_fx(
+                sl=self,
+                dataset=dataset,
+                roi_ids=roi_ids,
+                results=results)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        self.ca.worker_utilization = get_utilization(timings, nproc_needed)
 
         # Assure having a dataset (for paranoid ones)
         if not is_datasetlike(result_ds):
@@ -400,7 +518,86 @@ class Searchlight(BaseSearchlight):
         return result_ds
 
 
-    def _proc_block(self, block, ds, measure, seed=None, iblock='main'):
+    def _sl_call_shm(self, dataset, roi_ids, nproc):
+        """Searchlight implementation passing data via shared memory
+        """
+        if not len(roi_ids):
+            # nothing to compute, so there is not even a shape of results
+            return Dataset(np.zeros((0, 0)),
+                           fa=dict(center_ids=np.zeros(0, dtype=int)))
+        # all workers attach to the same read-only copy of the samples
+        samples = get_shared_array(data=dataset.samples,
+                                   prefix=self.tmp_prefix, readonly=True)
+        out = None
+        try:
+            ds = dataset.copy(deep=False)
+            ds.samples = samples
+            # compute the first ROI right here to figure out the shape of
+            # the results to preallocate the output for
+            first = self._proc_block(roi_ids[:1], ds, self.__datameasure)[0]
+            if not is_datasetlike(first):
+                first = Dataset(np.atleast_1d(first))
+            if first.nfeatures != 1:
+                raise ValueError("results_backend='shm' requires a single "
+                                 "feature per ROI. Got %i"
+                                 % first.nfeatures)
+            # floating point, so results of other ROIs would not get
+            # truncated if the first one happened to be of an integer dtype
+            out = get_shared_array((first.nsamples, len(roi_ids)),
+                                   dtype=np.result_type(first.samples.dtype,
+                                                        float),
+                                   prefix=self.tmp_prefix)
+            out[:, 0] = first.samples[:, 0]
+            roi_ids_ = np.asanyarray(roi_ids)
+            roi_pos = np.arange(1, len(roi_ids))
+            executor = own_executor = None
+            if nproc > 1 or self.executor is not None:
+                nproc_needed = max(1, min(len(roi_pos), nproc))
+                nblocks = nproc_needed \
+                          if self.nblocks is None else self.nblocks
+                executor, own_executor = get_executor(self.executor,
+                                                      nproc_needed)
+                isolated = getattr(executor, 'isolated', False)
+                copy_measure = copy.copy if isolated else copy.deepcopy
+                # workers get only a view into their part of the output
+                p_results = iter_results(
+                    executor,
+                    ((self._proc_block,
+                      (roi_ids_[pos], ds, copy_measure(self.__datameasure)),
+                      dict(seed=mvpa2.get_random_seed() if isolated else None,
+                           iblock=iblock,
+                           out=out[:, pos[0]:pos[-1] + 1]))
+                     for iblock, pos in enumerate(
+                         np.array_split(roi_pos, nblocks))
+                     if len(pos)),
+                    limit=nproc_needed)
+            else:
+                p_results = [self._proc_block(roi_ids_[roi_pos], ds,
+                                              self.__datameasure,
+                                              out=out[:, 1:])]
+            try:
+                # only per-ROI information is coming back
+                roi_infos = [dict([(k, v.value) for k, v in first.a.items()])] \
+                            + sum(p_results, [])
+            finally:
+                if own_executor:
+                    executor.shutdown()
+            result_ds = Dataset(np.array(out), sa=first.sa.copy(deep=False))
+        finally:
+            for a in (samples, out):
+                if a is not None:
+                    os.unlink(a.filename)
+
+        for ca in ('roi_feature_ids', 'roi_sizes', 'roi_center_ids'):
+            if self.ca.is_enabled(ca):
+                setattr(self.ca, ca, [i[ca] for i in roi_infos])
+        # store the center ids as a feature attribute
+        result_ds.fa['center_ids'] = roi_ids
+        return result_ds
+
+
+    def _proc_block(self, block, ds, measure, seed=None, iblock='main',
+                    out=None):
         """Little helper to capture the parts of the computation that can be
         parallelized
 
@@ -409,16 +606,22 @@ class Searchlight(BaseSearchlight):
         seed
           RNG seed.  Should be provided e.g. in child process invocations
           to guarantee that they all seed differently to not keep generating
-          the same sequencies due to reusing the same copy of numpy's RNG
+          the same sequencies due to reusing the same copy of numpy's RNG.
+          Must not be provided for threads, since the RNG is shared among
+          them.  RNG states are restored upon return.
         block
           Critical for generating non-colliding temp filenames in case
           of hdf5 backend.  Otherwise RNGs of different processes might
           collide in their temporary file names leading to problems.
+        out
+          2D array to store results of each ROI into the corresponding column
+          (for results_backend='shm'). Only a list of dictionaries with
+          per-ROI information (as stored in results' `a`) is returned then.
         """
         if seed is not None:
-            mvpa2.seed(seed)
+            return call_seeded(seed, self._proc_block, block, ds, measure,
+                               iblock=iblock, out=out)
         if __debug__:
-            debug_slc_ = 'SLC_' in debug.active
             debug('SLC',
                   "Starting computing block for %i elements" % len(block))
             start_time = time.time()
@@ -435,41 +638,14 @@ class Searchlight(BaseSearchlight):
         # measure within them
         bar = ProgressBar()
 
-        for i, f in enumerate(block):
-            # retrieve the feature ids of all features in the ROI from the query
-            # engine
-            roi_specs = self._queryengine[f]
-
-            if __debug__ and  debug_slc_:
-                debug('SLC_', 'For %r query returned roi_specs %r'
-                      % (f, roi_specs))
-
-            if is_datasetlike(roi_specs):
-                # TODO: unittest
-                assert(len(roi_specs) == 1)
-                roi_fids = roi_specs.samples[0]
-            else:
-                roi_fids = roi_specs
-
-            # slice the dataset
-            roi = ds[:, roi_fids]
-
-            if is_datasetlike(roi_specs):
-                for n, v in roi_specs.fa.iteritems():
-                    roi.fa[n] = v
-
-            if self.__add_center_fa:
-                # add fa to indicate ROI seed if requested
-                roi_seed = np.zeros(roi.nfeatures, dtype='bool')
-                if f in roi_fids:
-                    roi_seed[roi_fids.index(f)] = True
-                else:
-                    warning("Center feature attribute id %s not found" % f)
-                roi.fa[self.__add_center_fa] = roi_seed
-
-            # compute the datameasure and store in results
-            res = measure(roi)
+        if self._block_is_batchable(block, measure):
+            if __debug__:
+                debug('SLC', "Computing %s for batches of ROIs" % measure)
+            roi_results = self._iter_batched_results(block, ds, measure)
+        else:
+            roi_results = self._iter_roi_results(block, ds, measure)
 
+        for i, (f, roi_fids, res) in enumerate(roi_results):
             if assure_dataset and not is_datasetlike(res):
                 res = Dataset(np.atleast_1d(res))
             if store_roi_feature_ids:
@@ -477,14 +653,28 @@ class Searchlight(BaseSearchlight):
                 # aggregation
                 res.a['roi_feature_ids'] = roi_fids
             if store_roi_sizes:
-                res.a['roi_sizes'] = roi.nfeatures
+                res.a['roi_sizes'] = len(roi_fids)
             if store_roi_center_ids:
                 res.a['roi_center_ids'] = f
+            if out is not None:
+                # store the result right away, keeping only per-ROI info
+                res_samples = np.atleast_1d(
+                    res.samples if is_datasetlike(res) else res)
+                if res_samples.ndim == 1:
+                    res_samples = res_samples[:, None]
+                if res_samples.shape != (len(out), 1):
+                    raise ValueError(
+                        "results_backend='shm' requires results of the same "
+                        "shape %s for all ROIs. Got %s for ROI %i"
+                        % ((len(out), 1), res_samples.shape, f))
+                out[:, i] = res_samples[:, 0]
+                res = dict([(k, v.value) for k, v in res.a.items()]) \
+                      if is_datasetlike(res) else {}
             results.append(res)
 
             if __debug__:
                 msg = 'ROI %i (%i/%i), %i features' % \
-                            (f + 1, i + 1, len(block), roi.nfeatures)
+                            (f + 1, i + 1, len(block), len(roi_fids))
                 debug('SLC', bar(float(i + 1) / len(block), msg), cr=True)
 
         if __debug__:
@@ -496,7 +686,9 @@ class Searchlight(BaseSearchlight):
                 debug('SLC', "Post-processing %d results in proc_block using %s"
                       % (len(results), self.results_postproc_fx))
             results = self.results_postproc_fx(results)
-        if self.results_backend == 'native':
+        if self.checkpoint_dir is not None and len(block):
+            self._save_checkpoint(block, ds, results)
+        if self.results_backend in ('native', 'shm'):
             pass                        # nothing special
         elif self.results_backend == 'hdf5':
             # store results in a temporary file and return a filename
@@ -513,6 +705,178 @@ class Searchlight(BaseSearchlight):
         return results
 
 
+    def _iter_roi_results(self, block, ds, measure):
+        """Yield center id, feature ids and measure result for each ROI
+        """
+        if __debug__:
+            debug_slc_ = 'SLC_' in debug.active
+        for f in block:
+            # retrieve the feature ids of all features in the ROI from the query
+            # engine
+            roi_specs = self._queryengine[f]
+
+            if __debug__ and  debug_slc_:
+                debug('SLC_', 'For %r query returned roi_specs %r'
+                      % (f, roi_specs))
+
+            if is_datasetlike(roi_specs):
+                # TODO: unittest
+                assert(len(roi_specs) == 1)
+                roi_fids = roi_specs.samples[0]
+            else:
+                roi_fids = roi_specs
+
+            # slice the dataset -- lazily, as measures often need only
+            # a part of it
+            roi = DatasetView.from_dataset(ds, features=roi_fids)
+
+            if is_datasetlike(roi_specs):
+                for n, v in roi_specs.fa.iteritems():
+                    roi.fa[n] = v
+
+            if self.__add_center_fa:
+                # add fa to indicate ROI seed if requested
+                roi_seed = np.zeros(roi.nfeatures, dtype='bool')
+                if f in roi_fids:
+                    roi_seed[roi_fids.index(f)] = True
+                else:
+                    warning("Center feature attribute id %s not found" % f)
+                roi.fa[self.__add_center_fa] = roi_seed
+
+            # compute the datameasure
+            yield f, roi_fids, measure(roi)
+
+    def _block_is_batchable(self, block, measure):
+        """Either ROIs of the block could be passed to the measure at once
+
+        It is the case whenever the measure supports it, and ROIs are
+        specified by plain lists of feature ids, without any feature
+        attributes to be added.
+        """
+        return len(block) > 0 \
+               and getattr(measure, 'is_batchable', False) \
+               and not self.__add_center_fa \
+               and not is_datasetlike(self._queryengine[block[0]])
+
+    def _iter_batched_results(self, block, ds, measure):
+        """Yield center id, feature ids and measure result for each ROI
+
+        ROIs get queried until the padded matrix of their feature ids,
+        multiplied by the number of samples, reaches `_batch_nelements`, and
+        then passed to the measure at once.
+        """
+        batch = []
+        max_size = 1
+        for i, f in enumerate(block):
+            roi_fids = self._queryengine[f]
+            batch.append((f, roi_fids))
+            max_size = max(max_size, len(roi_fids))
+            if i + 1 < len(block) and \
+               len(batch) * max_size * len(ds) < self._batch_nelements:
+                continue
+            padded = np.empty((len(batch), max_size), dtype=int)
+            padded.fill(-1)
+            for j, (_, fids) in enumerate(batch):
+                padded[j, :len(fids)] = fids
+            for (f_, fids), res in zip(batch, measure._call_batch(ds, padded)):
+                yield f_, fids, res
+            batch = []
+            max_size = 1
+
+    def _proc_block_timed(self, block, *args, **kwargs):
+        """Run _proc_block and return the block, its results and timing
+        """
+        start = time.time()
+        results = self._proc_block(block, *args, **kwargs)
+        return block, results, (start, time.time())
+
+    def _get_cost_ordered_blocks(self, dataset, roi_ids, nproc):
+        """Split ROIs into blocks with the most expensive ROIs coming first
+
+        Cost of a ROI is estimated by the number of its features, if it is
+        known without querying the ROI (which would be done once again by the
+        workers).  Otherwise all ROIs are assumed to be equally expensive and
+        keep their order.  Unless `nblocks` is specified, each block takes
+        the same fraction of the total cost remaining to be computed (guided
+        scheduling), but at least 1/(20*nproc) of the total cost.  Otherwise
+        blocks are of equal cost.
+        """
+        qe = self._queryengine
+        if isinstance(qe, SparseQueryEngine):
+            # precomputed neighborhoods -- sizes are for free
+            costs = np.diff(qe.indptr)[np.asanyarray(roi_ids, dtype=int)]
+            costs = costs.astype(float)
+        else:
+            costs = np.ones(len(roi_ids))
+        order = np.argsort(-costs, kind='mergesort')
+        roi_ids = np.asanyarray(roi_ids)[order]
+        cumcosts = np.cumsum(costs[order])
+        total = cumcosts[-1]
+        if self.nblocks is not None:
+            bounds = np.searchsorted(
+                cumcosts, total * np.arange(1, self.nblocks) / self.nblocks)
+        else:
+            bounds = []
+            start, done = 0, 0.
+            while start < len(roi_ids):
+                chunk = max((total - done) / (2. * nproc),
+                            total / (20. * nproc))
+                start = max(start + 1, np.searchsorted(cumcosts, done + chunk,
+                                                       side='right'))
+                bounds.append(start)
+                done = cumcosts[start - 1]
+        blocks = [b for b in np.split(roi_ids, bounds) if len(b)]
+        if __debug__:
+            debug('SLC', "Split %i ROIs into %i blocks of decreasing cost"
+                  % (len(roi_ids), len(blocks)))
+        return blocks
+
+    def _save_checkpoint(self, block, ds, results):
+        """Store results of a block of ROIs in the checkpoint directory
+        """
+        if len(results) != len(block):
+            raise ValueError("Checkpointing requires a result per ROI. Got "
+                             "%i results for %i ROIs"
+                             % (len(results), len(block)))
+        fd, filename = tempfile.mkstemp(dir=self.checkpoint_dir,
+                                        prefix='block-%i-' % block[0],
+                                        suffix='.hdf5.part')
+        os.close(fd)
+        if __debug__:
+            debug('SLC', "Storing checkpoint into %s" % filename)
+        h5save(filename, dict(center_ids=np.asarray(block),
+                              shape=ds.shape,
+                              results=results))
+        # only completely written checkpoints get considered for resuming
+        os.rename(filename, filename[:-len('.part')])
+
+    def _load_checkpoints(self, dataset, roi_ids):
+        """Load results of ROIs from the checkpoint directory
+
+        Returns
+        -------
+        dict
+          Results keyed by the center ids.
+        """
+        done = {}
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+            return done
+        roi_ids_ = set(roi_ids)
+        for filename in sorted(glob.glob(os.path.join(self.checkpoint_dir,
+                                                      'block-*.hdf5'))):
+            checkpoint = h5load(filename)
+            if tuple(checkpoint['shape']) != dataset.shape:
+                raise ValueError("Checkpoint %s was computed on a dataset of "
+                                 "shape %s, while current one is %s"
+                                 % (filename, tuple(checkpoint['shape']),
+                                    dataset.shape))
+            for center_id, res in zip(checkpoint['center_ids'],
+                                      checkpoint['results']):
+                if center_id in roi_ids_:
+                    done[center_id] = res
+        return done
+
     def __set_datameasure(self, datameasure):
         """Set the datameasure"""
         self.untrain()
@@ -533,12 +897,16 @@ class Searchlight(BaseSearchlight):
         else:
             return results
 
-    def __handle_all_results(self, results):
+    def __handle_all_results(self, results, timings):
         """Helper generator to decorate passing the results out to
         results_fx
+
+        Results are expected as returned by _proc_block_timed, and (block,
+        results) pairs are yielded while timings get collected.
         """
-        for r in results:
-            yield self.__handle_results(r)
+        for block, r, timing in results:
+            timings.append(timing)
+            yield block, self.__handle_results(r)
 
 
     datameasure = property(fget=lambda self: self.__datameasure,
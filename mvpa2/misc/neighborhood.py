@@ -13,7 +13,7 @@ from numpy import array
 import sys
 import itertools
 
-from mvpa2.base import warning
+from mvpa2.base import warning, externals
 from mvpa2.base.types import is_sequence_type
 from mvpa2.base.dochelpers import borrowkwargs, borrowdoc, _repr_attrs, _repr
 from mvpa2.clfs.distance import cartesian_distance
@@ -594,6 +594,188 @@ class IndexQueryEngine(QueryEngine):
             return res
 
 
+class SparseQueryEngine(QueryEngine):
+    """Query engine with all neighborhoods precomputed upon training
+
+    Neighborhoods of all features are computed at once from the
+    coordinate increments of a `Sphere` (or any other neighborhood
+    providing `_get_increments`), and stored as a compressed sparse row
+    (CSR) incidence matrix (center x feature).  Query by feature id is then
+    a mere slice of that matrix.  Results of queries are always sorted.
+
+    Since only plain arrays are stored, a trained engine could be saved
+    (e.g. using `h5save`) and reused later on.  Training on a dataset with
+    the same coordinates as the one it was trained on (e.g. another
+    subject sharing the same mask) reuses the neighborhoods.
+
+    Examples
+    --------
+    >>> from mvpa2.misc.data_generators import normal_feature_dataset
+    >>> ds = normal_feature_dataset(nfeatures=4)
+    >>> ds.fa['voxel_indices'] = [[0, 0], [0, 1], [1, 0], [1, 1]]
+    >>> qe = SparseQueryEngine(voxel_indices=Sphere(1))
+    >>> qe.train(ds)
+    >>> qe[0]
+    [0, 1, 2]
+    >>> qe.get_matrix().sum()
+    12
+    """
+
+    _chunk_nelements = 2 ** 23
+    """Maximal number of tentative neighbors to be considered at once"""
+
+    def __init__(self, **kwargs):
+        """
+        Parameters
+        ----------
+        **kwargs
+          A single query object, e.g. ``voxel_indices=Sphere(3)``, which
+          must provide coordinate increments (as `Sphere` and
+          `HollowSphere` do).
+        """
+        QueryEngine.__init__(self, **kwargs)
+        if len(self._queryobjs) != 1:
+            raise ValueError("%s supports only a single space, got %s"
+                             % (self.__class__.__name__,
+                                self._queryobjs.keys()))
+        self._space, self._queryobj = self._queryobjs.items()[0]
+        if not hasattr(self._queryobj, '_get_increments'):
+            raise ValueError("%r provides no coordinate increments. Use "
+                             "IndexQueryEngine instead" % (self._queryobj,))
+        self._coords = None
+        """Coordinates of all features the engine was trained on"""
+        self._origin = None
+        self._volume = None
+        """Dense lookup of feature ids (+1) within the coordinates extent"""
+        self.indptr = None
+        """Neighbors of feature i are in indices[indptr[i]:indptr[i+1]]"""
+        self.indices = None
+        """Feature ids of neighbors for all features"""
+
+
+    def _train(self, dataset):
+        coords = np.asanyarray(self._queryattrs[self._space])
+        if coords.ndim == 1:
+            coords = coords[:, None]
+        if not coords.dtype.char in np.typecodes['AllInteger']:
+            raise ValueError("%s can only operate on integer coordinates "
+                             "(got: %s)"
+                             % (self.__class__.__name__, coords.dtype))
+        if self._coords is not None and self._coords.shape == coords.shape \
+                and np.all(self._coords == coords):
+            if __debug__:
+                debug('NBH', "Reusing neighborhoods of %i features"
+                      % len(coords))
+            return
+        self._coords = coords
+        self._setup_volume()
+        self._compute_neighborhoods()
+
+
+    def _setup_volume(self):
+        coords = self._coords
+        if len(coords):
+            self._origin = coords.min(axis=0)
+            shape = coords.max(axis=0) - self._origin + 1
+        else:
+            self._origin = np.zeros(coords.shape[1], dtype=int)
+            shape = np.zeros(coords.shape[1], dtype=int)
+        volume = np.zeros(shape, dtype=int)
+        volume[tuple((coords - self._origin).T)] = np.arange(1, len(coords) + 1)
+        if np.sum(volume > 0) != len(coords):
+            raise ValueError("Multiple features carry the same coordinates "
+                             "in %r.  %s cannot handle such cases -- use "
+                             "another appropriate query engine"
+                             % (self._space, self))
+        self._volume = volume
+
+
+    def _lookup(self, coords):
+        """Return feature ids for coordinates (last axis), -1 if unknown
+        """
+        coords = coords - self._origin
+        shape = np.array(self._volume.shape)
+        inside = np.all((coords >= 0) & (coords < shape), axis=-1)
+        fids = np.empty(inside.shape, dtype=int)
+        fids.fill(-1)
+        fids[inside] = self._volume[tuple(coords[inside].T)] - 1
+        return fids
+
+
+    def _compute_neighborhoods(self):
+        coords = self._coords
+        increments = self._queryobj._get_increments(coords.shape[1])
+        increments = np.asanyarray(increments, dtype=int).reshape(
+            (-1, coords.shape[1]))
+        nfeatures, nincrements = len(coords), len(increments)
+        if __debug__:
+            debug('NBH', "Computing neighborhoods of %i features for %i "
+                  "increments of %s" % (nfeatures, nincrements, self._queryobj))
+        chunk = max(1, self._chunk_nelements // max(nincrements, 1))
+        sizes, indices = [], []
+        for start in xrange(0, nfeatures, chunk):
+            # all tentative neighbors of the chunk of centers, sorted
+            # by feature id with unknown ones (-1) first
+            fids = np.sort(self._lookup(coords[start:start + chunk, None]
+                                        + increments[None]), axis=1)
+            known = fids >= 0
+            sizes.append(known.sum(axis=1))
+            indices.append(fids[known])
+        self.indptr = np.concatenate([[0]] + sizes).cumsum()
+        self.indices = np.concatenate([np.zeros(0, dtype=int)] + indices)
+
+
+    def query_byid(self, fid):
+        """Return feature ids of neighbors for a given feature id
+        """
+        return self.indices[self.indptr[fid]:self.indptr[fid + 1]].tolist()
+
+
+    def query(self, **kwargs):
+        space_args = kwargs.pop(self._space, None)
+        if len(kwargs):
+            raise ValueError, "Do not know how to treat space(s) %s given " \
+                  "in parameters of the query" % (kwargs.keys())
+        if space_args is None:
+            return range(len(self._coords))
+        coord = np.atleast_1d(space_args)
+        increments = self._queryobj._get_increments(len(coord))
+        if not len(increments):
+            return []
+        fids = self._lookup(coord + increments)
+        return sorted(fids[fids >= 0])
+
+
+    def get_matrix(self, ids=None):
+        """Return neighborhoods as a sparse incidence matrix
+
+        Parameters
+        ----------
+        ids : None or sequence of int
+          Feature ids of the centers (rows).  If None, all features are taken.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+          (center x feature) matrix with 1 for each neighbor of a center.
+        """
+        externals.exists('scipy', raise_=True)
+        import scipy.sparse as sps
+        nfeatures = len(self._coords)
+        if ids is None:
+            indptr, indices = self.indptr, self.indices
+        else:
+            ids = np.asanyarray(ids, dtype=int)
+            starts, stops = self.indptr[ids], self.indptr[ids + 1]
+            indptr = np.concatenate([[0], stops - starts]).cumsum()
+            # gather the slices of the selected rows at once
+            offsets = np.repeat(starts - indptr[:-1], stops - starts)
+            indices = self.indices[np.arange(indptr[-1]) + offsets]
+        return sps.csr_matrix((np.ones(len(indices), dtype=int),
+                               indices, indptr),
+                              shape=(len(indptr) - 1, nfeatures))
+
+
 class CachedQueryEngine(QueryEngineInterface):
     """Provides caching facility for query engines.
 
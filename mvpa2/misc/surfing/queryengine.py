@@ -19,6 +19,10 @@ and surface-based multi-voxel pattern analysis. Neuroimage, 56(2), pp. 593-600
 
 __docformat__ = 'restructuredtext'
 
+import os
+import hashlib
+import tempfile
+
 import numpy as np
 
 from mvpa2.base.dochelpers import _repr_attrs, borrowkwargs
@@ -29,6 +33,8 @@ from mvpa2.misc.neighborhood import QueryEngineInterface
 from mvpa2.misc.surfing import volgeom, surf_voxel_selection
 from mvpa2.base import warning
 
+if __debug__:
+    from mvpa2.base import debug
 
 class SurfaceQueryEngine(QueryEngineInterface):
     '''
@@ -41,7 +47,8 @@ class SurfaceQueryEngine(QueryEngineInterface):
     '''
 
     def __init__(self, surface, radius, distance_metric='dijkstra',
-                    fa_node_key='node_indices'):
+                    fa_node_key='node_indices', precompute=False,
+                    cache_dir=None):
         '''Make a new SurfaceQueryEngine
 
         Parameters
@@ -55,6 +62,17 @@ class SurfaceQueryEngine(QueryEngineInterface):
         fa_node_key: str
             Key for feature attribute that contains node indices
             (default: 'node_indices').
+        precompute: bool
+            If True, the neighborhoods of all nodes are computed at once
+            when training and kept in a compact (CSR) form, so that
+            self.query_byid(vertex_id) only has to look them up
+            (default: False).
+        cache_dir: str or None
+            Directory where precomputed neighborhoods are stored, in a
+            file named after a hash of the surface, radius and distance
+            metric. If such a file exists already, the neighborhoods are
+            read from it instead of being computed. Implies
+            precompute=True (default: None).
 
         Notes
         -----
@@ -65,17 +83,24 @@ class SurfaceQueryEngine(QueryEngineInterface):
         self.radius = radius
         self.distance_metric = distance_metric
         self.fa_node_key = fa_node_key
+        self.precompute = precompute
+        self.cache_dir = cache_dir
         self._vertex2feature_map = None
+        self._nbhoods = None
 
         allowed_metrics = ('dijkstra', 'euclidean')
         if not self.distance_metric in allowed_metrics:
             raise ValueError('distance_metric %s has to be in %s' %
                                     (self.distance_metric, allowed_metrics))
 
-        if self.distance_metric == 'dijkstra':
+        if self.distance_metric == 'dijkstra' and not self._use_nbhoods:
             # Pre-compute neighbor information (and ignore the output).
             surface.neighbors
 
+    @property
+    def _use_nbhoods(self):
+        return self.precompute or self.cache_dir is not None
+
     def __repr__(self, prefixes=None):
         if prefixes is None:
             prefixes = []
@@ -86,14 +111,19 @@ class SurfaceQueryEngine(QueryEngineInterface):
                    + _repr_attrs(self, ['distance_metric'],
                                    default='dijkstra')
                    + _repr_attrs(self, ['fa_node_key'],
-                                   default='node_indices'))
+                                   default='node_indices')
+                   + _repr_attrs(self, ['precompute'], default=False)
+                   + _repr_attrs(self, ['cache_dir']))
 
     def __reduce__(self):
         return (self.__class__, (self.surface,
                                  self.radius,
                                  self.distance_metric,
-                                 self.fa_node_key),
-                            dict(_vertex2feature_map=self._vertex2feature_map))
+                                 self.fa_node_key,
+                                 self.precompute,
+                                 self.cache_dir),
+                            dict(_vertex2feature_map=self._vertex2feature_map,
+                                 _nbhoods=self._nbhoods))
 
     def __str__(self):
         return '%s(%s, radius=%s, distance_metric=%s, fa_node_key=%s)' % \
@@ -153,6 +183,98 @@ class SurfaceQueryEngine(QueryEngineInterface):
         for feature_id, vertex_id in enumerate(vertex_ids):
             v2f[vertex_id].append(feature_id)
 
+        if self._use_nbhoods and self._nbhoods is None:
+            self._nbhoods = self._get_neighborhoods()
+
+    def _get_neighborhoods_filename(self):
+        '''Name of the file in cache_dir with precomputed neighborhoods'''
+        surface = self.surface
+        v = np.asarray(surface.vertices, dtype=np.float64)
+        f = np.asarray(surface.faces, dtype=np.int64)
+
+        h = hashlib.sha1()
+        h.update('%s %s %r %s' % (v.shape, f.shape, float(self.radius),
+                                  self.distance_metric))
+        h.update(np.ascontiguousarray(v).tostring())
+        h.update(np.ascontiguousarray(f).tostring())
+
+        return os.path.join(self.cache_dir,
+                            'surface_neighborhoods_%s.npz' % h.hexdigest())
+
+    def _get_neighborhoods(self):
+        '''Neighborhoods of all nodes, read from or stored in cache_dir
+
+        Returns
+        -------
+        nbhoods: tuple of np.ndarray
+            (indptr, indices, distances) so that the nodes in the
+            neighborhood of node i are indices[indptr[i]:indptr[i + 1]],
+            at distances[indptr[i]:indptr[i + 1]] from node i.
+        '''
+        fn = None
+        if self.cache_dir is not None:
+            fn = self._get_neighborhoods_filename()
+            if os.path.exists(fn):
+                if __debug__:
+                    debug('SVS', 'Loading neighborhoods from %s' % fn)
+                data = np.load(fn)
+                try:
+                    return tuple(data[key] for key in
+                                 ('indptr', 'indices', 'distances'))
+                finally:
+                    data.close()
+
+        if __debug__:
+            debug('SVS', 'Computing neighborhoods for %d nodes' %
+                         self.surface.nvertices)
+
+        if self.distance_metric == 'dijkstra':
+            n2d = self.surface.dijkstra_distance_matrix(maxdistance=self.radius)
+        else:
+            n2d = self.surface.euclidean_distance_matrix(
+                                                    maxdistance=self.radius)
+        nbhoods = (n2d.indptr, n2d.indices, n2d.data)
+
+        if fn is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            # write to a temporary file first, so that concurrent
+            # analyses never read an incomplete file
+            fd, tmp_fn = tempfile.mkstemp(suffix='.npz', dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, indptr=nbhoods[0], indices=nbhoods[1],
+                             distances=nbhoods[2])
+                os.rename(tmp_fn, fn)
+            except:
+                os.remove(tmp_fn)
+                raise
+
+            if __debug__:
+                debug('SVS', 'Stored neighborhoods in %s' % fn)
+
+        return nbhoods
+
+    def _get_nearby_nodes(self, vertex_id):
+        '''Distances from a vertex to the nodes in its neighborhood
+
+        Returns
+        -------
+        n2d: dict
+            n2d[j]=d means that node j is in the neighborhood of vertex_id,
+            at distance d.
+        '''
+        if self._nbhoods is None:
+            return self.surface.circlearound_n2d(vertex_id,
+                                                 self.radius,
+                                                 self.distance_metric)
+
+        indptr, indices, distances = self._nbhoods
+        start, stop = indptr[vertex_id], indptr[vertex_id + 1]
+        return dict(zip(indices[start:stop].tolist(),
+                        distances[start:stop].tolist()))
+
 
     def query(self, **kwargs):
         raise NotImplementedError
@@ -180,12 +302,11 @@ class SurfaceQueryEngine(QueryEngineInterface):
             raise KeyError('vertex_id should be integer in range(%d)' %
                                                 self.surface.nvertices)
 
-        nearby_nodes = self.surface.circlearound_n2d(vertex_id,
-                                                    self.radius,
-                                                    self.distance_metric)
+        nearby_nodes = self._get_nearby_nodes(vertex_id)
 
         v2f = self._vertex2feature_map
-        return sum((v2f[node] for node in nearby_nodes), [])
+        return [feature_id for node in nearby_nodes
+                           for feature_id in v2f[node]]
 
 
 class SurfaceRingQueryEngine(SurfaceQueryEngine):
@@ -278,19 +399,19 @@ class SurfaceRingQueryEngine(SurfaceQueryEngine):
             raise KeyError('vertex_id should be integer in range(%d)' %
                                                 self.surface.nvertices)
 
-        nearby_nodes = self.surface.circlearound_n2d(vertex_id,
-                                                    self.radius,
-                                                    self.distance_metric)
+        nearby_nodes = self._get_nearby_nodes(vertex_id)
 
         v2f = self._vertex2feature_map
         # Sorting nodes based on distance to center node to work around
         # the problem with add_center_fa in Searchlight
         nearby_nodes_keys = sorted(nearby_nodes, key=nearby_nodes.__getitem__)
         neighborhood = []
-        if self.include_center and vertex_id in nearby_nodes_keys:
-            neighborhood = v2f[vertex_id]
-        return sum((v2f[node] for node in nearby_nodes_keys
-                    if nearby_nodes[node] > self.inner_radius), neighborhood)
+        if self.include_center and vertex_id in nearby_nodes:
+            neighborhood.extend(v2f[vertex_id])
+        for node in nearby_nodes_keys:
+            if nearby_nodes[node] > self.inner_radius:
+                neighborhood.extend(v2f[node])
+        return neighborhood
 
 
 
@@ -516,12 +637,12 @@ class SurfaceVerticesQueryEngine(QueryEngineInterface):
 
         Parameters
         ----------
-        vertex_id: int
+        vertex_id: int or list of int
             Vertex id (referring to a node on the surface).
 
         Returns
         -------
-        feature_id: int
+        feature_id: int or list of int
             Index of feature nearest to the vertex with id vertex_id.
 
         Notes
@@ -529,9 +650,7 @@ class SurfaceVerticesQueryEngine(QueryEngineInterface):
         This function only considers feature ids that are selected by
         at least one vertex_id..
         '''
-        if type(vertex_id) in (list, tuple):
-            return map(self.vertex_id2nearest_feature_id, vertex_id)
-
+        # for a list, nearest voxels are found for all vertices at once
         lin_vox = self.voxsel.source2nearest_target(vertex_id)
 
         return self.linear_voxel_id2feature_id(lin_vox)
@@ -691,7 +810,8 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
                              results_backend=None,
                              tmp_prefix='tmpvoxsel',
                              output_modality='surface',
-                             node_voxel_mapping='maximal'):
+                             node_voxel_mapping='maximal',
+                             executor=None):
     """
     Voxel selection wrapper for multiple center nodes on the surface
 
@@ -746,9 +866,12 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
         Feature attributes from a dataset that should be returned if the
         queryengine is called with a dataset.
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        executor has workers, or as many as the system has cores.
+    executor: None or str or executor
+        Backend (name or instance) to run blocks of center nodes in
+        parallel (see mvpa2.base.parallel). If None, 'process' backend is
+        used whenever nproc > 1.
     outside_node_margin: float or None (default)
         By default nodes outside the volume are skipped; using this
         parameters allows for a marign. If this value is a float (possibly
@@ -759,9 +882,9 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the executor, while 'hdf5' would use h5save/h5load functionality.
+        Either way, each block provides its results as a few flat arrays.
+        If None, then 'native' is used.
     tmp_prefix : str, optional
         If specified -- serves as a prefix for temporary files storage
         if results_backend == 'hdf5'.  Thus can specify the directory to use
@@ -802,7 +925,8 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
                                 outside_node_margin=outside_node_margin,
                                 results_backend=results_backend,
                                 tmp_prefix=tmp_prefix,
-                                node_voxel_mapping=node_voxel_mapping)
+                                node_voxel_mapping=node_voxel_mapping,
+                                executor=executor)
 
 
     qe = modality2class[output_modality](voxsel, add_fa=add_fa)
@@ -25,6 +25,7 @@ and surface-based multi-voxel pattern analysis. Neuroimage, 56(2), pp. 593-600
 __docformat__ = 'restructuredtext'
 
 
+import copy
 import time
 import collections
 import operator
@@ -35,6 +36,7 @@ import os
 import numpy as np
 
 from mvpa2.base import warning, externals
+from mvpa2.base.parallel import get_executor, get_nproc, iter_results
 
 from mvpa2.misc.surfing import volgeom, volsurf, volume_mask_dict
 from mvpa2.support.nibabel import surf
@@ -394,7 +396,8 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                     distance_metric='dijkstra',
                     eta_step=10, nproc=None,
                     outside_node_margin=None,
-                    results_backend=None, tmp_prefix='tmpvoxsel'):
+                    results_backend=None, tmp_prefix='tmpvoxsel',
+                    executor=None):
 
     """
     Voxel selection for multiple center nodes on the surface
@@ -417,9 +420,12 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
     eta_step: int
         Report progress every eta_step (default: 10).
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        executor has workers, or as many as the system has cores.
+    executor: None or str or executor
+        Backend (name or instance) to run blocks of center nodes in
+        parallel (see mvpa2.base.parallel). If None, 'process' backend is
+        used whenever nproc > 1.
     outside_node_margin: float or True or None (default)
         By default nodes outside the volume are skipped; using this
         parameter allows for a marign. If this value is a float (possibly
@@ -430,9 +436,9 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the executor, while 'hdf5' would use h5save/h5load functionality.
+        Either way, each block provides its results as a few flat arrays.
+        If None, then 'native' is used.
     tmp_prefix : str, optional
         If specified -- serves as a prefix for temporary files storage
         if results_backend == 'hdf5'.  Thus can specify the directory to use
@@ -506,37 +512,13 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
         debug('SVS', "Instantiated voxel selector (radius %r)" % radius)
 
 
-    # structure to keep output data. Initialize with None, then
-    # make a sparse_attributes instance when we know what the attributes are
-    node2volume_attributes = None
-
-    attribute_mapper = voxel_selector.disc_voxel_indices_and_attributes
-
     srcs_order = [source_surf_nodes[node] for node in visitorder]
     src_trg_nodes = [(src, src2intermediate[src]) for src in srcs_order]
 
-    if nproc is not None and nproc > 1 and not externals.exists('pprocess'):
-        raise RuntimeError("The 'pprocess' module is required for "
-                           "multiprocess searchlights. Please either "
-                           "install python-pprocess, or reduce `nproc` "
-                           "to 1 (got nproc=%i) or set to default None"
-                           % nproc)
-
     if nproc is None:
-        if externals.exists('pprocess'):
-            try:
-                import pprocess
-                nproc = pprocess.get_number_of_cores() or 1
-                if _debug() :
-                    debug("SVS", 'Using pprocess with %d cores' % nproc)
-            except:
-                if _debug():
-                    debug("SVS", 'pprocess not available')
-
-        if nproc is None:
-            # importing pprocess failed - so use a single core
-            nproc = 1
-            debug("SVS", 'Using %d cores - pprocess not available' % nproc)
+        # as many as executor instance has workers, or all cores
+        nproc = get_nproc(getattr(executor, 'max_workers',
+                                  getattr(executor, '_max_workers', None)))
 
     # get the the voxel selection parameters
     parameter_dict = vol_surf_mapping.get_parameter_dict()
@@ -545,96 +527,77 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                                distance_metric=distance_metric),
                                source_nvertices=source_surf.nvertices)
 
+    n_srcs = len(src_trg_nodes)
+    nproc_needed = max(1, min(n_srcs, nproc))
 
-    init_output = lambda: volume_mask_dict.VolumeMaskDictionary(
-                                    vol_surf_mapping.volgeom,
-                                    intermediate_surf,
-                                    meta=parameter_dict)
-
-    if nproc > 1:
+    if nproc_needed > 1 or executor is not None:
         if results_backend == 'hdf5':
             externals.exists('h5py', raise_=True)
         elif results_backend is None:
-            if externals.exists('h5py') and externals.versions['hdf5'] >= '1.8.7':
-                results_backend = 'hdf5'
-            else:
-                results_backend = 'native'
+            results_backend = 'native'
         if _debug():
             debug('SVS', "Using '%s' backend" % (results_backend,))
 
         if not results_backend in ('native', 'hdf5'):
             raise ValueError('Illegal results backend %r' % results_backend)
 
-        import pprocess
-        n_srcs = len(src_trg_nodes)
-        blocks = np.array_split(np.arange(n_srcs), nproc)
-
-        results = pprocess.Map(limit=nproc)
-        reducer = results.manage(pprocess.MakeParallel(_reduce_mapper))
+        blocks = np.array_split(np.arange(n_srcs), nproc_needed)
+        executor, own_executor = get_executor(executor, nproc_needed)
 
         if __debug__:
-            debug('SVS', "Starting %d child processes", (len(blocks),))
-
-        for i, block in enumerate(blocks):
-            empty_dict = init_output()
+            debug('SVS', "Starting %d blocks using %s" %
+                         (len(blocks), executor.__class__.__name__))
 
-            src_trg = []
-            for idx in block:
-                src_trg.append(src_trg_nodes[idx])
+        def calls():
+            for i, block in enumerate(blocks):
+                selector = voxel_selector
+                if not getattr(executor, 'isolated', False):
+                    # blocks running concurrently in this process need their
+                    # own radius optimizer
+                    selector = copy.copy(voxel_selector)
+                    selector._optimizer = _RadiusOptimizer(
+                                                selector._initradius_mm)
 
-            if _debug():
-                debug('SVS', "  starting block %d/%d: %d centers" %
-                            (i + 1, nproc, len(src_trg)), cr=True)
+                src_trg = [src_trg_nodes[idx] for idx in block]
 
-            reducer(empty_dict, attribute_mapper, src_trg,
-                    eta_step=eta_step, proc_id='%d' % (i + 1,),
-                    results_backend=results_backend, tmp_prefix=tmp_prefix)
-        if _debug():
-            debug('SVS', '')
-            debug('SVS', 'Started all %d child processes' % (len(blocks)))
-            tstart = time.time()
-
-        node2volume_attributes = None
-        for i, result in enumerate(results):
-            if result is None:
-                continue
-
-            if results_backend == 'hdf5':
-                result_fn = result
-                result = h5load(result_fn)
-                os.remove(result_fn)
-
-            if node2volume_attributes is None:
-                # first time we have actual results.
-                # Use as a starting point
-                node2volume_attributes = result
                 if _debug():
-                    debug('SVS', '')
-                    debug('SVS', "Merging results from %d child "
-                                 "processes using '%s' backend" %
-                                 (len(blocks), results_backend))
-            else:
-                # merge new with current data
-                node2volume_attributes.merge(result)
-            if _debug():
-                debug('SVS', "  merged result block %d/%d" % (i + 1, nproc),
-                                cr=True)
+                    debug('SVS', "  starting block %d/%d: %d centers" %
+                                (i + 1, len(blocks), len(src_trg)), cr=True)
 
-        if _debug():
-            telapsed = time.time() - tstart
-            debug('SVS', "")
-            debug('SVS', 'Merged results from %d child processed - '
-                         'took %s' %
-                         (len(blocks), seconds2prettystring(telapsed)))
+                yield (_voxel_selection_block,
+                       (selector, src_trg),
+                       dict(eta_step=eta_step, proc_id='%d' % (i + 1,),
+                            results_backend=results_backend,
+                            tmp_prefix=tmp_prefix))
 
+        results = []
+        try:
+            for result in iter_results(executor, calls(),
+                                       limit=nproc_needed, ordered=False):
+                if results_backend == 'hdf5':
+                    result_fn = result
+                    result = h5load(result_fn)
+                    os.remove(result_fn)
+                results.append(result)
+        finally:
+            if own_executor:
+                executor.shutdown()
     else:
-        empty_dict = init_output()
-        node2volume_attributes = _reduce_mapper(empty_dict,
-                                                attribute_mapper,
-                                                src_trg_nodes,
-                                                eta_step=eta_step)
+        results = [_voxel_selection_block(voxel_selector, src_trg_nodes,
+                                          eta_step=eta_step)]
         debug('SVS', "")
 
+    if n_srcs:
+        if _debug():
+            debug('SVS', "Combining results from %d blocks" % len(results))
+        node2volume_attributes = volume_mask_dict.VolumeMaskDictionary(
+                                    vol_surf_mapping.volgeom,
+                                    intermediate_surf,
+                                    meta=parameter_dict)
+        node2volume_attributes.add_arrays(*_concatenate_blocks(results))
+    else:
+        node2volume_attributes = None
+
     if _debug():
         if node2volume_attributes is None:
             msgs = ["Voxel selection completed: none of %d nodes have "
@@ -659,15 +622,21 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                         len(visitorder))
     return node2volume_attributes
 
-def _reduce_mapper(node2volume_attributes, attribute_mapper,
-                   src_trg_indices, eta_step=1, proc_id=None,
-                   results_backend='native', tmp_prefix='tmpvoxsel'):
+def _voxel_selection_block(voxel_selector, src_trg_indices, eta_step=1,
+                           proc_id=None, results_backend='native',
+                           tmp_prefix='tmpvoxsel'):
     '''applies voxel selection to a list of src_trg_indices
-    results are added to node2volume_attributes.
-    '''
 
-    if not src_trg_indices:
-        return None
+    Returns
+    -------
+    block: tuple
+        (srcs, offsets, nbrs, aux) with source node indices srcs, and
+        voxel indices nbrs[offsets[i]:offsets[i+1]] and auxiliary
+        properties aux[key][offsets[i]:offsets[i+1]] selected for srcs[i]
+        (see VolumeMaskDictionary.add_arrays). If results_backend is
+        'hdf5' then block is stored in a temporary file, and the name of
+        that file is returned instead.
+    '''
 
     if not results_backend in ('native', 'hdf5'):
         raise ValueError('Illegal results backend %r' % results_backend)
@@ -692,11 +661,34 @@ def _reduce_mapper(node2volume_attributes, attribute_mapper,
     bar = ProgressBar()
     n = len(src_trg_indices)
 
+    attribute_mapper = voxel_selector.disc_voxel_indices_and_attributes
+
+    srcs = []
+    counts = []
+    nbrs = []
+    aux = None
+
     for i, (src, trg) in enumerate(src_trg_indices):
         idxs, misc_attrs = attribute_mapper(trg)
 
         if idxs is not None:
-            node2volume_attributes.add(int(src), idxs, misc_attrs)
+            idxs = np.asarray(idxs).ravel()
+            misc_attrs = misc_attrs or dict()
+            if aux is None:
+                aux = dict((k, []) for k in misc_attrs)
+            elif set(aux) != set(misc_attrs):
+                raise ValueError("aux label mismatch: %s != %s" %
+                                 (set(misc_attrs), set(aux)))
+
+            for k, v in misc_attrs.iteritems():
+                v = np.asarray(v).ravel()
+                if len(v) == 1 and len(idxs) != 1:
+                    v = np.repeat(v, len(idxs))
+                aux[k].append(v)
+
+            srcs.append(int(src))
+            counts.append(len(idxs))
+            nbrs.append(idxs)
 
         if _debug() and eta_step and (i % eta_step == 0 or i == n - 1):
             msg = bar(float(i + 1) / n, progresspat % (src, trg))
@@ -704,14 +696,57 @@ def _reduce_mapper(node2volume_attributes, attribute_mapper,
                 msg += ' (#%s)' % proc_id
             debug('SVS', msg, cr=True)
 
+    offsets = np.cumsum([0] + counts)
+    nbrs = np.hstack(nbrs) if nbrs else np.zeros((0,), dtype=np.int)
+    aux = dict((k, np.hstack(v)) for k, v in (aux or {}).iteritems())
+    block = (srcs, offsets, nbrs, aux)
+
     if results_backend == 'hdf5':
         tmp_postfix = ('__tmp__%d_%s.h5py' %
                                  (hash(time.time()), proc_id))
         tmp_fn = tmp_prefix + tmp_postfix
-        h5save(tmp_fn, node2volume_attributes)
+        h5save(tmp_fn, block)
         return tmp_fn
     else:
-        return node2volume_attributes
+        return block
+
+def _concatenate_blocks(blocks):
+    '''Combines results of _voxel_selection_block
+
+    Parameters
+    ----------
+    blocks: list of tuple
+        (srcs, offsets, nbrs, aux) tuples.
+
+    Returns
+    -------
+    block: tuple
+        (srcs, offsets, nbrs, aux) with all blocks concatenated.
+    '''
+    srcs = []
+    offsets = [np.zeros((1,), dtype=np.int)]
+    nbrs = []
+    aux = None
+    for b_srcs, b_offsets, b_nbrs, b_aux in blocks:
+        if not len(b_srcs):
+            continue
+        if aux is None:
+            aux = dict((k, []) for k in b_aux or ())
+        elif set(aux) != set(b_aux or ()):
+            raise ValueError("aux label mismatch: %s != %s" %
+                             (set(b_aux or ()), set(aux)))
+
+        srcs.extend(b_srcs)
+        offsets.append(np.asarray(b_offsets[1:]) + offsets[-1][-1])
+        nbrs.append(b_nbrs)
+        for k in aux:
+            aux[k].append(b_aux[k])
+
+    if not srcs:
+        return [], offsets[0], np.zeros((0,), dtype=np.int), None
+
+    return (srcs, np.hstack(offsets), np.hstack(nbrs),
+            dict((k, np.hstack(v)) for k, v in aux.iteritems()))
 
 def _debug():
     return __debug__ and 'SVS' in debug.active
@@ -725,7 +760,7 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
                          nsteps=10, eta_step=1, nproc=None,
                          outside_node_margin=None,
                          results_backend=None, tmp_prefix='tmpvoxsel',
-                         node_voxel_mapping='maximal'):
+                         node_voxel_mapping='maximal', executor=None):
 
     """
     Voxel selection wrapper for multiple center nodes on the surface
@@ -772,9 +807,12 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
         After how many searchlights an estimate should be printed of the
         remaining time until completion of all searchlights
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        executor has workers, or as many as the system has cores.
+    executor: None or str or executor
+        Backend (name or instance) to run blocks of center nodes in
+        parallel (see mvpa2.base.parallel). If None, 'process' backend is
+        used whenever nproc > 1.
     outside_node_margin: float or None (default)
         By default nodes outside the volume are skipped; using this
         parameter allows for a marign. If this value is a float (possibly
@@ -785,9 +823,9 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the executor, while 'hdf5' would use h5save/h5load functionality.
+        Either way, each block provides its results as a few flat arrays.
+        If None, then 'native' is used.
     tmp_prefix : str, optional
         If specified -- serves as a prefix for temporary files storage
         if results_backend == 'hdf5'.  Thus can specify the directory to use
@@ -827,7 +865,8 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
                           eta_step=eta_step, nproc=nproc,
                           outside_node_margin=outside_node_margin,
                           results_backend=results_backend,
-                          tmp_prefix=tmp_prefix)
+                          tmp_prefix=tmp_prefix,
+                          executor=executor)
 
     return sel
 
@@ -25,7 +25,7 @@ from collections import Mapping
 
 import numpy as np
 
-from mvpa2.base import externals
+from mvpa2.base import externals, warning
 from mvpa2.misc.surfing import volgeom
 
 from mvpa2.support.utils import deprecated
@@ -59,8 +59,13 @@ class VolumeMaskDictionary(Mapping):
      Besides storing voxel indices, each mask can also have additional
     'auxiliary' information associated, such as distance from the center
     or its relative position in grey matter.
+
+    Internally the masks are stored in a compressed sparse row layout:
+    the voxel indices of all masks are concatenated in a single array,
+    with offsets indicating where the mask of each source starts and ends;
+    auxiliary information is stored in arrays that are aligned with the
+    voxel indices.
     """
-    # TODO: docs for src2nbr and src2aux
     def __init__(self, vg, source, meta=None, src2nbr=None, src2aux=None):
         """Initialize a VolumeMaskDictionary
 
@@ -82,22 +87,118 @@ class VolumeMaskDictionary(Mapping):
             indices to lists of voxel indices.
         src2aux: dict or None
             In a typical use case it can contain auxiliary information such as
-            distance of each voxel to each center.
+            distance of each voxel to each center. It maps each auxiliary
+            label to a mapping from node center indices to values.
         """
         self._volgeom = volgeom.from_any(vg)
         self._source = source
 
+        self._meta = meta
+
+        self._set_masks(src2nbr, src2aux)
 
-        self._src2nbr = dict() if src2nbr is None else src2nbr
-        self._src2aux = dict() if src2nbr is None else src2aux
+    def _set_masks(self, src2nbr, src2aux):
+        '''Helper: replace all masks by those in src2nbr and src2aux
 
-        self._meta = meta
+        Both can be given either as dicts or in the tuple-based
+        representation (see _dict_with_arrays2array_tuple)'''
+        # keys in order of addition, and their position in that order
+        self._srcs = []
+        self._src2idx = dict()
+
+        # keys in sorted order, generated when first needed
+        self._lazy_keys = None
+
+        # voxel indices of mask self._srcs[i] are
+        # self._nbrs[self._offsets[i]:self._offsets[i + 1]]
+        self._offsets = np.zeros((1,), dtype=np.int)
+        self._nbrs = np.zeros((0,), dtype=np.int)
+
+        # auxiliary label -> values aligned with self._nbrs
+        self._aux = dict()
+
+        # (counts, nbrs, aux) for masks added but not yet concatenated
+        self._pending = []
 
         # this attribute is initially set to None
         # upon the first call that requires an inverse mapping
         # it is generated.
         self._lazy_nbr2src = None
 
+        # KD-tree of mask centers, generated when first needed
+        self._lazy_source_index = None
+
+        if not src2nbr:
+            return
+
+        keys, lengths, data = _as_array_tuple(src2nbr)
+        if not len(keys):
+            return
+
+        # keys must be python int or str, not numpy int or str
+        keys = np.asarray(keys).tolist()
+        lengths = np.asarray(lengths, dtype=np.int)
+
+        aux = None
+        if src2aux:
+            aux = dict((label, _align_array_tuple(_as_array_tuple(v),
+                                                  keys, lengths))
+                       for label, v in src2aux.iteritems())
+
+        self.add_arrays(keys, np.hstack(([0], np.cumsum(lengths))),
+                        data, aux)
+
+    def _consolidate(self):
+        '''Helper: concatenate masks that were added since the last call'''
+        if not self._pending:
+            return
+
+        counts = np.hstack([c for c, _, _ in self._pending])
+        self._offsets = np.hstack((self._offsets,
+                                   self._offsets[-1] + np.cumsum(counts)))
+        self._nbrs = np.hstack([self._nbrs] +
+                               [nbrs for _, nbrs, _ in self._pending])
+        for k in self._aux:
+            self._aux[k] = np.hstack([self._aux[k]] +
+                                     [aux[k] for _, _, aux in self._pending])
+
+        self._pending = []
+
+    def _get_positions(self, keys):
+        '''Helper: positions in the concatenated arrays of the masks
+        indexed by keys'''
+        self._consolidate()
+
+        rows = np.asarray([self._src2idx[k] for k in keys], dtype=np.int)
+        starts = self._offsets[rows]
+        counts = self._offsets[rows + 1] - starts
+
+        ends = np.cumsum(counts)
+        n = ends[-1] if len(ends) else 0
+        return np.arange(n) + np.repeat(starts - ends + counts, counts)
+
+    def _get_nbrs(self, keys=None):
+        '''Helper: concatenated voxel indices of the masks indexed by keys,
+        or of all masks if keys is None'''
+        if keys is None:
+            self._consolidate()
+            return self._nbrs
+        return self._nbrs[self._get_positions(keys)]
+
+    def _split(self, label=None):
+        '''Helper: mapping from keys to the voxel indices (if label is None)
+        or auxiliary values labelled label for each mask'''
+        self._consolidate()
+        data = self._nbrs if label is None else self._aux[label]
+        return dict(zip(self._srcs, np.split(data, self._offsets[1:-1])))
+
+    def _get_arrays(self):
+        '''Helper: (srcs, offsets, nbrs, aux) with all masks, as accepted
+        by add_arrays(...)'''
+        self._consolidate()
+        return (list(self._srcs), self._offsets, self._nbrs,
+                dict(self._aux) or None)
+
     def __repr__(self, prefixes=None):
         if prefixes is None:
             prefixes = []
@@ -107,23 +208,86 @@ class VolumeMaskDictionary(Mapping):
         if self._meta is not None:
             prefixes_.append('meta=%r' % self._meta)
 
-        if self._src2nbr is not None:
-            prefixes_.append('src2nbr=%r' % self._src2nbr)
-        if self._src2aux is not None:
-            # using the representation of the full _src2aux may cause
-            # a significant slow-down, therefore only list the keys
-            # and not any values
-            dict_summary=', '.join('%s=<...>' % k for k in self._src2aux)
-            prefixes_.append('src2aux=%s(%s)' % (type(self._src2aux),
-                                                 dict_summary))
+        prefixes_.append('src2nbr=%r' % self._split())
+
+        # using the representation of all auxiliary values may cause
+        # a significant slow-down, therefore only list the keys
+        # and not any values
+        dict_summary=', '.join('%s=<...>' % k for k in self._aux)
+        prefixes_.append('src2aux=%s(%s)' % (type(self._aux),
+                                             dict_summary))
 
         return "%s(%s)" % (self.__class__.__name__, ','.join(prefixes_))
 
     def __str__(self):
         return '%s(%d centers, volgeom=%s)' % (self.__class__.__name__,
-                                               len(self._src2nbr),
+                                               len(self),
                                                self._volgeom)
 
+    def _check_src(self, src):
+        '''Helper: raise an error if src cannot be added'''
+        if not type(src) in [int, basestring]:
+            # for now to avoid unhasbable type
+            raise TypeError("src should be int or str")
+
+        if src in self._src2idx:
+            raise ValueError('%s already in %s' % (src, self))
+
+    def _check_aux(self, aux, n, broadcast=False):
+        '''Helper: convert auxiliary values for n voxels to arrays
+
+        The datatype for each label is the one of values already stored.
+        If broadcast is True then single values are repeated n times.'''
+        labels = set(aux) if aux else set()
+        expected_labels = set(self.aux_keys())
+        if len(self) and labels != expected_labels:
+            # all masks must have the same auxiliary labels
+            raise ValueError("aux label mismatch: %s != %s" %
+                            (labels, expected_labels))
+
+        aux_arrs = dict()
+        for k, v in (aux or dict()).iteritems():
+            # ensure that values have the same datatype for different keys
+            v_dtype = self._aux[k].dtype if k in self._aux else None
+
+            if isinstance(v, (list, tuple, int, float, np.ndarray)):
+                v_arr = np.asanyarray(v, dtype=v_dtype).ravel()
+            else:
+                raise ValueError('illegal type %s for %s' % (type(v), v))
+
+            if broadcast:
+                if len(v_arr) not in (n, 1):
+                    raise ValueError('size mismatch: size %d != %d or 1' %
+                                        (len(v_arr), n))
+                if len(v_arr) != n:
+                    v_arr = np.repeat(v_arr, n)
+            elif len(v_arr) != n:
+                raise ValueError('size mismatch: size %d != %d' %
+                                 (len(v_arr), n))
+
+            aux_arrs[k] = v_arr
+
+        return aux_arrs
+
+    def _append(self, srcs, counts, nbrs, aux_arrs):
+        '''Helper: store checked masks, to be concatenated when needed'''
+        if not len(srcs):
+            return
+
+        for k, v in aux_arrs.iteritems():
+            if not k in self._aux:
+                self._aux[k] = v[:0]
+
+        n = len(self._srcs)
+        self._src2idx.update((src, n + i) for i, src in enumerate(srcs))
+        self._srcs.extend(srcs)
+        self._lazy_keys = None
+        self._pending.append((counts, nbrs, aux_arrs))
+
+        # inverse mapping and spatial index are regenerated when needed
+        self._lazy_nbr2src = None
+        self._lazy_source_index = None
+
     def add(self, src, nbrs, aux=None):
         """Add a volume mask
 
@@ -136,54 +300,57 @@ class VolumeMaskDictionary(Mapping):
             linear voxel indices of the voxels in the mask
         aux: dict or None
             auxiliary properties associated with (the voxels in) the volume
-            mask. If the current dictionary instance alraedy has stored
-            auxiliary properties for other masks, then the set of keys in
-            the current mask should be the same as for other masks. In
-            addition, the length of each value in aux should be either
-            the number of elements in nbrs or one.
+            mask. If the current dictionary instance already contains
+            other masks, then the set of keys in the current mask should
+            be the same as for other masks. In addition, the length of each
+            value in aux should be either the number of elements in nbrs
+            or one; in the latter case the value is used for all voxels.
         """
+        self._check_src(src)
 
-        if not type(src) in [int, basestring]:
-            # for now to avoid unhasbable type
-            raise TypeError("src should be int or str")
-
-        if src in self._src2nbr:
-            raise ValueError('%s already in %s' % (src, self))
+        nbrs = np.asarray(nbrs, dtype=np.int).ravel()
+        aux_arrs = self._check_aux(aux, len(nbrs), broadcast=True)
 
+        self._append([src], [len(nbrs)], nbrs, aux_arrs)
 
-        self._src2nbr[src] = np.asarray(nbrs, dtype=np.int)
+    def add_arrays(self, srcs, offsets, nbrs, aux=None):
+        """Add many volume masks at once
 
-        if self._lazy_nbr2src is not None:
-            self._add_target2source(src)
-
-        if aux:
-            n = len(nbrs)
-            expected_keys = set(self.aux_keys())
-            if expected_keys and (set(aux) != expected_keys):
-                raise ValueError("aux label mismatch: %s != %s" %
-                                (set(aux), expected_keys))
-            for k, v in aux.iteritems():
-                if not k in self._src2aux:
-                    self._src2aux[k] = dict()
-
-                # ensure that values have the same datatype for different keys
-                if len(self._src2aux[k]) == 0:
-                    v_dtype = None
-                else:
-                    v_dtype = next(self._src2aux[k].itervalues()).dtype
+        Parameters
+        ----------
+        srcs: list of int or str
+            indices or names of the volume masks. None of them should be
+            already present in this dictionary.
+        offsets: list of int
+            len(srcs)+1 positions in nbrs (starting with 0), so that
+            nbrs[offsets[i]:offsets[i+1]] are the voxels in the mask for
+            srcs[i].
+        nbrs: list of int
+            linear voxel indices of the voxels in all masks, concatenated.
+        aux: dict or None
+            auxiliary properties associated with the voxels in the masks,
+            with each value concatenated across masks as nbrs. The same
+            restrictions apply for its keys as in add(...).
+        """
+        if isinstance(srcs, np.ndarray):
+            srcs = srcs.tolist()
+        offsets = np.asarray(offsets, dtype=np.int)
+        nbrs = np.asarray(nbrs, dtype=np.int).ravel()
 
-                if isinstance(v, (list, tuple, int, float, np.ndarray)):
-                    v_arr = np.asanyarray(v, dtype=v_dtype).ravel()
-                else:
-                    raise ValueError('illegal type %s for %s' % (type(v), v))
+        if len(offsets) != len(srcs) + 1 or offsets[0] != 0 \
+                or offsets[-1] != len(nbrs) or np.any(np.diff(offsets) < 0):
+            raise ValueError("offsets should be %d increasing positions "
+                             "from 0 to %d" % (len(srcs) + 1, len(nbrs)))
 
-                if len(v_arr) not in (n, 1):
-                    raise ValueError('size mismatch: size %d != %d or 1' %
-                                        (len(v_arr), n))
+        for src in srcs:
+            self._check_src(src)
 
-                self._src2aux[k][src] = v_arr
+        if len(set(srcs)) != len(srcs):
+            raise ValueError('Duplicate masks in %s' % self)
 
+        aux_arrs = self._check_aux(aux, len(nbrs))
 
+        self._append(list(srcs), np.diff(offsets), nbrs, aux_arrs)
 
     def get_tuple_list(self, src, *labels):
         """Return a list of tuples with mask indices and/or aux information.
@@ -208,13 +375,13 @@ class VolumeMaskDictionary(Mapping):
         tuple_lists = []
         for label in labels:
             if label is None:
-                tuple_list_elem = idxs.tolist()
+                tuple_list_elem = idxs
             else:
                 vs = self.get_aux(src, label)
                 if len(vs) == 1:
                     tuple_list_elem = [vs[0]] * n
                 else:
-                    tuple_list_elem = vs.tolist()
+                    tuple_list_elem = vs
 
             tuple_lists.append(tuple_list_elem)
 
@@ -263,7 +430,9 @@ class VolumeMaskDictionary(Mapping):
         idxs: list of int
             linear voxel indices indexed by src
         """
-        return self._src2nbr[src].tolist()
+        i = self._src2idx[src]
+        self._consolidate()
+        return self._nbrs[self._offsets[i]:self._offsets[i + 1]].tolist()
 
     @deprecated("use .get_aux instead")
     def aux_get(self, src, label):
@@ -287,11 +456,10 @@ class VolumeMaskDictionary(Mapping):
         labels = self.aux_keys()
         if not label in labels:
             raise ValueError("%s not in %r" % (label, labels))
-        if not label in self._src2aux:
-            msg = ("Mismatch for key %r" if src in self._src2nbr
-                                        else "Unknown key %r")
-            raise ValueError((msg + ', label %r') % (src, label))
-        return self._src2aux[label][src].tolist()
+
+        i = self._src2idx[src]
+        self._consolidate()
+        return self._aux[label][self._offsets[i]:self._offsets[i + 1]].tolist()
 
     # XXX:  get_aux_labels?
     # YYY:  aux is also a dictionary (actually a dictionary with dictionaries)
@@ -304,27 +472,26 @@ class VolumeMaskDictionary(Mapping):
         keys: list of str
             Names of auxiliary labels that are supported by get_aux
         '''
-        return self._src2aux.keys()
+        return self._aux.keys()
 
     def _ensure_has_target2sources(self):
-        '''Helper function to ensure that inverse mapping is set properly'''
-        if not self._lazy_nbr2src:
-            self._lazy_nbr2src = dict()
-            for src in self.keys():
-                self._add_target2source(src)
+        '''Helper function to ensure that inverse mapping is set properly
 
-    def _add_target2source(self, src, targets=None):
-        if targets is None:
-            targets = self[src]
+        The inverse mapping consists of all voxel indices in sorted order,
+        and for each of them the position of the mask it is part of'''
+        if self._lazy_nbr2src is not None:
+            return
 
-        contains = self.volgeom.contains_lin(np.asarray(targets))
-        for i, target in enumerate(targets):
-            if not contains[i]:
-                raise ValueError("Target not in volume: %s" % target)
-            if not target in self._lazy_nbr2src:
-                self._lazy_nbr2src[target] = set()
-            self._lazy_nbr2src[target].add(src)
+        nbrs = self._get_nbrs()
+        if len(nbrs):
+            contains = self.volgeom.contains_lin(nbrs)
+            if not np.all(contains):
+                raise ValueError("Target not in volume: %s" %
+                                 nbrs[np.logical_not(contains)][0])
 
+        rows = np.repeat(np.arange(len(self._srcs)), np.diff(self._offsets))
+        order = np.argsort(nbrs, kind='mergesort')
+        self._lazy_nbr2src = nbrs[order], rows[order]
 
     def target2sources(self, nbr):
         """Find the indices of masks that map to a linear voxel index
@@ -339,15 +506,19 @@ class VolumeMaskDictionary(Mapping):
         srcs: list of int
             Indices i for which get(i) contains nbr
         """
-        if type(nbr) in (list, tuple):
-            return map(self.target2sources, nbr)
-
         self._ensure_has_target2sources()
+        targets, rows = self._lazy_nbr2src
 
-        if not nbr in self._lazy_nbr2src:
-            return None
+        nbrs = np.asarray(nbr).ravel()
+        starts = np.searchsorted(targets, nbrs, side='left')
+        stops = np.searchsorted(targets, nbrs, side='right')
 
-        return self._lazy_nbr2src[nbr]
+        srcs = [set(self._srcs[row] for row in rows[start:stop]) or None
+                for start, stop in zip(starts, stops)]
+
+        if type(nbr) in (list, tuple):
+            return srcs
+        return srcs[0]
 
     def get_targets(self):
         """Return list of voxels that are in one or more masks
@@ -358,8 +529,9 @@ class VolumeMaskDictionary(Mapping):
             Linear indices of voxels in one or more masks
         """
         self._ensure_has_target2sources()
+        targets, _ = self._lazy_nbr2src
 
-        return sorted(self._lazy_nbr2src.keys())
+        return np.unique(targets).tolist()
 
     def _check_has_keys(self, keys=None, raise_=True):
         """Check that a list of keys is present; if not raise an error
@@ -414,14 +586,9 @@ class VolumeMaskDictionary(Mapping):
         subset of all nodes on a cortical surface.
         """
         self._check_has_keys(keys)
-        self._ensure_has_target2sources()
         m_lin = np.zeros((self.volgeom.nvoxels, 1), dtype=np.int8)
 
-        if keys is None:
-            keys = self.keys()
-
-        for key in keys:
-            m_lin[self[key]] = 1
+        m_lin[self._get_nbrs(keys)] = 1
 
         return np.reshape(m_lin, self.volgeom.shape[:3])
 
@@ -478,14 +645,8 @@ class VolumeMaskDictionary(Mapping):
         """
         self._check_has_keys(keys=keys)
 
-        if keys is None:
-            keys = self.keys()
-
         # get linear voxel indices
-        lin_vox_set = set.union(*(set(self[k]) for k in keys))
-
-        # convert to array
-        lin_vox_arr = np.asarray(list(lin_vox_set))
+        lin_vox_arr = np.unique(self._get_nbrs(keys))
 
         return map(tuple, self.volgeom.lin2ijk(lin_vox_arr))
 
@@ -517,20 +678,25 @@ class VolumeMaskDictionary(Mapping):
         subset of all nodes on a cortical surface.
 
         """
-        # convert to tuples
-        ds_voxel_indices = map(tuple, ds.fa.voxel_indices)
-        sel_voxel_indices = map(tuple, self.get_voxel_indices(keys=keys))
+        self._check_has_keys(keys=keys)
 
-        set_ds_voxel_indices = set(ds_voxel_indices)
-        set_sel_voxel_indices = set(sel_voxel_indices)
+        # convert to linear indices; -1 for voxels outside the volume
+        ds_ijk = np.reshape(ds.fa.voxel_indices, (-1, 3))
+        inside = self.volgeom.contains_ijk(ds_ijk, apply_mask=False)
+        ds_lin = np.zeros((len(ds_ijk),), dtype=np.int) - 1
+        ds_lin[inside] = np.ravel_multi_index(ds_ijk[inside].T,
+                                              self.volgeom.shape[:3])
 
-        not_in_ds = set_sel_voxel_indices - set_ds_voxel_indices
-        if not_in_ds:
+        sel_lin = np.unique(self._get_nbrs(keys))
+
+        not_in_ds = np.setdiff1d(sel_lin, ds_lin)
+        if len(not_in_ds):
             raise ValueError('Found %d voxel indices selected that were '
                              'not in dataset, first one is %s' %
-                                (len(not_in_ds), not_in_ds.pop()))
+                                (len(not_in_ds),
+                                 tuple(self.volgeom.lin2ijk(not_in_ds)[0])))
 
-        return np.asarray([d in sel_voxel_indices for d in ds_voxel_indices])
+        return np.in1d(ds_lin, sel_lin)
 
     def get_minimal_dataset(self, ds, keys=None):
         """For a dataset return only portion with features which were selected
@@ -563,10 +729,14 @@ class VolumeMaskDictionary(Mapping):
         return self.get(key)
 
     def __len__(self):
-        return len(self.__keys__())
+        return len(self._srcs)
 
     def __keys__(self):
-        return self._src2nbr.keys()
+        # masks are stored in order of addition, but keys are
+        # returned in sorted order
+        if self._lazy_keys is None:
+            self._lazy_keys = sorted(self._srcs)
+        return list(self._lazy_keys)
 
     def __iter__(self):
         return iter(self.__keys__())
@@ -585,7 +755,8 @@ class VolumeMaskDictionary(Mapping):
 
 
     def _getstate(self):
-        s = (self._volgeom, self._source, self._meta, self._src2nbr, self._src2aux)
+        src2aux = dict((k, self._split(k)) for k in self._aux)
+        s = (self._volgeom, self._source, self._meta, self._split(), src2aux)
         return s
 
     @deprecated("should be used for testing compatibility only - "
@@ -599,14 +770,16 @@ class VolumeMaskDictionary(Mapping):
         #  __setstate__ is called.
 
         # new as of Dec 2013: support more efficient storage method for
-        # h5save/load
+        # h5save/load. The masks are stored with the same
+        # (keys, lengths, data) tuples as _dict_with_arrays2array_tuple
+        # would give, which are just views on the internal arrays
+        self._consolidate()
+        keys = np.asarray(self._srcs)
+        lengths = np.diff(self._offsets)
 
-        s = self._getstate()
-        # because of h5py issues when assigning values in the tuple s,
-        # here a new tuple is created
-        s3 = _dict_with_arrays2array_tuple(s[3])
-        s4 = _dict_with_arrays2array_tuple(s[4])
-        ss = s[:3] + (s3, s4)
+        s3 = (keys, lengths, self._nbrs)
+        s4 = dict((k, (keys, lengths, v)) for k, v in self._aux.iteritems())
+        ss = (self._volgeom, self._source, self._meta, s3, s4)
 
         return ss
 
@@ -620,11 +793,15 @@ class VolumeMaskDictionary(Mapping):
         if len(s) == 4:
             # computatibilty thing: previous version (before Sep 12, 2013) did
             # not store meta
-            self._volgeom, self._source, self._src2nbr, self._src2aux = s
+            self._volgeom, self._source, src2nbr, src2aux = s
             self._meta = False # signal that it is old (no meta information)
             warning('Using old (pre-12 Sep 2013) mapping - no meta data')
         else:
-            self._volgeom, self._source, self._meta, self._src2nbr, self._src2aux = s
+            self._volgeom, self._source, self._meta, src2nbr, src2aux = s
+
+        # masks can be stored either as dicts or (as of Dec 2013)
+        # as array tuples
+        self._set_masks(src2nbr, src2aux)
 
 
     @deprecated("should be used for testing compatibility only - "
@@ -639,9 +816,6 @@ class VolumeMaskDictionary(Mapping):
 
     def __setstate__(self, s):
         self._setstate(s)
-        # new as of Dec 2013: use more efficient storage method for h5save/load
-        self._src2nbr = _array_tuple2dict_with_arrays(self._src2nbr)
-        self._src2aux = _array_tuple2dict_with_arrays(self._src2aux)
 
 
     def __eq__(self, other):
@@ -665,17 +839,25 @@ class VolumeMaskDictionary(Mapping):
         if set(self.keys()) != set(other.keys()):
             return False
 
-        for k in self.keys():
-            if self[k] != other[k]:
-                return False
-
         if set(self.aux_keys()) != set(other.aux_keys()):
             return False
 
+        # compare all masks at once, with the masks in other
+        # in the same order as in the current instance
+        self._consolidate()
+        pos = other._get_positions(self._srcs)
+
+        rows = [other._src2idx[k] for k in self._srcs]
+        if not np.array_equal(np.diff(self._offsets),
+                              np.diff(other._offsets)[rows]):
+            return False
+
+        if not np.array_equal(self._nbrs, other._nbrs[pos]):
+            return False
+
         for lab in self.aux_keys():
-            for k in self.keys():
-                if self.get_aux(k, lab) != other.get_aux(k, lab):
-                    return False
+            if not np.array_equal(self._aux[lab], other._aux[lab][pos]):
+                return False
 
         if self.meta != False or other.meta != False:
             # both are 'new' ones with
@@ -739,40 +921,11 @@ class VolumeMaskDictionary(Mapping):
             return
 
         aks = self.aux_keys()
-        if set(aks) != set(other.aux_keys()):
-            if len(self.keys()) == 0:
-                # current instance is empty, so use the keys from
-                # the other (necessarily non-empty because of the check above)
-                # instance
-                aks = other.aux_keys()
-            else:
-                raise ValueError('Different keys in merge: %s != %s' %
-                                (aks, other.aux_keys()))
-
-# TODO: optimization in case either one or both already have the
-#       inverse mapping from voxels to nodes
-#       For now simply set everything to empty.
-#        if self._lazy_nbr2src is None and not other._lazy_nbr2src is None:
-#            self._ensure_has_target2sources()
-#        elif other._lazy_nbr2src is None and not self._lazy_nbr2src is None:
-#            other._ensure_has_target2sources()
-#        elif not (other._lazy_nbr2src is None or self._lazy_nbr2src is None):
-#            for k, vs in other._lazy_nbr2src.iteritems():
-#                self._add_target2source(k, vs)
-
-        self._lazy_nbr2src = None
-
-        for k in other.keys():
-            idxs = other[k]
+        if len(self) and set(aks) != set(other.aux_keys()):
+            raise ValueError('Different keys in merge: %s != %s' %
+                            (aks, other.aux_keys()))
 
-            a_dict = dict()
-            for ak in aks:
-                a_dict[ak] = other.get_aux(k, ak)
-
-            if not a_dict:
-                a_dict = None
-
-            self.add(k, idxs, a_dict)
+        self.add_arrays(*other._get_arrays())
 
     def xyz_target(self, ts=None):
         """Compute the x,y,z coordinates of one or more voxels
@@ -844,6 +997,25 @@ class VolumeMaskDictionary(Mapping):
         """
         return self._source
 
+    def _get_source_index(self):
+        '''Helper: KD-tree with the coordinates of all mask centers
+
+        Returns a tuple (tree, keys) with a scipy.spatial.cKDTree of the
+        finite coordinates of mask centers, and the keys of these centers.
+        It is computed if called for the first time after masks were added,
+        otherwise the cached result is returned.'''
+        if self._lazy_source_index is None:
+            from scipy.spatial import cKDTree
+
+            keys = self.keys()
+            xyz = np.reshape(self.xyz_source(keys), (-1, 3))
+            finite = np.all(np.isfinite(xyz), 1)
+
+            self._lazy_source_index = (cKDTree(xyz[finite]),
+                                       [k for k, f in zip(keys, finite) if f])
+
+        return self._lazy_source_index
+
     def target2nearest_source(self, target, fallback_euclidean_distance=False):
         """Find the voxel nearest to a mask center
 
@@ -881,12 +1053,24 @@ class VolumeMaskDictionary(Mapping):
                     flat_srcs.append(j)
 
         if not flat_srcs:
-            if fallback_euclidean_distance:
-                flat_srcs = self.keys()
-            else:
+            if not fallback_euclidean_distance:
                 return None
 
+            # nearest of all mask centers, using a KD-tree that is
+            # shared by subsequent calls
+            tree, keys = self._get_source_index()
+            if not keys:
+                return None
 
+            # all centers (nearly) as near as the nearest one are
+            # candidates, and their distances are computed as a brute-force
+            # search would, so that ties are resolved in the same way, i.e.
+            # in favor of the smallest key
+            d, _ = tree.query(xyz_trg)
+            radius = np.min(d) * (1 + 1e-9) + 1e-12
+            nearby = tree.query_ball_point(xyz_trg, radius)
+            candidates = sorted(set(i for ii in nearby for i in ii))
+            flat_srcs = [keys[i] for i in candidates]
 
         xyz_srcs = self.xyz_source(flat_srcs)
         d = volgeom.distance(xyz_srcs, xyz_trg)
@@ -901,24 +1085,42 @@ class VolumeMaskDictionary(Mapping):
 
         Parameters
         ==========
-        src: int
-            mask index
+        src: int or list of int
+            mask index, or a list with mask indices
 
         Returns
         =======
-        target: int
+        target: int or list of int
             linear index of the voxel that is contained in the mask associated
-            with src and nearest (Euclidean distance) to src.
+            with src and nearest (Euclidean distance) to src. If src is a list
+            then a list with such an index for each mask is returned.
         """
+        sources = list(source) if type(source) in (list, tuple) else [source]
 
-        trgs = self.__getitem__(source)
+        # all voxels in all masks at once
+        self._consolidate()
+        rows = np.asarray([self._src2idx[s] for s in sources], dtype=np.int)
+        counts = np.diff(self._offsets)[rows]
+
+        empty = np.nonzero(counts == 0)[0]
+        if len(empty):
+            raise ValueError("No voxels in mask %r" % (sources[empty[0]],))
+
+        trgs = self._get_nbrs(sources)
         trg_xyz = self.xyz_target(trgs)
+        src_xyz = np.reshape(self.xyz_source(sources), (-1, 3))
 
-        src_xyz = self.xyz_source(source)
-        d = volgeom.distance(trg_xyz, src_xyz)
-        i = np.argmin(d)
+        delta = trg_xyz - np.repeat(src_xyz, counts, axis=0)
+        d = np.sum(delta ** 2, 1)
 
-        return trgs[i / src_xyz.shape[0]]
+        # per mask, the voxel with the smallest distance comes first;
+        # the sort is stable so ties are resolved as with argmin
+        order = np.lexsort((d, np.repeat(np.arange(len(sources)), counts)))
+        nearest = trgs[order[np.cumsum(counts) - counts]].tolist()
+
+        if type(source) in (list, tuple):
+            return nearest
+        return nearest[0]
 
 
 def _dict_with_arrays2array_tuple(d):
@@ -936,7 +1138,7 @@ def _dict_with_arrays2array_tuple(d):
     - if k is the i-th element in d.keys(), then
           v[k]==data[offset+lengths[i]] where offset=np.sum(lenghts[:i])
 
-    The 'inverse' of this function is _array_tuple2dict_with_arrays
+    The tuples are used directly by VolumeMaskDictionary.__setstate__
     '''
 
     if d is None:
@@ -984,52 +1186,62 @@ def _dict_with_arrays2array_tuple(d):
     return keys, lengths, data
 
 
-def _array_tuple2dict_with_arrays(kld):
-        '''Helper: converts from a tuple-based representation to dictionaries
-
-        This function converts a more efficient tuple-based representation
-        of _src2nbr and _src2aux to canonical dicts
-
-        Input: a tuple (keys, lengths, data) with each element a numpu array
-        Output: dict d where for each key k, each value v[k] is a numpy array
-
-        It holds that:
-        - keys.tolist()==d.keys()
-        - if k is the i-th element in d.keys(), then
-              v[k]==data[offset+lengths[i]] where offset=np.sum(lenghts[:i])
-
-        The 'inverse' of this function is _dict_with_arrays2array_tuple
-        '''
-        if kld is None:
-            return None
-        if type(kld) is dict:
-            if all(type(v) in (tuple, dict) for v in kld.values()):
-                # probably src2aux, so run recursively
-                return dict((k, _array_tuple2dict_with_arrays(v))
-                            for k, v in kld.iteritems())
-            elif all(isinstance(v, np.ndarray) for v in kld.values()):
-                # old-style mapping
-                return kld
-            else:
-                raise ValueError('Unrecognized dict: %s' % kld)
-
-        keys, lengths, data = kld
+def _as_array_tuple(d):
+    '''Helper: converts a mapping to the tuple-based representation
 
-        # keys must be python int or str, not numpy int or str
-        keys = keys.tolist()
+    Input: dict d where for each key k, each value v[k] is array-like,
+    or a tuple (keys, lengths, data) as returned by
+    _dict_with_arrays2array_tuple
+    Output: a tuple (keys, lengths, data)
+    '''
+    if isinstance(d, dict):
+        if not all(isinstance(v, np.ndarray) for v in d.itervalues()):
+            d = dict((k, np.asarray(v)) for k, v in d.iteritems())
+        if not d:
+            return np.zeros((0,), dtype=np.int), \
+                   np.zeros((0,), dtype=np.int), \
+                   np.zeros((0,), dtype=np.int)
+        return _dict_with_arrays2array_tuple(d)
+
+    keys, lengths, data = d
+    return keys, lengths, data
 
-        # space for output
-        d = dict()
 
-        pos = 0
-        for key, length in zip(keys, lengths):
-            d[key] = data[pos + np.arange(length)]
-            pos += length
+def _align_array_tuple(kld, keys, lengths):
+    '''Helper: align values in the tuple-based representation with masks
 
-        if pos != data.size:
-            raise ValueError('data size mismatch: expected %s, found %s' %
-                                    (data.size, pos))
-        return d
+    Input: a tuple (keys, lengths, data) and the keys and lengths of masks
+    Output: data reordered for keys, with values of length one repeated to
+    the length of the corresponding mask
+    '''
+    akeys, alengths, adata = kld
+
+    # keys must be python int or str, not numpy int or str
+    akeys = np.asarray(akeys).tolist()
+    alengths = np.asarray(alengths, dtype=np.int)
+    if akeys == keys and np.array_equal(alengths, lengths):
+        return adata
+
+    offsets = np.hstack(([0], np.cumsum(alengths)))
+    if offsets[-1] != len(adata):
+        raise ValueError('data size mismatch: expected %s, found %s' %
+                                (len(adata), offsets[-1]))
+
+    key2pos = dict((k, i) for i, k in enumerate(akeys))
+    values = []
+    for key, length in zip(keys, lengths):
+        if not key in key2pos:
+            raise ValueError("No auxiliary information for %r" % (key,))
+        i = key2pos[key]
+        v = adata[offsets[i]:offsets[i + 1]]
+        if len(v) == 1:
+            v = np.repeat(v, length)
+        elif len(v) != length:
+            raise ValueError('size mismatch: size %d != %d or 1' %
+                                (len(v), length))
+        values.append(v)
+
+    return np.hstack(values)
 
 
 def from_any(s):
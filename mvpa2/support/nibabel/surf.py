@@ -47,6 +47,10 @@ class Surface(object):
         a surface specified by vertices and faces
     '''
 
+    _batch_nelements = 2 ** 22
+    '''Maximal number of (source, node) distances that
+    dijkstra_distance_matrix keeps in memory at once'''
+
     def __init__(self, v, f=None, check=True):
         # set vertices
         v = np.asarray(v)
@@ -259,6 +263,42 @@ class Surface(object):
 
         return dict(self._nbrs)  # make a copy
 
+    @property
+    def adjacency_matrix(self):
+        '''Sparse matrix with the (Euclidean) length of each edge
+
+        Returns
+        -------
+        adj : scipy.sparse.csr_matrix
+            PxP matrix (with P==self.nvertices) so that adj[i,j]=d means
+            that nodes i and j share an edge of length d. It holds that
+            adj[i,j]==adj[j,i]. Nodes that do not share an edge have no
+            entry stored.
+
+        Note
+        ----
+        This matrix holds the same information as neighbors, but is
+        computed without looping over faces in Python. It is computed if
+        called for the first time, otherwise the cached result is returned.
+        '''
+
+        if not hasattr(self, '_adjacency'):
+            from scipy import sparse
+
+            nv, v, f = self._nv, self._v, self._f
+
+            # each edge of each face, in both directions
+            p = f.ravel().astype(np.int64)
+            q = f[:, [1, 2, 0]].ravel().astype(np.int64)
+            edges = np.unique(np.hstack((p * nv + q, q * nv + p)))
+            p, q = edges // nv, edges % nv
+
+            d = np.sum((v[p] - v[q]) ** 2, 1) ** .5
+
+            self._adjacency = sparse.csr_matrix((d, (p, q)), shape=(nv, nv))
+
+        return self._adjacency
+
     def circlearound_n2d(self, src, radius, metric='euclidean'):
         '''Finds the distances from a center node to surrounding nodes.
 
@@ -354,6 +394,173 @@ class Surface(object):
 
         return fdist
 
+    def dijkstra_distance_matrix(self, srcs=None, maxdistance=None):
+        '''Computes Dijkstra distances from many nodes to surrounding nodes
+
+        Parameters
+        ----------
+        srcs : list of int or None
+            Indices of center (source) nodes. If None then all nodes are
+            used as source.
+        maxdistance: float (default: None)
+            Maximum distance for a node to qualify as a 'surrounding' node.
+            If 'maxdistance is None' then the distances to all nodes are
+            returned.
+
+        Returns
+        -------
+        n2d : scipy.sparse.csr_matrix
+            QxP matrix (with Q==len(srcs) and P==self.nvertices) so that
+            n2d[i,j]=d means that the distance from node srcs[i] to node j
+            is d. Only distances to surrounding nodes are stored; the
+            distance from srcs[i] to itself is stored as an explicit zero,
+            so that n2d[i].indices are exactly the nodes surrounding
+            srcs[i].
+
+        Note
+        ----
+        Distances are computed with scipy.sparse.csgraph on the
+        adjacency_matrix, for batches of nearby sources at once. If
+        maxdistance is not None, a batch only considers the nodes in the
+        bounding box of its sources widened by maxdistance, as no shorter
+        path can leave that box. For a single source dijkstra_distance
+        is usually faster.
+        '''
+        from scipy import sparse
+        from scipy.sparse.csgraph import dijkstra
+
+        srcs = self._as_source_indices(srcs)
+        limit = np.inf if maxdistance is None else maxdistance
+
+        adj = self.adjacency_matrix
+        node2sub = np.zeros((self._nv,), dtype=np.int_) - 1
+
+        rows, cols, ds = [], [], []
+        for batch, subnodes in self._source_batches(srcs, maxdistance):
+            if subnodes is None:
+                sub = adj
+                sub_srcs = srcs[batch]
+            else:
+                # sub graph with only the nodes near the sources
+                nsub = len(subnodes)
+                node2sub[subnodes] = np.arange(nsub)
+                sub = adj[subnodes]
+                sub_rows = np.repeat(np.arange(nsub), np.diff(sub.indptr))
+                sub_cols = node2sub[sub.indices]
+                keep = sub_cols >= 0
+                sub = sparse.csr_matrix((sub.data[keep],
+                                         (sub_rows[keep], sub_cols[keep])),
+                                        shape=(nsub, nsub))
+                sub_srcs = node2sub[srcs[batch]]
+                node2sub[subnodes] = -1
+
+            d = dijkstra(sub, indices=sub_srcs, limit=limit)
+            i, j = np.nonzero(np.isfinite(d))
+
+            rows.append(batch[i])
+            cols.append(j if subnodes is None else subnodes[j])
+            ds.append(d[i, j])
+
+        return self._as_distance_matrix(srcs, rows, cols, ds)
+
+    def _as_source_indices(self, srcs):
+        '''Checks source node indices for *_distance_matrix
+
+        Returns all node indices if srcs is None, and srcs as a
+        vector of node indices otherwise'''
+        nv = self._nv
+
+        if srcs is None:
+            return np.arange(nv)
+
+        srcs = np.asarray(srcs, dtype=np.int_).ravel()
+        if np.any((srcs < 0) | (srcs >= nv)):
+            raise ValueError("Source node indices should be in range 0..%d"
+                             % (nv - 1))
+        return srcs
+
+    def _as_distance_matrix(self, srcs, rows, cols, ds):
+        '''Combines batches of distances into a sparse matrix'''
+        from scipy import sparse
+
+        shape = (len(srcs), self._nv)
+        if not rows:
+            return sparse.csr_matrix(shape)
+
+        rows, cols, ds = map(np.hstack, (rows, cols, ds))
+        return sparse.csr_matrix((ds, (rows, cols)), shape=shape)
+
+    def _source_batches(self, srcs, maxdistance=None):
+        '''Splits source nodes into batches of nearby nodes
+
+        Parameters
+        ----------
+        srcs : np.ndarray
+            Indices of source nodes.
+        maxdistance : float or None
+            Maximum distance from a source to the nodes of interest.
+
+        Returns
+        -------
+        batches : generator
+            Yields (batch, subnodes) tuples, where batch are indices of
+            srcs and subnodes are the indices of all nodes that lie
+            within maxdistance (in each dimension) of any node in
+            srcs[batch]; subnodes is None if maxdistance is None, meaning
+            all nodes. Each batch has either a single source or
+            len(batch)*len(subnodes) <= self._batch_nelements.
+        '''
+        nv, v = self._nv, self._v
+        nsrcs = len(srcs)
+        max_nelements = self._batch_nelements
+        step = max(1, max_nelements // max(nv, 1))
+
+        if maxdistance is None:
+            for start in xrange(0, nsrcs, step):
+                yield np.arange(start, min(start + step, nsrcs)), None
+            return
+
+        # visit sources ordered by position so that each batch
+        # covers a small part of the surface
+        cells = np.floor(v[srcs] / (maxdistance or 1.))
+        order = np.lexsort(cells.T[::-1])
+
+        x_order = np.argsort(v[:, 0])
+        x_sorted = v[x_order, 0]
+
+        start = 0
+        while start < nsrcs:
+            # shrink the batch until its distances fit in memory
+            while True:
+                batch = order[start:start + step]
+                xyz = v[srcs[batch]]
+                # nodes without (finite) coordinates have no neighbors
+                xyz = xyz[np.all(np.isfinite(xyz), 1)]
+
+                if len(xyz):
+                    lo = np.min(xyz, 0) - maxdistance
+                    hi = np.max(xyz, 0) + maxdistance
+
+                    subnodes = x_order[np.searchsorted(x_sorted, lo[0]):
+                                       np.searchsorted(x_sorted, hi[0],
+                                                       side='right')]
+                    xyz = v[subnodes]
+                    subnodes = subnodes[np.all((xyz >= lo) * (xyz <= hi), 1)]
+                else:
+                    subnodes = np.zeros((0,), dtype=np.int_)
+                subnodes = np.union1d(subnodes, srcs[batch])
+
+                nelements = len(batch) * len(subnodes)
+                if step == 1 or nelements <= max_nelements:
+                    break
+                step //= 2
+
+            yield batch, subnodes
+
+            start += len(batch)
+            # try a larger batch next time
+            step *= 2
+
     def dijkstra_shortest_path(self, src, maxdistance=None):
         '''Computes Dijkstra shortest path from one node to surrounding nodes.
 
@@ -529,6 +736,132 @@ class Surface(object):
         d = np.power(ss, .5)
         return d
 
+    def euclidean_distance_matrix(self, srcs=None, maxdistance=None):
+        '''Computes Euclidean distances from many nodes to surrounding nodes
+
+        Parameters
+        ----------
+        srcs : list of int or None
+            Indices of center (source) nodes. If None then all nodes are
+            used as source.
+        maxdistance: float (default: None)
+            Maximum distance for a node to qualify as a 'surrounding' node.
+            If 'maxdistance is None' then the distances to all nodes are
+            returned.
+
+        Returns
+        -------
+        n2d : scipy.sparse.csr_matrix
+            QxP matrix (with Q==len(srcs) and P==self.nvertices) so that
+            n2d[i,j]=d means that the distance from node srcs[i] to node j
+            is d, in the same format as dijkstra_distance_matrix.
+        '''
+        v = self._v
+        srcs = self._as_source_indices(srcs)
+
+        rows, cols, ds = [], [], []
+        for batch, subnodes in self._source_batches(srcs, maxdistance):
+            if subnodes is None:
+                subnodes = np.arange(self._nv)
+
+            # same arithmetic as euclidean_distance
+            ss = 0.
+            for dim in xrange(3):
+                delta = v[subnodes, dim][np.newaxis] - \
+                        v[srcs[batch], dim][:, np.newaxis]
+                ss = ss + delta * delta
+            d = np.power(ss, .5)
+
+            if maxdistance is None:
+                i, j = np.nonzero(np.isfinite(d))
+            else:
+                i, j = np.nonzero(d <= maxdistance)
+
+            rows.append(batch[i])
+            cols.append(subnodes[j])
+            ds.append(d[i, j])
+
+        return self._as_distance_matrix(srcs, rows, cols, ds)
+
+    def _get_spatial_index(self, node_indices=None):
+        '''Helper: KD-tree of node coordinates
+
+        Returns a tuple (tree, nodes) with a scipy.spatial.cKDTree of the
+        coordinates of nodes (in node_indices, or all nodes if None)
+        that are finite, and the indices of these nodes. The tree for
+        all nodes is computed if called for the first time, otherwise
+        the cached result is returned.
+        '''
+        use_cache = node_indices is None
+        if use_cache and hasattr(self, '_spatial_index'):
+            return self._spatial_index
+
+        from scipy.spatial import cKDTree
+
+        nodes = np.arange(self.nvertices)
+        if not use_cache:
+            nodes = nodes[node_indices]
+
+        v = self.vertices[nodes]
+        finite = np.all(np.isfinite(v), 1)
+        spatial_index = cKDTree(v[finite]), nodes[finite]
+
+        if use_cache:
+            self._spatial_index = spatial_index
+
+        return spatial_index
+
+    def nearest_nodes(self, coords, node_indices=None):
+        '''Finds the nearest node for many coordinates at once
+
+        Parameters
+        ----------
+        coords: numpy.ndarray (Px3 array)
+            Coordinates for which the nearest nodes are found
+        node_indices: numpy.ndarray (default: None)
+            Indices of nodes to consider. By default all nodes are considered
+
+        Returns
+        -------
+        idxs: numpy.ndarray (P-valued vector)
+            Indices of nearest nodes, or -1 for coordinates that are not
+            finite (or if there are no nodes with finite coordinates)
+        ds: numpy.ndarray (P-valued vector)
+            Euclidean distances to the nearest nodes, or np.inf if idxs
+            is -1
+
+        Note
+        ----
+        Nearest nodes are found with a KD-tree of the node coordinates.
+        Unless node_indices is provided, this tree is computed only once.
+        '''
+        coords = np.reshape(np.asarray(coords, dtype=np.float), (-1, 3))
+        tree, nodes = self._get_spatial_index(node_indices)
+
+        n = coords.shape[0]
+        idxs = np.zeros((n,), dtype=np.int) - 1
+        ds = np.zeros((n,)) + np.inf
+
+        finite = np.nonzero(np.all(np.isfinite(coords), 1))[0]
+        nfinite = len(finite)
+        if nfinite and len(nodes):
+            # take a few nearest nodes as candidates, and compute their
+            # distances as a brute-force search would, so that (nearly)
+            # equal distances are resolved in the same way as np.argmin
+            k = min(4, len(nodes))
+            _, i = tree.query(coords[finite], k=k)
+            i = np.sort(np.reshape(i, (nfinite, k)), 1)
+
+            delta = self.vertices[nodes[i]] - coords[finite, np.newaxis]
+            ss = np.sum(delta ** 2, 2)
+            j = np.argmin(ss, 1)
+            rows = np.arange(nfinite)
+
+            idxs[finite] = nodes[i[rows, j]]
+            ds[finite] = ss[rows, j] ** .5
+
+        return idxs, ds
+
     def nearest_node_index(self, src_coords, node_mask_indices=None):
         '''Computes index of nearest node to src
 
@@ -542,7 +875,7 @@ class Surface(object):
         Returns
         -------
         idxs: numpy.ndarray (P-valued vector)
-            Indices of nearest nodes
+            Indices of nearest nodes (-1 for coordinates that are not finite)
         '''
 
         if not isinstance(src_coords, np.ndarray):
@@ -555,20 +888,7 @@ class Surface(object):
         elif len(src_coords.shape) != 2 or src_coords.shape[1] != 3:
             raise ValueError("Expected Px3 array for src_coords")
 
-        use_mask = node_mask_indices is not None
-        # vertices to consider
-        v = self.vertices[node_mask_indices] if use_mask else self.vertices
-
-        # indices of these vertices
-        all_idxs = np.arange(self.nvertices)
-        masked_idxs = all_idxs[node_mask_indices] if use_mask else all_idxs
-
-        n = src_coords.shape[0]
-        idxs = np.zeros((n,), dtype=np.int)
-        for i in xrange(n):
-            delta = v - src_coords[i]
-            minidx = np.argmin(np.sum(delta ** 2, 1))
-            idxs[i] = masked_idxs[minidx]
+        idxs, _ = self.nearest_nodes(src_coords, node_mask_indices)
 
         return idxs
 
@@ -943,7 +1263,8 @@ class Surface(object):
 
     def __reduce__(self):
         # these are lazily computed on the first call to e.g. node2faces
-        lazy_keys = ('_n2f', '_f2el', '_v2ael', '_e2f', '_nbrs')
+        lazy_keys = ('_n2f', '_f2el', '_v2ael', '_e2f', '_nbrs', '_adjacency',
+                     '_spatial_index')
         lazy_dict = dict()
         # TODO: add in efficient way to translate these dictionaries
         #       to something like a numpy array, and implement the 
@@ -953,6 +1274,8 @@ class Surface(object):
         #       _v2ael: array
         #       _e2f: (int,int) -> int
         #       _nbrs: int -> (int -> float)
+        #       _adjacency: scipy.sparse.csr_matrix
+        #       _spatial_index: (scipy.spatial.cKDTree, array)
         #       
         # For now this this functionaltiy is switched off,
         # because pickling it (also with hdf5) takes a long time
@@ -1329,10 +1652,9 @@ class Surface(object):
         MapIcosahedron, where the lower resolution surface defines centers
         in a searchlight whereas the higher resolution surfaces is used to
         delineate the grey matter for voxel selection.
-        This function implements an optimization which in most cases
-        yields solutions much faster than map_to_high_resolution_surf_exact,
-        but may fail to find the correct solution for larger values
-        of epsilon.
+        Unlike map_to_high_resolution_surf_slow, this function finds
+        nearest nodes for all nodes at once using a KD-tree of the
+        nodes in the high resolution surface.
 
         Parameters
         ----------
@@ -1394,80 +1716,27 @@ class Surface(object):
                              "this one (%d)" % (nx, ny))
 
 
-        # use a fast approach
-        # slice up the high and low res in smaller boxes
-        # and index them, so that when finding the nearest coordinates
-        # it only requires to consider a limited number of nodes
-        n_boxes = 20
-        box_size = max(np.max(x, 0) - np.min(x, 0)) / n_boxes
-
-        x_boxed = self.coordinates_to_box_indices(box_size,
-                                                  master=highres) + .5
-        y_boxed = highres.coordinates_to_box_indices(box_size) + .5
-
-        # get indices of nodes that are very near a box boundary
-        delta = epsilon / box_size
-        on_borders = np.nonzero(np.logical_or( \
-            np.floor(y_boxed + delta) - np.floor(y_boxed) > 0,
-            np.floor(y_boxed) - np.floor(y_boxed - delta) > 0))[0]
-
-        # on_borders may have duplicates - so get rid of those.
-        msk = np.zeros((ny,), dtype=np.int)
-        msk[on_borders] = 1
-        on_borders = np.nonzero(msk)[0]
-
-        # convert to tuples with integers for indexing
-        # (tuples are hashable so can be used as keys in dictionary)
-        x_tuples = map(tuple, np.asarray(x_boxed, dtype=np.int))
-        y_tuples = map(tuple, np.asarray(y_boxed, dtype=np.int))
-
-        # maps box indices in low-resolution surface to indices
-        # of potentially nearby nodes in highres surface
-        x_tuple2near_indices = dict()
-
-        # add border nodes to all low-res surface
-        # this is a bit inefficient
-        # TODO optimize to consider neighboorhood
-        for x_tuple in x_tuples:
-            x_tuple2near_indices[x_tuple] = list(on_borders)
-
-        # for non-border nodes in high-res surface, add them to
-        # a single box
-        for i, y_tuple in enumerate(y_tuples):
-            if i in on_borders:
-                continue  # because it was added above
-
-            if not y_tuple in x_tuple2near_indices:
-                x_tuple2near_indices[y_tuple] = list()
-            x_tuple2near_indices[y_tuple].append(i)
-
-        # it now holds that for every node i in low-res surface (which is
-        # identified by t=x_tuples[i]), there is no node j in the high-res surface
-        # within distance epsilon for which j in x_tuple2near_indices[t]
-
-        for i, x_tuple in enumerate(x_tuples):
-            i_xyz = x[i, :]
-            if np.any(np.isnan(i_xyz)):
-                continue
+        # nearest high-res node for each low-res node at once,
+        # using the (cached) spatial index of the highres surface
+        idxs, ds = highres.nearest_nodes(x)
 
-            idxs = np.asarray(x_tuple2near_indices[x_tuple])
+        # nodes with nan coordinates are not mapped
+        valid = np.nonzero(np.logical_not(np.any(np.isnan(x), 1)))[0]
 
-            ds = np.sum((x[i, :] - y[idxs, :]) ** 2, axis=1)
+        missing = valid[idxs[valid] < 0]
+        if len(missing):
+            i = missing[0]
+            raise ValueError("Empty sequence: is center %d (%r)"
+                             " illegal?" % (i, (x[i],)))
 
-            not_nan_idxs = np.nonzero(np.logical_not(np.isnan(ds)))[0]
-            if len(not_nan_idxs) == 0:
-                raise ValueError("Empty sequence: is center %d (%r)"
-                                 " illegal?" % (i, (x[i],)))
-
-            minpos = not_nan_idxs[np.argmin(ds[not_nan_idxs])]
-
-            mind = ds[minpos] ** .5
-
-            if epsilon is not None and not (mind < epsilon):
+        if epsilon is not None:
+            too_far = valid[np.logical_not(ds[valid] < epsilon)]
+            if len(too_far):
+                i = too_far[0]
                 raise ValueError("Not found for node %i: %s > %s" %
-                                 (i, mind, epsilon))
+                                 (i, ds[i], epsilon))
 
-            mapping[i] = idxs[minpos]
+        mapping.update(zip(valid.tolist(), idxs[valid].tolist()))
 
         return mapping
 
@@ -1518,43 +1787,42 @@ class Surface(object):
 
         # node indices in high-res surface that have a mapping
         # and thus are acceptable
-        highres_center_set = set(high2low)
-
+        is_center = np.zeros((highres_surf.nvertices,), dtype=np.bool_)
+        is_center[list(high2low)] = True
 
         # starting value for radius
         radius = np.mean(self.average_node_edge_length)
         max_radius = radius * 10000.
 
-        # set of node indices of low-res surface
-        lowres_node_set = set(xrange(self.nvertices))
-
         # space for output
         high2high_in_low = dict()
 
+        # high-res nodes that have not been mapped yet
+        pending = np.asarray(sorted(highres_indices), dtype=np.int_)
+
         # continue increasing radius until all high-res nodes
         # have been mapped to a low-res node
-        while set(high2high_in_low) != highres_indices:
-            for highres_index in highres_indices:
-                if highres_index in high2high_in_low:
-                    # already has a low-res node mapped to it
-                    continue
-
-                # compute distances in high-res surface
-                ds = highres_surf.dijkstra_distance(highres_index, radius)
-
-                common = set.intersection(set(ds), highres_center_set)
-
-                if len(common):
-                    # keep only distances to allowed nodes
-                    small_ds = dict(
-                        (k, v) for k, v in ds.iteritems() if k in common)
-
-                    # find nearest node
-                    nearest_node_highres = min(small_ds, key=small_ds.get)
-                    d = small_ds[nearest_node_highres]
-
-                    # store the result
-                    high2high_in_low[highres_index] = (nearest_node_highres, d)
+        while len(pending):
+            # compute distances in high-res surface
+            n2d = highres_surf.dijkstra_distance_matrix(pending, radius)
+
+            # keep only distances to allowed nodes
+            rows = np.repeat(np.arange(len(pending)), np.diff(n2d.indptr))
+            keep = is_center[n2d.indices]
+            rows, cols, ds = rows[keep], n2d.indices[keep], n2d.data[keep]
+
+            # find nearest node for each row (lowest index for ties)
+            order = np.lexsort((cols, ds, rows))
+            rows, cols, ds = rows[order], cols[order], ds[order]
+            nearest = np.hstack(([True], rows[1:] != rows[:-1]))[:len(rows)]
+            rows, cols, ds = rows[nearest], cols[nearest], ds[nearest]
+
+            # store the result
+            for i, j, d in zip(pending[rows].tolist(), cols.tolist(),
+                               ds.tolist()):
+                high2high_in_low[i] = (j, d)
+
+            pending = np.delete(pending, rows)
 
             radius *= 2
 
@@ -8,6 +8,7 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 """Unit tests for PyMVPA SplittingSensitivityAnalyzer"""
 
+import os
 import numpy as np
 
 from mvpa2.testing import *
@@ -541,6 +542,87 @@ class SensitivityAnalysersTests(unittest.TestCase):
         assert_equal(res.shape, (len(self.dataset.sa['chunks'].unique), 1))
 
 
+    @sweepargs(executor=('serial', 'thread', 'process'))
+    def test_parallel_cv(self, executor):
+        if executor == 'process' and not hasattr(os, 'fork'):
+            raise SkipTest("'process' backend requires fork()")
+        ds = self.dataset
+        def run(**kwargs):
+            callback_folds = []
+            def store_fold(data, node, result):
+                callback_folds.append(
+                    (data.sa.partitions.copy(), result.samples.copy(),
+                     node.ca.stats.matrix.copy()))
+            cv = CrossValidation(SMLR(), NFoldPartitioner(),
+                                 callback=store_fold,
+                                 enable_ca=['stats', 'training_stats',
+                                            'repetition_results', 'datasets'],
+                                 **kwargs)
+            return cv, cv(ds), callback_folds
+        cv, res, folds = run()
+        pcv, pres, pfolds = run(nproc=2, executor=executor)
+        # SMLR is deterministic, so results match the serial run exactly
+        assert_array_equal(res.samples, pres.samples)
+        assert_array_equal(res.sa.cvfolds, pres.sa.cvfolds)
+        assert_equal(len(folds), len(pfolds))
+        for fold, pfold in zip(folds, pfolds):
+            assert_array_equal(fold[0], pfold[0])
+            assert_array_equal(fold[1], pfold[1])
+            assert_array_equal(fold[2], pfold[2])
+        assert_array_equal(cv.ca.stats.matrix, pcv.ca.stats.matrix)
+        assert_array_equal(cv.ca.training_stats.matrix,
+                           pcv.ca.training_stats.matrix)
+        for r, pr in zip(cv.ca.repetition_results,
+                         pcv.ca.repetition_results):
+            assert_array_equal(r.samples, pr.samples)
+        assert_equal(len(pcv.ca.datasets), len(cv.ca.datasets))
+        assert_true('executor=%r' % executor in repr(pcv))
+
+
+    @sweepargs(executor=('thread', 'process'))
+    def test_parallel_cv_svm(self, executor):
+        if not externals.exists('libsvm'):
+            raise SkipTest("libsvm is not available")
+        if executor == 'process' and not hasattr(os, 'fork'):
+            raise SkipTest("'process' backend requires fork()")
+        ds = self.dataset
+        res = []
+        for kwargs in ({}, dict(nproc=2, executor=executor)):
+            # a trained libsvm model can not be pickled, hence must not be
+            # sent back from the workers
+            cv = CrossValidation(libsvm.SVM(), NFoldPartitioner(),
+                                 enable_ca=['stats', 'training_stats'],
+                                 **kwargs)
+            res.append((cv(ds).samples, cv.ca.stats.matrix,
+                        cv.ca.training_stats.matrix))
+        for r, pr in zip(*res):
+            assert_array_equal(r, pr)
+
+
+    @sweepargs(executor=('serial', 'process'))
+    def test_parallel_repetitions_seeded(self, executor):
+        if executor == 'process' and not hasattr(os, 'fork'):
+            raise SkipTest("'process' backend requires fork()")
+        from mvpa2.generators.permutation import AttributePermutator
+        class RandomMeasure(Measure):
+            is_trained = True
+            def _call(self, ds):
+                return Dataset([[np.random.uniform(), ds.targets[0]]])
+        ds = self.dataset
+        results = []
+        for kwargs in ({}, dict(nproc=2, executor=executor)):
+            rm = RepeatedMeasure(RandomMeasure(),
+                                 AttributePermutator('targets', count=6),
+                                 reseed=True, **kwargs)
+            mvpa2.seed(1)
+            results.append(rm(ds).samples)
+        # both the generator and the node draw random numbers, which
+        # nevertheless are the same regardless of parallelization
+        assert_equal(len(np.unique(results[0][:, 0])), 6)
+        assert_array_equal(results[0], results[1])
+        assert_true('reseed=True' in repr(rm))
+
+
     def test_repeated_features(self):
         class CountFeatures(Measure):
             is_trained = True
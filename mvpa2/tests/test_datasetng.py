@@ -21,9 +21,11 @@ from mvpa2.base import cfg
 from mvpa2.base.externals import versions
 from mvpa2.base.types import is_datasetlike
 from mvpa2.base.dataset import DatasetError, vstack, hstack, all_equal, \
+                                DatasetStacker, \
                                 stack_by_unique_feature_attribute, \
                                 stack_by_unique_sample_attribute
-from mvpa2.datasets.base import dataset_wizard, Dataset, HollowSamples
+from mvpa2.datasets.base import dataset_wizard, Dataset, HollowSamples, \
+     DatasetView
 from mvpa2.misc.data_generators import normal_feature_dataset
 from mvpa2.testing import reseed_rng
 import mvpa2.support.copy as copy
@@ -501,6 +503,48 @@ def test_stack_add_attributes():
                 assert_array_equal(col['ok'].value, COL(data0)['ok'].value)
                 assert_array_equal(col['ok'].value, COL(data1)['ok'].value)
 
+def test_dataset_stacker():
+    dss = [Dataset(np.random.normal(size=(i, 4)),
+                   sa=dict(targets=[i] * i, coords=np.ones((i, 2)) * i),
+                   fa=dict(roi=np.arange(4)),
+                   a=dict(n=i % 2))
+           for i in xrange(1, 6)]
+    # integer samples get promoted when floats arrive
+    dss[0].samples = np.ones((1, 4), dtype=int)
+    dss[2].fa['extra'] = np.arange(4)
+    for axis, xstack in ((0, vstack), (1, hstack)):
+        if axis:
+            dss = [Dataset(ds.samples.T,
+                           sa=dict([(k, v.value) for k, v in ds.fa.items()]),
+                           fa=dict([(k, v.value) for k, v in ds.sa.items()]),
+                           a=dict(n=ds.a.n))
+                   for ds in dss]
+        # streaming
+        stacker = DatasetStacker(axis=axis, a='uniques')
+        for i, ds in enumerate(dss):
+            stacker.append(ds)
+            assert_equal(len(stacker), i + 1)
+        stacked = stacker.get()
+        assert_datasets_equal(stacked, xstack(dss, a='uniques'))
+        assert_equal(stacked.shape[axis], 15)
+        assert_equal(stacked.a.n, (1, 0))
+        # non-unique attribute of the other axis got dropped
+        ok_(not 'extra' in (stacked.fa, stacked.sa)[axis])
+        # the stack can grow further without affecting the result
+        stacker.append(dss[0])
+        assert_equal(stacked.shape[axis], 15)
+        assert_equal(stacker.get().shape[axis], 16)
+        stacker.reset()
+        assert_raises(ValueError, stacker.get)
+        # all at once
+        stacker.extend(dss)
+        assert_datasets_equal(stacker.get(), stacked)
+        # mismatching size along the other axis
+        assert_raises(ValueError, stacker.append,
+                      dss[0][:, :2] if axis == 0 else dss[0][:2])
+    assert_raises(ValueError, DatasetStacker, axis=2)
+    assert_raises(ValueError, DatasetStacker, strategy='bogus')
+
 def test_unique_stack():
     data = Dataset(np.reshape(np.arange(24), (4, 6)),
                         sa=dict(x=[0, 1, 0, 1]),
@@ -820,6 +864,42 @@ def test_arrayattributes():
                   'complex_list2', [[], [1], [1, 2]])
 
 
+def test_factorized_attributes():
+    ds = dataset_wizard(np.arange(24).reshape((8, 3)),
+                        targets=['b', 'a', 'c', 'a', 'b', 'b', 'c', 'a'],
+                        chunks=[3, 3, 1, 1, 2, 2, 1, 3])
+    uniques, codes = ds.sa['targets'].factorized
+    assert_array_equal(uniques, ['a', 'b', 'c'])
+    assert_array_equal(uniques[codes], ds.targets)
+    assert_array_equal(ds.sa['targets'].unique, uniques)
+    groups = ds.sa['targets'].groups
+    assert_equal(len(groups), 3)
+    for u, g in zip(uniques, groups):
+        assert_array_equal(g, np.where(ds.targets == u)[0])
+    # computed only once
+    assert_true(ds.sa['targets'].groups is groups)
+    # and shared with shallow copies
+    assert_true(ds.copy(deep=False).sa['targets'].groups is groups)
+    # slices derive it from the parent
+    sds = ds[[0, 4, 2, 6]]
+    suniques, scodes = sds.sa['targets'].factorized
+    assert_array_equal(suniques, ['b', 'c'])
+    assert_array_equal(suniques[scodes], sds.targets)
+    assert_array_equal(sds.sa['targets'].groups[1], [2, 3])
+    # but are reset upon assignment
+    sds.targets = ['x', 'y', 'x', 'x']
+    assert_array_equal(sds.sa['targets'].factorized[0], ['x', 'y'])
+    assert_array_equal(sds.sa['targets'].groups[0], [0, 2, 3])
+    # group-based helpers
+    from mvpa2.datasets.miscfx import get_samples_by_attr
+    assert_array_equal(get_samples_by_attr(ds, 'chunks', [3, 1]),
+                       [0, 1, 2, 3, 6, 7])
+    assert_array_equal(get_samples_by_attr(ds, 'chunks', 5), [])
+    # only 1D attributes
+    ds.fa['coords'] = np.arange(6).reshape((3, 2))
+    assert_raises(ValueError, getattr, ds.fa['coords'], 'factorized')
+
+
 def test_repr():
     attr_repr = "SampleAttribute(name='TestAttr', doc='my own test', " \
                                 "value=array([0, 1, 2, 3, 4]), length=None)"
@@ -1105,6 +1185,54 @@ def test_hollow_samples():
     assert_equal(ds.samples.dtype, int)
     assert_equal(ds.shape, sshape)
 
+def test_dataset_view():
+    ds = dataset_wizard(np.arange(60).reshape((6, 2, 5)),
+                        targets=range(6), chunks=[0, 0, 1, 1, 2, 2])
+    ds.fa['roi'] = np.arange(10) % 3
+    sel = ([4, 1, 3], [0, 2, 7, 9])
+    orig = ds[sel]
+    view = DatasetView.from_dataset(ds, *sel)
+    assert_true(isinstance(view, Dataset))
+    # nothing is selected until needed
+    assert_equal(view.shape, orig.shape)
+    assert_equal(len(view), 3)
+    assert_equal(view.nfeatures, 4)
+    assert_true(view._is_lazy())
+    assert_array_equal(view.sa.targets, orig.sa.targets)
+    assert_true(view._samples is None)
+    assert_array_equal(view.samples, orig.samples)
+    assert_array_equal(view.fa.roi, orig.fa.roi)
+    # mapper gets the feature selection appended
+    assert_array_equal(view.a.mapper.reverse1(view.samples[0]),
+                       orig.a.mapper.reverse1(orig.samples[0]))
+    # views of lazy views refer to the origin
+    subview = DatasetView.from_dataset(ds, [1, 2, 4])[::2, ds.fa.roi == 0]
+    assert_true(subview._dataset is ds)
+    assert_array_equal(subview.samples, ds[[1, 4], ds.fa.roi == 0].samples)
+    assert_array_equal(
+        subview.a.mapper.forward(ds.a.mapper.reverse(ds.samples))[[1, 4]],
+        subview.samples)
+    # selection dicts work as well
+    assert_array_equal(DatasetView.from_dataset(ds)[:, {'roi': [0]}].samples,
+                       ds[:, {'roi': [0]}].samples)
+    # but materialized ones are used as they are
+    view.sa['new'] = range(3)
+    subview = view[np.array([True, False, True])]
+    assert_true(subview._dataset is view)
+    assert_array_equal(subview.sa.new, [0, 2])
+    assert_array_equal(subview.samples, orig.samples[[0, 2]])
+    # modifications do not affect the parent
+    view.samples = view.samples * 0
+    assert_array_equal(ds.samples, dataset_wizard(np.arange(60).reshape((6, 2, 5))).samples)
+    assert_false('new' in ds.sa)
+    # copies and stacking produce plain datasets
+    for res in (view.copy(), copy.deepcopy(view), vstack((view, view)),
+                hstack((view, view))):
+        assert_true(isinstance(res, Dataset))
+        assert_array_equal(res.samples, 0)
+    assert_array_equal(view.copy(deep=True).sa.targets, orig.sa.targets)
+
+
 def test_assign_sa():
     # https://github.com/PyMVPA/PyMVPA/issues/149
     ds = Dataset(np.arange(6).reshape((2,-1)), sa=dict(targets=range(2)))
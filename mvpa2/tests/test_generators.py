@@ -19,6 +19,7 @@ from mvpa2.testing.tools import assert_warnings
 from mvpa2.testing.tools import assert_datasets_equal
 
 from mvpa2.datasets import dataset_wizard, Dataset
+from mvpa2.datasets.base import DatasetView
 from mvpa2.generators.splitters import Splitter
 from mvpa2.base.node import ChainNode
 from mvpa2.generators.partition import OddEvenPartitioner, NFoldPartitioner, \
@@ -99,6 +100,38 @@ def test_partitionmapper():
         assert_equal(len(p), len(ds))
 
 
+def test_partition_indices():
+    ds = give_data()
+    for p in (NFoldPartitioner(cvtype=2), OddEvenPartitioner(),
+              NFoldPartitioner(count=3)):
+        # same partitionings as with the full datasets
+        for pds, pidx in zip(p.generate(ds), p.generate_indices(ds)):
+            pattr = pds.sa.partitions
+            assert_equal(len(pidx), 3)
+            for i, idx in enumerate(pidx):
+                assert_array_equal(idx, np.where(pattr == i)[0])
+        # no partition set missing
+        assert_equal(len(list(p.generate(ds))),
+                     len(list(p.generate_indices(ds))))
+    # input dataset stays untouched
+    assert_false('partitions' in ds.sa)
+
+    # splitting into lazy views
+    spl = Splitter('partitions', attr_values=(1, 2), view=True)
+    pds = list(NFoldPartitioner().generate(ds))[1]
+    splits = list(spl.generate(pds))
+    assert_equal(len(splits), 2)
+    for split, ref in zip(splits, Splitter('partitions',
+                                           attr_values=(1, 2)).generate(pds)):
+        assert_true(isinstance(split, DatasetView))
+        assert_equal(split.shape, ref.shape)
+        # no samples were sliced yet
+        assert_true(split._samples is None)
+        assert_array_equal(split.sa.chunks, ref.sa.chunks)
+        assert_array_equal(split.samples, ref.samples)
+        assert_equal(split.a.lastsplit, ref.a.lastsplit)
+
+
 @reseed_rng()
 def test_attrpermute():
 
@@ -143,8 +143,6 @@ def test_cluster_count():
 # run same test with parallel and serial execution
 @sweepargs(n_proc=[1, 2])
 def test_group_clusterthreshold_simple(n_proc):
-    if n_proc > 1:
-        skip_if_no_external('joblib')
     feature_thresh_prob = 0.005
     nsubj = 10
     # make a nice 1D blob and a speck
@@ -174,7 +172,10 @@ def test_group_clusterthreshold_simple(n_proc):
 
     clstr_sizes = clthr._null_cluster_sizes
     # getting anything but a lonely one feature cluster is very unlikely
-    assert_true(max([c[0] for c in clstr_sizes.keys()]) <= 1)
+    assert_equal(clstr_sizes.shape, (1, blob.nfeatures + 1))
+    assert_true(np.all(clstr_sizes[0, 2:] == 0))
+    # every bootstrap map contributes at least one count
+    assert_greater_equal(clstr_sizes.sum(), clthr.params.n_bootstrap)
     # threshold orig map
     res = clthr(blob)
     #
@@ -272,6 +273,30 @@ def test_group_clusterthreshold_simple(n_proc):
 
     # TODO continue with somewhat more real dataset
 
+def test_batch_cluster_sizes():
+    # mapped dataset with a feature mask
+    mask = np.random.rand(4, 5, 6) > .3
+    ds = dataset_wizard(np.random.rand(20, 4, 5, 6) > .6, mask=mask)
+    ds.samples[3] = False
+    edges = gct.get_feature_adjacency(ds.a.mapper, ds.nfeatures)
+    # neighbors are unique pairs
+    assert_equal(len(set(zip(*edges))), len(edges[0]))
+    hist = gct.get_batch_cluster_sizes(ds.samples, edges)
+    assert_equal(len(hist), ds.nfeatures + 1)
+    # same as labeling each reverse-mapped sample
+    counter = gct.get_cluster_sizes(ds)
+    assert_equal(dict([(s, c) for s, c in enumerate(hist) if c]),
+                 dict(counter))
+    # plain arrays have neighbors along the feature axis only
+    edges = gct.get_feature_adjacency(gct.IdentityMapper(), 10)
+    assert_array_equal(edges[0], np.arange(9))
+    assert_array_equal(edges[1], np.arange(1, 10))
+    hist = gct.get_batch_cluster_sizes(
+        [[0, 1, 1, 0, 1, 0, 0, 1, 1, 1],
+         [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], edges)
+    assert_array_equal(hist, [1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0])
+
+
 def test_repeat_cluster_vals():
     assert_array_equal(gct.repeat_cluster_vals({1: 2, 3: 1}), [1, 1, 3])
     assert_array_equal(gct.repeat_cluster_vals({1: 2, 3: 2, 2: 1}),
@@ -171,6 +171,65 @@ def test_dataset_without_chunks():
     ds_loaded = h5load(f.name)
     ok_(ds_loaded.a.custom == ds.a.custom)
 
+@with_tempfile()
+def test_mmap_load(f):
+    from mvpa2.datasets.base import Dataset
+    from mvpa2.mappers.flatten import FlattenMapper
+    from mvpa2.mappers.zscore import ZScoreMapper
+    ds = Dataset(np.random.normal(size=(12, 3, 4)),
+                 sa=dict(chunks=np.repeat(range(3), 4)))
+    h5save(f, ds)
+    # samples stay in the file
+    ds_mm = h5load(f, mmap_mode='r')
+    ok_(isinstance(ds_mm.samples, np.memmap))
+    assert_array_equal(ds_mm.samples, ds.samples)
+    assert_array_equal(ds_mm.sa.chunks, ds.sa.chunks)
+    assert_array_equal(AttrDataset.from_hdf5(f, mmap_mode='r').samples,
+                       ds.samples)
+    # read-only
+    assert_raises(ValueError, ds_mm.samples.__setitem__, 0, 0)
+    # selections only read the samples they need
+    assert_array_equal(ds_mm[[1, 5], :2].samples, ds[[1, 5], :2].samples)
+    # and mappers work in place of the in-memory data
+    fds = FlattenMapper(shape=(3, 4))(ds)
+    fds_mm = FlattenMapper(shape=(3, 4))(ds_mm)
+    ok_(isinstance(fds_mm.samples, np.memmap))
+    assert_array_equal(fds_mm.samples, fds.samples)
+    assert_array_almost_equal(ZScoreMapper(auto_train=True)(fds_mm).samples,
+                              ZScoreMapper(auto_train=True)(fds).samples)
+    # compressed arrays are loaded as usual
+    h5save(f, ds, compression='gzip')
+    ds_c = h5load(f, mmap_mode='r')
+    ok_(not isinstance(ds_c.samples, np.memmap))
+    assert_array_equal(ds_c.samples, ds.samples)
+
+@with_tempfile()
+def test_chunked_partial_load(f):
+    from mvpa2.datasets.base import Dataset
+    ds = Dataset(np.random.normal(size=(12, 10)),
+                 sa=dict(targets=np.arange(12) % 3),
+                 fa=dict(roi=np.arange(10)))
+    # chunk shape is adapted to each array, including scalars and empty ones
+    ds.a['scalar'] = 3
+    ds.a['empty'] = np.array([])
+    h5save(f, ds, chunks=(4, 2), compression='gzip')
+    hdf = h5py.File(f, 'r')
+    assert_equal(hdf['rcargs/items/0'].chunks, (4, 2))
+    hdf.close()
+    assert_datasets_equal(h5load(f), ds)
+    for samples, features in (([5, 1, 1], slice(2, 8)),
+                              (slice(None, None, -3), [9, 0]),
+                              (ds.sa.targets == 1, ds.fa.roi > 6),
+                              ([3], None),
+                              (None, slice(4))):
+        pds = h5load(f, samples=samples, features=features)
+        assert_datasets_equal(
+            pds, ds[samples if samples is not None else slice(None),
+                    features if features is not None else slice(None)])
+    # only datasets can be sliced on loading
+    h5save(f, range(3))
+    assert_raises(ValueError, h5load, f, samples=[0])
+
 def test_recursion():
     obj = range(2)
     obj.append(HDFDemo())
@@ -183,6 +242,47 @@ def test_recursion():
     ok_(obj[3] is obj)
     ok_(lobj[3] is lobj)
 
+def _count_hdf_objects(filename):
+    names = []
+    hdf = h5py.File(filename, 'r')
+    hdf.visit(names.append)
+    hdf.close()
+    return len(names)
+
+@with_tempfile()
+def test_packed_containers(f):
+    arr = np.arange(4)
+    obj = dict(arrays=[np.arange(i) for i in xrange(20)] + [arr.reshape(2, 2)],
+               nbhoods=dict([(i, np.arange(i, i + 3)) for i in xrange(20)]),
+               floats=(1.5, 2., 3.),
+               npfloats=[np.float32(i) for i in xrange(3)],
+               names=dict(a='one', b='two'),
+               # not homogeneous -- stored per item
+               mixed=[1, 'a', arr],
+               # repeated -- references are kept
+               refs=[arr, arr])
+    h5save(f, obj, packed=False)
+    nobjects = _count_hdf_objects(f)
+    h5save(f, obj)
+    ok_(_count_hdf_objects(f) < nobjects / 2)
+    obj_ = h5load(f)
+    assert_equal(sorted(obj_.keys()), sorted(obj.keys()))
+    assert_equal(len(obj_['arrays']), 21)
+    for a, a_ in zip(obj['arrays'], obj_['arrays']):
+        assert_array_equal(a, a_)
+        assert_equal(a.shape, a_.shape)
+        assert_equal(a.dtype, a_.dtype)
+    assert_equal(sorted(obj_['nbhoods'].keys()), range(20))
+    for k, v in obj['nbhoods'].iteritems():
+        assert_array_equal(obj_['nbhoods'][k], v)
+    assert_equal(obj_['floats'], obj['floats'])
+    ok_(isinstance(obj_['floats'], tuple))
+    assert_equal(obj_['npfloats'], obj['npfloats'])
+    assert_equal(obj_['npfloats'][0].dtype, np.float32)
+    assert_equal(obj_['names'], obj['names'])
+    assert_equal(obj_['mixed'][:2], obj['mixed'][:2])
+    ok_(obj_['refs'][0] is obj_['refs'][1])
+
 @with_tempfile()
 def test_h5save_mkdir(dirname):
     # create deeper directory name
@@ -463,7 +563,7 @@ def test_save_load_FlattenMapper(f):
 def test_versions(f):
     h5save(f, [])
     hdf = h5py.File(f, 'r')
-    assert_equal(hdf.attrs.get('__pymvpa_hdf5_version__'), '2')
+    assert_equal(hdf.attrs.get('__pymvpa_hdf5_version__'), '3')
     assert_equal(hdf.attrs.get('__pymvpa_version__'), mvpa2.__version__)
 
 def test_present_fmri_dataset():
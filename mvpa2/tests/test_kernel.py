@@ -141,6 +141,7 @@ class KernelTests(unittest.TestCase):
 
         self.assertTrue(ck._recomputed,
                         'CachedKernel was not initially computed')
+        self.assertTrue(ck.is_cached(d))
 
         # Try some splitting
         for chunk in [d[d.sa.chunks == i] for i in range(nchunks)]:
@@ -149,9 +150,11 @@ class KernelTests(unittest.TestCase):
             self.kernel_equiv(rk, ck) #, accuracy=1e-12)
             self.failIf(ck._recomputed,
                         "CachedKernel incorrectly recomputed it's kernel")
+            self.assertTrue(ck.is_cached(chunk))
 
         # Test what happens when a parameter changes
         ck.params.sigma = 3.5
+        self.failIf(ck.is_cached(d))
         ck.compute(d)
         self.assertTrue(ck._recomputed,
                         "CachedKernel doesn't recompute on kernel change")
@@ -162,6 +165,7 @@ class KernelTests(unittest.TestCase):
 
         # Now test handling new data
         d2 = Dataset(np.random.randn(32, 43))
+        self.failIf(ck.is_cached(d2))
         ck.compute(d2)
         self.assertTrue(ck._recomputed,
                         "CachedKernel did not automatically recompute new data")
@@ -12,6 +12,7 @@ import numpy as np
 
 from mvpa2.testing import *
 from mvpa2.testing.datasets import pure_multivariate_signal
+from mvpa2.datasets.base import Dataset
 
 from mvpa2.clfs.knn import kNN
 from mvpa2.clfs.distance import one_minus_correlation
@@ -63,6 +64,38 @@ class KNNTests(unittest.TestCase):
         self.assertTrue(not (clf.ca.distances.fa['chunks'] is train.sa['chunks']))
         self.assertTrue(not (clf.ca.distances.fa.chunks is train.sa.chunks))
 
+
+    @sweepargs(voting=('majority', 'weighted'))
+    def test_knn_batches(self, voting):
+        train = pure_multivariate_signal(40, 3)
+        test = pure_multivariate_signal(20, 3)
+
+        clf = kNN(k=5, voting=voting)
+        clf.ca.enable(['estimates', 'distances'])
+        clf.train(train)
+        p = clf.predict(test.samples)
+        estimates = clf.ca.estimates
+        dists = clf.ca.distances.samples
+
+        # same results when predicting few test samples at a time
+        clf._batch_nelements = 3 * len(train)
+        assert_equal(clf.predict(test.samples), p)
+        assert_equal(clf.ca.estimates, estimates)
+        assert_array_equal(clf.ca.distances.samples, dists)
+
+        # votes of the k nearest neighbors
+        knns = np.argsort(dists, axis=1)[:, :5]
+        for e, nns in zip(estimates, knns):
+            assert_equal(sum(e.values()) > 0, True)
+            if voting == 'majority':
+                for l in e:
+                    assert_equal(e[l], np.sum(train.targets[nns] == l))
+
+        # ties are broken by the mean distance to the neighbors
+        clf = kNN(k=2, voting='majority')
+        clf.train(Dataset([[0.], [1.5], [3.]], sa={'targets': [0, 1, 2]}))
+        assert_equal(clf.predict([[0.5], [2.5]]), [0, 2])
+
 def suite():  # pragma: no cover
     return unittest.makeSuite(KNNTests)
 
@@ -122,3 +122,20 @@ def test_polydetrend():
     # but if done inplace that is no longer true
     poly_detrend(ds, chunks_attr='chunks', polyord=1, space='time')
     assert_array_equal(ds, mds)
+
+
+def test_polydetrend_blocks():
+    ds = dataset_wizard(np.random.normal(size=(20, 7)) + np.arange(20)[:, None],
+                        chunks=np.repeat([0, 1], 10))
+    dm = PolyDetrendMapper(chunks_attr='chunks', polyord=2)
+    mds = dm.forward(ds)
+    # a few features at a time yields the same
+    dm._batch_nelements = 3 * len(ds)
+    assert_array_almost_equal(dm.forward(ds).samples, mds.samples)
+    # also in-place
+    ds_ = ds.copy()
+    dm = PolyDetrendMapper(chunks_attr='chunks', polyord=2)
+    dm._secret_inplace_detrend = True
+    dm._batch_nelements = 3 * len(ds)
+    dm.forward(ds_)
+    assert_array_almost_equal(ds_.samples, mds.samples)
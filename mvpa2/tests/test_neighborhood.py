@@ -277,6 +277,50 @@ def test_cached_query_engine():
     #ds2.fa.myspace = ds2.fa.myspace*3
     #assert_raises(ValueError, qec.train, ds2)
 
+def test_sparse_query_engine():
+    ds = datasets['3dlarge']
+    for sphere in (ne.Sphere(2), ne.Sphere(1.5, element_sizes=(1, 2, 1)),
+                   ne.HollowSphere(2, 1)):
+        qe = ne.IndexQueryEngine(myspace=sphere)
+        qe.train(ds)
+        sqe = ne.SparseQueryEngine(myspace=sphere)
+        # compute in small chunks of centers
+        sqe._chunk_nelements = 100
+        sqe.train(ds)
+        assert_equal(sqe.ids, qe.ids)
+        for fid in xrange(ds.nfeatures):
+            assert_array_equal(sqe[fid], qe[fid])
+            assert_array_equal(sqe(myspace=ds.fa.myspace[fid]), qe[fid])
+        # neighborhoods get reused on a dataset with the same coordinates
+        indices = sqe.indices
+        sqe.train(ds.copy())
+        ok_(sqe.indices is indices)
+        # but not on some other one
+        ds_ = ds[:, 1:]
+        sqe.train(ds_)
+        ok_(sqe.indices is not indices)
+        assert_equal(len(sqe.indptr), ds_.nfeatures + 1)
+
+    # incidence matrix
+    sqe.train(ds)
+    m = sqe.get_matrix()
+    assert_equal(m.shape, (ds.nfeatures, ds.nfeatures))
+    assert_array_equal(m.getrow(10).indices, sqe[10])
+    m = sqe.get_matrix([3, 1])
+    assert_equal(m.shape, (2, ds.nfeatures))
+    assert_array_equal(m.getrow(0).indices, sqe[3])
+    assert_array_equal(m.getrow(1).indices, sqe[1])
+
+    assert_raises(ValueError, ne.SparseQueryEngine,
+                  myspace=ne.Sphere(1), other=ne.Sphere(1))
+    assert_raises(ValueError, ne.SparseQueryEngine,
+                  myspace=ne.IdentityNeighborhood())
+    ds_ = ds.copy()
+    ds_.fa.myspace[1] = ds_.fa.myspace[0]
+    assert_raises(ValueError, ne.SparseQueryEngine(myspace=ne.Sphere(1)).train,
+                  ds_)
+
+
 def test_scattered_neighborhoods():
     radius = 1
     sphere = ne.Sphere(radius)
@@ -0,0 +1,111 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Unit tests for PyMVPA parallel execution backends"""
+
+import os
+import numpy as np
+
+from mvpa2.testing import *
+from mvpa2.base.parallel import get_executor, iter_results, get_utilization, \
+     SerialExecutor, ThreadExecutor, ForkExecutor
+
+
+def _square(x, offset=0):
+    return x ** 2 + offset
+
+def _fail(x):
+    raise ValueError("failed on %s" % x)
+
+def _getpid(x):
+    return os.getpid()
+
+
+@sweepargs(backend=('serial', 'thread', 'process', 'joblib'))
+def test_executors(backend):
+    if backend == 'joblib':
+        skip_if_no_external('joblib')
+    executor, own = get_executor(backend, 2)
+    ok_(own)
+    try:
+        futures = [executor.submit(_square, i, offset=1) for i in range(5)]
+        assert_equal([f.result() for f in futures], [1, 2, 5, 10, 17])
+        # exceptions are passed back to the caller
+        assert_raises((ValueError, RuntimeError),
+                      executor.submit(_fail, 1).result)
+        # and results could be obtained in order via the generator
+        assert_equal(list(iter_results(executor,
+                                       [(_square, (i,), {}) for i in range(7)])),
+                     [i ** 2 for i in range(7)])
+        pids = set(iter_results(executor,
+                                [(_getpid, (i,), {}) for i in range(3)]))
+        if backend in ('process', 'joblib'):
+            ok_(not os.getpid() in pids)
+        else:
+            assert_equal(pids, set([os.getpid()]))
+    finally:
+        executor.shutdown()
+
+
+def test_get_executor():
+    assert_true(isinstance(get_executor(None, 1)[0], SerialExecutor))
+    executor, own = get_executor(None, 2)
+    ok_(isinstance(executor, (ForkExecutor, ThreadExecutor)))
+    executor.shutdown()
+    # instances are returned as is and are not owned
+    executor = ThreadExecutor(1)
+    assert_equal(get_executor(executor), (executor, False))
+    executor.shutdown()
+    assert_raises(ValueError, get_executor, 'bogus')
+    assert_raises(ValueError, get_executor, object())
+
+
+def test_iter_results_limit():
+    # results should be consumed before more computations get submitted
+    submitted = []
+
+    class _Recorder(SerialExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(args[0])
+            return super(_Recorder, self).submit(fn, *args, **kwargs)
+
+    for i, r in enumerate(iter_results(_Recorder(),
+                                       [(_square, (j,), {}) for j in range(5)],
+                                       limit=2)):
+        assert_equal(r, i ** 2)
+        assert_equal(len(submitted), min(i + 2, 5))
+
+
+def _sleep(x):
+    import time
+    time.sleep(x)
+    return x
+
+
+@sweepargs(backend=('thread', 'process'))
+def test_iter_results_unordered(backend):
+    executor = get_executor(backend, 2)[0]
+    try:
+        calls = [(_sleep, (t,), {}) for t in (0.5, 0.01, 0.02, 0.03)]
+        # short computations get through the idle worker before the long one
+        assert_equal(list(iter_results(executor, calls, ordered=False)),
+                     [0.01, 0.02, 0.03, 0.5])
+        assert_equal(list(iter_results(executor, calls)),
+                     [0.5, 0.01, 0.02, 0.03])
+    finally:
+        executor.shutdown()
+
+
+def test_get_utilization():
+    assert_array_equal(get_utilization([], 2), [0, 0])
+    # two workers busy all the time
+    assert_array_almost_equal(
+        get_utilization([(0, 2), (0, 1), (1, 2)], 2), [1, 1])
+    # the second worker idles half of the time
+    assert_array_almost_equal(
+        get_utilization([(0, 1), (1, 2), (0, 1)], 2), [1, .5])
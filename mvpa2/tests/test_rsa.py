@@ -227,14 +227,75 @@ def test_PDistTargetSimilaritySearchlight():
     sl_both = sphere_searchlight(tdcm1_both)(ds)
     assert_array_equal(sl_both.shape, (2, ds.nfeatures))
     assert_array_equal(sl_both.sa.metrics, ['rho', 'p'])
-    # rho must be exactly the same
-    assert_array_equal(sl_both.samples[0], sl_rho.samples[0])
+    # rho must be the same -- up to precision since sl_rho gets computed
+    # for batches of ROIs at once
+    assert_array_almost_equal(sl_both.samples[0], sl_rho.samples[0])
     # just because we are here and we can
     # Actually here for some reason assert_array_lequal gave me a trouble
     assert_true(np.all(sl_both.samples[1] <= 1.0))
     assert_true(np.all(0 <= sl_both.samples[1]))
 
 
+@sweepargs(metric=('correlation', 'cosine', 'euclidean', 'sqeuclidean'))
+def test_PDist_batched(metric):
+    ds = dataset_wizard(samples=data, targets=np.tile(xrange(3), 2))
+    # ROIs of different sizes padded with -1
+    roi_fids = np.array([[0, 1, 2, -1], [4, 3, 2, 1], [1, -1, -1, -1]])
+    rois = [[0, 1, 2], [4, 3, 2, 1], [1]]
+    tdsm = np.arange(15)
+    for m in (PDist(pairwise_metric=metric),
+              PDist(pairwise_metric=metric, center_data=True, square=True),
+              PDistTargetSimilarity(tdsm, pairwise_metric=metric),
+              PDistTargetSimilarity(tdsm, pairwise_metric=metric,
+                                    comparison_metric='spearman',
+                                    corrcoef_only=True)):
+        ok_(m.is_batchable)
+        results = m._call_batch(ds, roi_fids)
+        assert_equal(len(results), len(rois))
+        for roi, res in zip(rois, results):
+            res_ = m(ds[:, roi])
+            if metric == 'correlation' and len(roi) == 1:
+                # undefined for a single feature
+                continue
+            assert_array_almost_equal(res.samples, res_.samples)
+            assert_equal(res.sa.keys(), res_.sa.keys())
+            assert_equal(res.fa.keys(), res_.fa.keys())
+    if metric == 'correlation':
+        # correlations of two features are exactly +-1 as with pdist
+        pairs = np.array([[2.27, -1.45], [.05, -.19], [1.53, 1.47],
+                          [.15, .38]])
+        assert_array_equal(
+            PDist(pairwise_metric=metric)._call_batch(
+                Dataset(pairs), np.array([[0, 1]]))[0].samples[:, 0],
+            pdist(pairs, metric))
+    # not supported metrics and post-processing disable batching
+    assert_false(PDist(pairwise_metric='cityblock').is_batchable)
+    assert_false(PDist(postproc=mean_sample()).is_batchable)
+
+
+def test_PDist_batched_searchlight():
+    from mvpa2.measures.searchlight import sphere_searchlight
+    ds = datasets['3dsmall'][:, :13]
+    ds.fa['voxel_indices'] = ds.fa.myspace
+    ds = mean_group_sample(['chunks'])(ds)
+    tdsm = np.arange(6)
+    m = PDistTargetSimilarity(tdsm, corrcoef_only=True)
+    sl = sphere_searchlight(m, radius=1)
+    sl.ca.enable(['roi_sizes', 'roi_feature_ids'])
+    res = sl(ds)
+    # per-ROI computation is used with center feature attribute added
+    sl_ = sphere_searchlight(m, radius=1, add_center_fa=True)
+    sl_.ca.enable(['roi_sizes', 'roi_feature_ids'])
+    res_ = sl_(ds)
+    assert_array_almost_equal(res.samples, res_.samples)
+    assert_array_equal(res.fa.center_ids, res_.fa.center_ids)
+    assert_equal(sl.ca.roi_sizes, sl_.ca.roi_sizes)
+    assert_equal(sl.ca.roi_feature_ids, sl_.ca.roi_feature_ids)
+    # and results stay the same if ROIs get split into many small batches
+    sl._batch_nelements = 20
+    assert_array_almost_equal(sl(ds).samples, res.samples)
+
+
 def test_Regression():
     skip_if_no_external('skl')
     # a very correlated dataset
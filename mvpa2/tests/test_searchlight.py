@@ -34,7 +34,8 @@ from mvpa2.measures.nnsearchlight import sphere_m1nnsearchlight, \
      M1NNSearchlight
 from mvpa2.clfs.knn import kNN
 
-from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere, HollowSphere, CachedQueryEngine
+from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere, HollowSphere, CachedQueryEngine, \
+     SparseQueryEngine
 from mvpa2.misc.errorfx import corr_error, mean_match_accuracy
 from mvpa2.generators.partition import NFoldPartitioner, OddEvenPartitioner, CustomPartitioner
 from mvpa2.generators.splitters import Splitter
@@ -198,7 +199,7 @@ class SearchlightTests(unittest.TestCase):
                 # for correlation distance we need to use "fancy" way
 
         # Test nproc just once
-        if externals.exists('pprocess') and not self._tested_pprocess:
+        if not self._tested_pprocess:
             sls += [sphere_searchlight(cv, nproc=2, **skwargs)]
             self._tested_pprocess = True
 
@@ -654,7 +655,6 @@ class SearchlightTests(unittest.TestCase):
 
 
     def test_nblocks(self):
-        skip_if_no_external('pprocess')
         # just a basic test to see that we are getting the same
         # results with different nblocks
         ds = datasets['3dsmall'].copy(deep=True)[:, :13]
@@ -665,6 +665,170 @@ class SearchlightTests(unittest.TestCase):
         assert_array_equal(res1, res2)
 
 
+    @sweepargs(executor=('serial', 'thread', 'process'))
+    def test_executors(self, executor):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        res1 = sphere_searchlight(cv, radius=1, nproc=1)(ds)
+        sl = sphere_searchlight(cv, radius=1, nproc=2, nblocks=3,
+                                executor=executor)
+        sl.ca.enable('roi_sizes')
+        res2 = sl(ds)
+        assert_array_equal(res1, res2)
+        assert_array_equal(res1.fa.center_ids, res2.fa.center_ids)
+        assert_equal(len(sl.ca.roi_sizes), ds.nfeatures)
+        # executor instances are used as is
+        from mvpa2.base.parallel import ThreadExecutor
+        executor = ThreadExecutor(2)
+        try:
+            res3 = sphere_searchlight(cv, radius=1, executor=executor)(ds)
+        finally:
+            executor.shutdown()
+        assert_array_equal(res1, res3)
+        assert_raises(ValueError, sphere_searchlight, cv, executor='bogus')
+
+    @sweepargs(executor=('serial', 'thread', 'process'))
+    def test_dynamic_schedule(self, executor):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        sl_static = sphere_searchlight(cv, radius=1, nproc=1)
+        sl_static.ca.enable(['roi_sizes', 'roi_feature_ids'])
+        res1 = sl_static(ds)
+        for nblocks in (None, 4):
+            sl = sphere_searchlight(cv, radius=1, nproc=2, nblocks=nblocks,
+                                    executor=executor, schedule='dynamic')
+            sl.ca.enable(['roi_sizes', 'roi_feature_ids',
+                          'worker_utilization'])
+            res2 = sl(ds)
+            # results come in the original order regardless of the schedule
+            assert_array_equal(res1, res2)
+            assert_array_equal(res1.fa.center_ids, res2.fa.center_ids)
+            assert_equal(sl.ca.roi_sizes, sl_static.ca.roi_sizes)
+            assert_equal(sl.ca.roi_feature_ids, sl_static.ca.roi_feature_ids)
+            assert_equal(len(sl.ca.worker_utilization), 2)
+            ok_(np.all(sl.ca.worker_utilization >= 0))
+            ok_(np.all(sl.ca.worker_utilization <= 1))
+        # sizes of ROIs are unknown without querying them, so they keep
+        # their order while blocks get smaller
+        sl = sphere_searchlight(cv, radius=1, nproc=2, schedule='dynamic')
+        blocks = sl._get_cost_ordered_blocks(ds, range(ds.nfeatures), 2)
+        assert_equal(list(np.hstack(blocks)), range(ds.nfeatures))
+        assert_equal([len(b) for b in blocks],
+                     sorted([len(b) for b in blocks], reverse=True))
+        ok_(len(blocks[0]) > len(blocks[-1]))
+        # but precomputed neighborhoods tell their sizes, so the largest
+        # ROIs come first
+        sl = Searchlight(cv, SparseQueryEngine(voxel_indices=Sphere(1)),
+                         nproc=2, nblocks=4, executor=executor,
+                         schedule='dynamic')
+        assert_array_equal(sl(ds), res1)
+        blocks = sl._get_cost_ordered_blocks(ds, range(ds.nfeatures), 2)
+        assert_equal(sorted(np.hstack(blocks)), range(ds.nfeatures))
+        sizes = [len(sl.queryengine[r]) for r in np.hstack(blocks)]
+        assert_equal(sizes, sorted(sizes, reverse=True))
+        ok_(len(blocks[0]) <= len(blocks[-2]))
+        assert_raises(ValueError, sphere_searchlight, cv, schedule='bogus')
+
+    @sweepargs(executor=(None, 'serial', 'thread', 'process'))
+    def test_shm_results_backend(self, executor):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        sl_native = sphere_searchlight(cv, radius=1, nproc=1)
+        sl_native.ca.enable(['roi_sizes', 'roi_feature_ids'])
+        res1 = sl_native(ds)
+        sl = sphere_searchlight(cv, radius=1, nproc=2, nblocks=3,
+                                executor=executor, results_backend='shm')
+        sl.ca.enable(['roi_sizes', 'roi_feature_ids'])
+        res2 = sl(ds)
+        assert_array_equal(res1, res2)
+        assert_array_equal(res1.fa.center_ids, res2.fa.center_ids)
+        assert_equal(res1.sa.keys(), res2.sa.keys())
+        assert_equal(sl.ca.roi_sizes, sl_native.ca.roi_sizes)
+        assert_equal(sl.ca.roi_feature_ids, sl_native.ca.roi_feature_ids)
+        assert_array_equal(sl.ca.roi_center_ids, sl_native.ca.roi_center_ids)
+        # no junk is left behind in shared memory
+        assert_false(any(os.path.basename(f).startswith('tmpsl')
+                         for f in glob.glob('/dev/shm/*')))
+        # only a single feature per ROI is supported
+        assert_raises(ValueError,
+                      sphere_searchlight(lambda x: np.ones((2, 2)),
+                                         results_backend='shm'), ds)
+        assert_raises(ValueError, sphere_searchlight, cv,
+                      results_backend='shm', results_fx=lambda **kw: None)
+        # integer result of the first ROI does not truncate the others
+        calls = []
+        def mixed(x):
+            calls.append(x.nfeatures)
+            return np.array([x.nfeatures if len(calls) == 1
+                             else x.nfeatures + .5])
+        res = sphere_searchlight(mixed, radius=1, results_backend='shm',
+                                 center_ids=[0, 1, 2])(ds)
+        sizes = [len(sl.queryengine[r]) for r in (0, 1, 2)]
+        assert_array_equal(res.samples[0], np.array(sizes) + [0, .5, .5])
+        # and nothing is computed for no ROIs
+        sl._queryengine.train(ds)
+        assert_equal(sl._sl_call_shm(ds, [], 2).nfeatures, 0)
+
+    def test_checkpointing(self):
+        skip_if_no_external('h5py')
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        computed = []
+        class CrashingMeasure(object):
+            crash_on = None
+            def __call__(self, roi):
+                center = roi.fa.center[roi.fa.roi_seed][0]
+                if center == self.crash_on:
+                    raise RuntimeError("crash")
+                computed.append(center)
+                return np.array([roi.samples.mean()])
+
+        ds.fa['center'] = np.arange(ds.nfeatures)
+        measure = CrashingMeasure()
+        res_ref = sphere_searchlight(measure, radius=1, add_center_fa=True)(ds)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # crash in the middle of the computation
+            measure.crash_on = 9
+            computed[:] = []
+            sl = sphere_searchlight(measure, radius=1, add_center_fa=True,
+                                    nproc=1, nblocks=4, checkpoint_dir=tmpdir)
+            assert_raises(RuntimeError, sl, ds)
+            assert_equal(computed, range(9))
+            # first two blocks got stored
+            assert_equal(len(glob.glob(os.path.join(tmpdir, 'block-*.hdf5'))),
+                         2)
+            # resume -- only the rest gets computed
+            measure.crash_on = None
+            computed[:] = []
+            res = sl(ds)
+            assert_equal(computed, range(7, 13))
+            assert_array_equal(res, res_ref)
+            assert_array_equal(res.fa.center_ids, res_ref.fa.center_ids)
+            assert_array_equal(sl.ca.roi_center_ids, range(ds.nfeatures))
+            # independent runs on parts are merged in the full one
+            shutil.rmtree(tmpdir)
+            for center_ids in (range(0, 5), range(5, 13)):
+                sphere_searchlight(measure, radius=1, add_center_fa=True,
+                                   center_ids=center_ids,
+                                   checkpoint_dir=tmpdir)(ds)
+            computed[:] = []
+            res = sphere_searchlight(measure, radius=1, add_center_fa=True,
+                                     checkpoint_dir=tmpdir)(ds)
+            assert_equal(computed, [])
+            assert_array_equal(res, res_ref)
+            # checkpoints must match the dataset
+            assert_raises(ValueError,
+                          sphere_searchlight(measure, radius=1,
+                                             add_center_fa=True,
+                                             checkpoint_dir=tmpdir),
+                          ds[:, :12])
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
     def test_custom_results_fx_logic(self):
         # results_fx was introduced for the blow-up-the-memory-Swaroop
         # where keeping all intermediate results of the dark-magic SL
@@ -680,7 +844,6 @@ class SearchlightTests(unittest.TestCase):
         # handled by the results_fx function and removed in this case
         # to check if we indeed have desired high number of blocks while
         # only limited nproc.
-        skip_if_no_external('pprocess')
 
         tfile = tempfile.mktemp('mvpa', 'test-sl')
 
@@ -806,6 +969,24 @@ class SearchlightTests(unittest.TestCase):
         res = gnb_sl(ds1)
         assert_false(cached_qe.ids is None)
 
+    @sweepargs(indexsum=('sparse', 'fancy'))
+    def test_sparse_qe_gnbsearchlight(self, indexsum):
+        ds1 = datasets['3dsmall'].copy(deep=True)
+        gnb_sl = GNBSearchlight(GNB(), NFoldPartitioner(),
+                                qe=IndexQueryEngine(myspace=Sphere(2)),
+                                indexsum=indexsum)
+        sqe = SparseQueryEngine(myspace=Sphere(2))
+        gnb_sl_sparse = GNBSearchlight(GNB(), NFoldPartitioner(), qe=sqe,
+                                       indexsum=indexsum)
+        gnb_sl.ca.enable(['roi_sizes'])
+        gnb_sl_sparse.ca.enable(['roi_sizes'])
+        assert_array_equal(gnb_sl(ds1), gnb_sl_sparse(ds1))
+        assert_equal(list(gnb_sl.ca.roi_sizes),
+                     list(gnb_sl_sparse.ca.roi_sizes))
+        # and generic searchlight would simply query it
+        sl = Searchlight(CrossValidation(GNB(), NFoldPartitioner()), sqe)
+        assert_array_almost_equal(sl(ds1), gnb_sl_sparse(ds1))
+
     def test_gnbsearchlight_3partitions_and_splitter(self):
         ds = self.dataset[:, :20]
         # custom partitioner which provides 3 partitions
@@ -11,9 +11,11 @@
 from mvpa2.testing import *
 from mvpa2.testing.datasets import datasets
 
+import mvpa2
 from mvpa2 import cfg
 from mvpa2.base import externals
-from mvpa2.clfs.stats import MCNullDist, FixedNullDist, NullDist
+from mvpa2.clfs.stats import MCNullDist, FixedNullDist, NullDist, \
+     SequentialMCNullDist, Nonparametric, NonparametricArray
 from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.datasets import Dataset
 from mvpa2.measures.anova import OneWayAnova, CompoundOneWayAnova
@@ -79,6 +81,154 @@ class StatsTests(unittest.TestCase):
             self.assertRaises(ValueError, null.p, [5, 3, 4])
 
 
+    @sweepargs(executor=('thread', 'process'))
+    def test_mcnulldist_parallel(self, executor):
+        ds = datasets['uni2small']
+        dist_samples = []
+        for executor_ in ('serial', executor):
+            null = MCNullDist(permutator, tail='right', nproc=2,
+                              executor=executor_, enable_ca=['dist_samples'])
+            mvpa2.seed(1)
+            null.fit(OneWayAnova(), ds)
+            dist_samples.append(null.ca.dist_samples.samples)
+            assert_equal(dist_samples[-1].shape, (1, ds.nfeatures, 30))
+            assert_equal(len(null.dists()), ds.nfeatures)
+        # permutations and seeds come from the main process, so the results
+        # do not depend on the backend
+        assert_array_equal(dist_samples[0], dist_samples[1])
+        # and match what was computed for each element
+        assert_array_equal(sorted(null.dists()[0]._dist_samples),
+                           sorted(dist_samples[1][0, 0]))
+
+    def test_mcnulldist_seeded(self):
+        from mvpa2.measures.base import Measure
+        class RandomMeasure(Measure):
+            is_trained = True
+            def _call(self, ds):
+                return Dataset([[np.random.uniform()]])
+        ds = datasets['uni2small']
+        dist_samples = []
+        for executor in ('serial', 'process', None):
+            null = MCNullDist(permutator, tail='right', nproc=2,
+                              executor=executor, enable_ca=['dist_samples'])
+            if executor is None:
+                null.nproc = 1
+            mvpa2.seed(1)
+            null.fit(RandomMeasure(), ds)
+            dist_samples.append(null.ca.dist_samples.samples)
+            # RNG is reseeded for each permutation
+            assert_equal(len(np.unique(dist_samples[-1])), 30)
+        # but the same way regardless of the executor
+        assert_array_equal(dist_samples[0], dist_samples[1])
+        assert_array_equal(dist_samples[0], dist_samples[2])
+
+    def test_mcnulldist_dtype(self):
+        from mvpa2.measures.base import Measure
+        class MixedMeasure(Measure):
+            is_trained = True
+            ncalls = 0
+            def _call(self, ds):
+                MixedMeasure.ncalls += 1
+                if MixedMeasure.ncalls == 1:
+                    return Dataset([[1]])
+                return Dataset([[MixedMeasure.ncalls + 0.5]])
+        null = MCNullDist(AttributePermutator('targets', count=3),
+                          tail='right', enable_ca=['dist_samples'])
+        null.fit(MixedMeasure(), datasets['uni2small'])
+        # later floating point values were not truncated
+        assert_array_equal(null.ca.dist_samples.samples[0, 0],
+                           [1, 2.5, 3.5])
+
+    def test_mcnulldist_skipped(self):
+        from mvpa2.base.learner import LearnerError
+        from mvpa2.measures.base import Measure
+        class FailingMeasure(Measure):
+            is_trained = True
+            ncalls = 0
+            def _call(self, ds):
+                FailingMeasure.ncalls += 1
+                if FailingMeasure.ncalls % 3 == 0:
+                    raise LearnerError("failed")
+                return Dataset([[float(FailingMeasure.ncalls)]])
+        ds = datasets['uni2small']
+        null = MCNullDist(permutator, tail='right',
+                          enable_ca=['dist_samples'])
+        null.fit(FailingMeasure(), ds)
+        assert_equal(null.ca.skipped, 10)
+        assert_equal(null.ca.dist_samples.shape, (1, 1, 20))
+
+    def test_sequential_mcnulldist(self):
+        ds = datasets['uni2small']
+        nonbogus = ds.a.nonbogus_features
+        computed = []
+        class RecordingAnova(OneWayAnova):
+            def _call(self, ds):
+                computed.append(ds.nfeatures)
+                return super(RecordingAnova, self)._call(ds)
+        null = SequentialMCNullDist(AttributePermutator('targets', count=100),
+                                    nexceedances=5, step=5, tail='right',
+                                    enable_ca=['npermutations',
+                                               'dist_samples'])
+        mvpa2.seed(1)
+        null.fit(RecordingAnova(), ds)
+        observed = OneWayAnova()(ds)
+        nperms = null.ca.npermutations
+        assert_equal(nperms.shape, (1, ds.nfeatures))
+        # informative features were permuted all the way
+        assert_array_equal(nperms[0, nonbogus], 100)
+        # and bogus ones got settled early
+        stopped = nperms[0] < 100
+        ok_(np.any(stopped))
+        # permutations are done in rounds
+        assert_array_equal(nperms % 5, 0)
+        # so less computation was done, but all of it was used (+1 for the
+        # observed value)
+        assert_equal(sum(computed), nperms.sum() + ds.nfeatures)
+        # p-value of stopped ones is the fraction of exceedances (clipped
+        # by Nonparametric)
+        p = null.p(observed).samples[0]
+        n = nperms[0, stopped]
+        nexceeded = np.sum(null.ca.dist_samples.samples[0, stopped]
+                           >= observed.samples[0, stopped][:, None], axis=1)
+        # at least 5 but not more than the last round could add
+        ok_(np.all(nexceeded >= 5))
+        ok_(np.all(nexceeded < 10))
+        assert_array_almost_equal(
+            p[stopped],
+            np.clip(nexceeded / n.astype(float), 1. / (n + 2),
+                    (n + 1.) / (n + 2)))
+        ok_(np.all(p[nonbogus] < 0.05))
+        # only done permutations are stored
+        ok_(np.all(np.isnan(null.ca.dist_samples.samples[0, stopped, -1])))
+
+    @sweepargs(correction=('clip', None))
+    def test_nonparametric_array(self, correction):
+        samples = np.random.normal(size=(20, 30))
+        # some ties
+        samples[:, :5] = samples[:, 5:10]
+        samples[2, 3] = np.nan
+        x = np.hstack((np.random.normal(size=10), samples[10:, 7]))
+        dist = NonparametricArray(samples, correction=correction)
+        assert_equal(len(dist), 20)
+        for fx in ('cdf', 'rcdf'):
+            assert_array_almost_equal(
+                getattr(dist, fx)(x),
+                [getattr(Nonparametric(s, correction=correction), fx)(v)
+                 for s, v in zip(samples, x)])
+        # samples were not touched
+        ok_(np.isnan(samples[2, 3]))
+        # individual distributions are available
+        assert_array_equal(dist[1]._dist_samples, np.sort(samples[1]))
+        # varying number of samples
+        nsamples = np.arange(1, 21)
+        dist = NonparametricArray(samples, nsamples=nsamples,
+                                  correction=correction)
+        assert_array_almost_equal(
+            dist.rcdf(x),
+            [Nonparametric(s[:n], correction=correction).rcdf(v)
+             for s, n, v in zip(samples, nsamples, x)])
+        assert_raises(ValueError, dist.cdf, x[:3])
+
     def test_anova(self):
         """Do some extended testing of OneWayAnova
 
@@ -119,7 +119,7 @@ class SurfTests(unittest.TestCase):
             assert_true(low2high[k] == v)
 
         # ensure that slow implementation gives same results as fast one
-        low2high_slow = s.map_to_high_resolution_surf(h, .1)
+        low2high_slow = s.map_to_high_resolution_surf_slow(h, .1)
         for k, v in low2high.iteritems():
             assert_true(low2high_slow[k] == v)
 
@@ -127,6 +127,23 @@ class SurfTests(unittest.TestCase):
         assert_raises(ValueError,
                       lambda x:x.map_to_high_resolution_surf(h, .01), s)
 
+        # nearest nodes as found by brute force
+        coords = np.vstack((h.vertices[::7] * 1.1, [[np.nan, 0, 0]]))
+        idxs, ds = s.nearest_nodes(coords)
+        for i, coord in enumerate(coords[:-1]):
+            d = np.sum((s.vertices - coord) ** 2, 1) ** .5
+            assert_equal(idxs[i], np.argmin(d))
+            assert_almost_equal(ds[i], np.min(d))
+        assert_equal(idxs[-1], -1)
+        assert_equal(ds[-1], np.inf)
+        assert_array_equal(s.nearest_node_index(coords), idxs)
+
+        node_mask = np.arange(0, s.nvertices, 3)
+        idxs_mask = s.nearest_node_index(coords[:-1], node_mask)
+        for i, coord in enumerate(coords[:-1]):
+            d = np.sum((s.vertices[node_mask] - coord) ** 2, 1)
+            assert_equal(idxs_mask[i], node_mask[np.argmin(d)])
+
         n2f = s.node2faces
         for i in xrange(s.nvertices):
             nf = [10] if i < 2 else [5, 6]  # number of faces expected
@@ -143,6 +160,26 @@ class SurfTests(unittest.TestCase):
         for k, v in some_ds.iteritems():
             assert_true(abs(v - ds2[k]) < eps)
 
+        # batched distances should match those for single nodes
+        if externals.exists('scipy'):
+            adj = s.adjacency_matrix
+            for i, j, k in n_check:
+                assert_true(abs(adj[i, j] - k) < .0001)
+                assert_equal(adj[i, j], adj[j, i])
+
+            srcs = [2, 40, 2, 100]
+            for radius in (None, .5, 2.):
+                n2d = s.dijkstra_distance_matrix(srcs, radius)
+                assert_equal(n2d.shape, (len(srcs), s.nvertices))
+                for i, src in enumerate(srcs):
+                    ds = s.dijkstra_distance(src, radius)
+                    row = n2d[i]
+                    assert_equal(sorted(ds), list(row.indices))
+                    assert_array_almost_equal([ds[j] for j in row.indices],
+                                              row.data)
+            assert_raises(ValueError, s.dijkstra_distance_matrix,
+                          [s.nvertices])
+
         # test I/O (through ascii files)
         surf.write(temp_fn, s, overwrite=True)
         s2 = surf.read(temp_fn)
@@ -855,6 +892,31 @@ class SurfTests(unittest.TestCase):
             else:
                 assert_equal(sel0, sel)
 
+    def test_voxel_selection_executors(self):
+        vg = volgeom.VolGeom((10, 10, 10), np.identity(4))
+        outer = surf.generate_sphere(10) * 4. + 5
+        inner = surf.generate_sphere(10) * 2. + 5
+
+        for radius in (3., 20):
+            sel0 = surf_voxel_selection.run_voxel_selection(radius, vg,
+                                            inner, outer, nproc=1)
+            assert_true(len(sel0.keys()) > 0)
+
+            for executor, nproc in (('serial', 1), ('thread', 3),
+                                    ('process', 2), (None, 4)):
+                if executor == 'process' and not hasattr(os, 'fork'):
+                    continue
+                sel = surf_voxel_selection.run_voxel_selection(radius, vg,
+                                            inner, outer, nproc=nproc,
+                                            executor=executor)
+                assert_equal(sel0, sel)
+                assert_equal(sel0.aux_keys(), sel.aux_keys())
+                for k in sel0.keys():
+                    assert_array_equal(sel0[k], sel[k])
+                    for label in sel0.aux_keys():
+                        assert_array_equal(sel0.get_aux(k, label),
+                                           sel.get_aux(k, label))
+
     def test_agreement_surface_volume(self):
         '''test agreement between volume-based and surface-based
         searchlights when using euclidean measure'''
@@ -1044,6 +1106,54 @@ class SurfTests(unittest.TestCase):
                     fa_indices += np.where(ds3.fa.node_indices == node)[0].tolist()
                 assert_equal(set(feature_ids), set(fa_indices))
 
+    @with_tempfile('', '_nbhoods')
+    def test_surf_queryengine_precompute(self, cache_dir):
+        s = surf.generate_plane((0, 0, 0), (0, 1, 0), (0, 0, 1), 4, 5)
+        s2 = surf.merge(s, (s + (.01, 0, 0)))
+        ds = Dataset(samples=np.arange(20)[np.newaxis],
+                     fa=dict(node_indices=np.arange(39, 0, -2)))
+        ds3 = hstack((ds, ds, ds))
+
+        for distance_metric in ('euclidean', 'dijkstra'):
+            for cls, kwargs in ((queryengine.SurfaceQueryEngine, {}),
+                                (queryengine.SurfaceRingQueryEngine,
+                                 dict(inner_radius=1., include_center=True))):
+                builder = lambda **kw: cls(surface=s2, radius=2.5,
+                                           distance_metric=distance_metric,
+                                           **dict(kwargs, **kw))
+                qe = builder()
+                qe.train(ds3)
+
+                # first run computes and stores the neighborhoods,
+                # second run reads them
+                for _ in xrange(2):
+                    qe_pre = builder(cache_dir=cache_dir)
+                    qe_pre.train(ds3)
+                    assert_equal(len(os.listdir(cache_dir)), 1)
+                    for node in xrange(s2.nvertices):
+                        assert_equal(sorted(qe.query_byid(node)),
+                                     sorted(qe_pre.query_byid(node)))
+                    assert_raises(KeyError, qe_pre.query_byid, s2.nvertices)
+
+                # neighborhoods do not depend on the dataset
+                qe_pre = builder(precompute=True)
+                qe_pre.train(ds)
+                for node in xrange(s2.nvertices):
+                    assert_equal(sorted(qe_pre.query_byid(node)),
+                                 [i for i in sorted(qe.query_byid(node))
+                                  if i < 20])
+
+            # different surfaces get different files
+            os.remove(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+            for surface in (s2, s2 + (0, 0, 1)):
+                qe_pre = queryengine.SurfaceQueryEngine(
+                                    surface, 2.5, distance_metric,
+                                    cache_dir=cache_dir)
+                qe_pre.train(ds3)
+            assert_equal(len(os.listdir(cache_dir)), 2)
+            for fn in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, fn))
+
     def test_surf_pairs(self):
         o, x, y = map(np.asarray, [(0, 0, 0), (0, 1, 0), (1, 0, 0)])
         d = np.asarray((0, 0, .1))
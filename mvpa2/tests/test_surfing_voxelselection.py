@@ -635,12 +635,9 @@ class SurfVoxelSelectionTests(unittest.TestCase):
                     assert_equal(type(ix), np.ndarray)
             h5save(fn, qe)
 
+            # masks stored in either way can be loaded in either way
             qe_copy = h5load(fn)
 
-            if setstate_use_legacy and not reduce_use_legacy:
-                assert_raises(AttributeError, lambda: qe_copy.ids)
-                continue
-
             # ensure keys are the same
             assert_equal(qe.ids, qe_copy.ids)
 
@@ -829,26 +826,137 @@ class SurfVoxelSelectionTests(unittest.TestCase):
         vg = VolGeom((2, 2, 2), np.zeros((4, 4)))
 
         d = VolumeMaskDictionary(vg, None)
-        d.add(0, [3, 4], dict(foo=np.asarray([1.1, 2])))
-        d.add(1, [5, 6], dict(foo=np.asarray([1.3, 2])))
+        d.add(0, [3, 4], dict(foo=np.asarray([1.1, 2], dtype=np.float32)))
+        d.add(1, [5, 6], dict(foo=np.asarray([1.3, 2], dtype=np.float64)))
 
-        # set the values to different varieties of float
-        d._src2aux['foo'][0] = d._src2aux['foo'][0].astype(np.float32)
-        d._src2aux['foo'][1] = d._src2aux['foo'][1].astype(np.float64)
+        # values are stored with the datatype of the first mask
+        assert_array_almost_equal(d.get_aux(1, 'foo'), [1.3, 2.])
+        assert_equal(d.__getstate__()[4]['foo'][2].dtype, np.float32)
 
         # float elements must be converted properly
-        at = _dict_with_arrays2array_tuple(d._src2aux)
+        src2aux = dict(foo={0: np.asarray([1.1, 2], dtype=np.float32),
+                            1: np.asarray([1.3, 2], dtype=np.float64)})
+        at = _dict_with_arrays2array_tuple(src2aux)
         at_expected = dict(foo=(np.asarray([0, 1]),
                                 np.asarray([2, 2]),
                                 np.asarray([1.1, 2., 1.3, 2.])))
         for i, (at_elem, at_expected_elem) in enumerate(zip(at['foo'], at_expected['foo'])):
             assert_array_almost_equal(at_elem, at_expected_elem)
 
-        # set auxilary attribute so that _src2aux has no common
+        # set auxilary attribute so that src2aux has no common
         # datatype; this should raise an error
-        d._src2aux['foo'][1] = np.asarray('bar')
-        assert_raises(TypeError, _dict_with_arrays2array_tuple, d._src2aux)
+        src2aux['foo'][1] = np.asarray('bar')
+        assert_raises(TypeError, _dict_with_arrays2array_tuple, src2aux)
+        assert_raises(TypeError, VolumeMaskDictionary, vg, None,
+                      src2nbr={0: [3, 4], 1: [5]}, src2aux=src2aux)
+
+    def test_volume_mask_dictionary_arrays(self):
+        vg = VolGeom((3, 4, 5), np.identity(4))
+        srcs = [4, 1, 7, 3]
+        nbrs = [[0, 5, 9], [5], [], [59, 0, 5, 1]]
+        dists = [[.5, 1., 2.], [0.], [], [3., .5, 1., 2.]]
 
+        d = VolumeMaskDictionary(vg, None)
+        for src, nbr, dist in zip(srcs, nbrs, dists):
+            d.add(src, nbr, dict(dist=dist, center=[src]))
+
+        # same masks when added at once
+        counts = map(len, nbrs)
+        offsets = np.cumsum([0] + counts)
+        d_arr = VolumeMaskDictionary(vg, None)
+        d_arr.add_arrays(srcs, offsets, sum(nbrs, []),
+                         dict(dist=sum(dists, []),
+                              center=np.repeat(srcs, counts)))
+        assert_equal(d, d_arr)
+        assert_equal(d_arr.keys(), sorted(srcs))
+
+        for src, nbr, dist in zip(srcs, nbrs, dists):
+            assert_equal(d[src], nbr)
+            assert_equal(d.get_aux(src, 'dist'), dist)
+            # single values are used for all voxels
+            assert_equal(d.get_aux(src, 'center'), [src] * len(nbr))
+
+        assert_equal(d.get_targets(), [0, 1, 5, 9, 59])
+        assert_equal(d.target2sources(5), set([4, 1, 3]))
+        assert_equal(d.target2sources([9, 2]), [set([4]), None])
+
+        mask = d.get_mask([1, 7, 3])
+        assert_array_equal(np.nonzero(mask.ravel())[0], [0, 1, 5, 59])
+        assert_equal(d.get_voxel_indices([1]), [(0, 1, 0)])
+        assert_raises(KeyError, d.get_mask, [2])
+
+        # masks can only be added with matching auxiliary information
+        assert_raises(ValueError, d.add, 1, [2], dict(dist=[1.], center=[1]))
+        assert_raises(ValueError, d.add, 2, [2])
+        assert_raises(ValueError, d.add, 2, [2, 3],
+                      dict(dist=[1., 2., 3.], center=[2]))
+        assert_raises(ValueError, d_arr.add_arrays, [5, 6], [0, 2, 1], [1, 2])
+        assert_raises(ValueError, d_arr.add_arrays, [5, 5], [0, 1, 2], [1, 2],
+                      dict(dist=[1., 2.], center=[5, 5]))
+
+        # adding after querying
+        d.add(2, [2, 3], dict(dist=[2., 3.], center=[2]))
+        assert_equal(d.target2sources(2), set([2]))
+        assert_equal(len(d), 5)
+
+        # merging
+        d_merged = VolumeMaskDictionary(vg, None)
+        d_other = VolumeMaskDictionary(vg, None)
+        d_merged.add_arrays(srcs[:2], offsets[:3], sum(nbrs[:2], []),
+                            dict(dist=sum(dists[:2], []),
+                                 center=np.repeat(srcs[:2], counts[:2])))
+        d_other.add_arrays(srcs[2:], offsets[2:] - offsets[2],
+                           sum(nbrs[2:], []),
+                           dict(dist=sum(dists[2:], []),
+                                center=np.repeat(srcs[2:], counts[2:])))
+        d_merged.merge(d_other)
+        assert_equal(d_merged, d_arr)
+        assert_false(d_merged == d)
+
+        # state is stored as a few arrays
+        keys, lengths, data = d_arr.__getstate__()[3]
+        assert_array_equal(keys, srcs)
+        assert_array_equal(lengths, counts)
+        assert_array_equal(data, sum(nbrs, []))
+
+        # both current and dict-based states can be restored
+        for state in (d_arr.__getstate__(), d_arr._getstate()):
+            d_copy = VolumeMaskDictionary(vg, None)
+            d_copy.__setstate__(state)
+            assert_equal(d_copy, d_arr)
+            assert_equal(d_copy.get_aux(3, 'dist'), dists[3])
+
+        # states with single auxiliary values per mask (as stored before)
+        src2aux = dict(dist=dict(zip(srcs, map(np.asarray, dists))),
+                       center=dict((src, np.asarray([src])) for src in srcs))
+        d_copy = VolumeMaskDictionary(vg, None,
+                                      src2nbr=dict(zip(srcs, nbrs)),
+                                      src2aux=src2aux)
+        assert_equal(d_copy, d_arr)
+
+        # nearest voxels and centers, with centers at voxel coordinates
+        d_xyz = VolumeMaskDictionary(vg, vg.lin2xyz(np.arange(vg.nvoxels)))
+        d_xyz.add_arrays(srcs, offsets, sum(nbrs, []))
+        assert_equal(d_xyz.source2nearest_target(4), 9)
+        assert_equal(d_xyz.source2nearest_target([4, 1, 3]), [9, 5, 1])
+        assert_raises(ValueError, d_xyz.source2nearest_target, 7)
+
+        assert_equal(d_xyz.target2nearest_source(59), 3)
+        assert_equal(d_xyz.target2nearest_source(20), None)
+        assert_equal(d_xyz.target2nearest_source(
+                            20, fallback_euclidean_distance=True), 1)
+        d_xyz.add(20, [20])
+        assert_equal(d_xyz.target2nearest_source(
+                            40, fallback_euclidean_distance=True), 20)
+
+        # among equally near centers the one with the smallest key wins,
+        # here of the face neighbors 7, 11, 13, 17 and 32 of voxel 12
+        d_tie = VolumeMaskDictionary(vg, vg.lin2xyz(np.arange(vg.nvoxels)))
+        for src in xrange(vg.nvoxels):
+            if src != 12:
+                d_tie.add(src, [src])
+        assert_equal(d_tie.target2nearest_source(
+                            12, fallback_euclidean_distance=True), 7)
 
 
 def _cartprod(d):
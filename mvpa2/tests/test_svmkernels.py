@@ -26,6 +26,8 @@ from mvpa2.clfs.sg.svm import SVM as sgSVM
 from mvpa2.generators.splitters import Splitter
 from mvpa2.generators.partition import NFoldPartitioner
 from mvpa2.measures.base import CrossValidation, TransferMeasure, ProxyMeasure
+from mvpa2.generators.permutation import AttributePermutator
+from mvpa2.clfs.stats import MCNullDist
 from mvpa2.mappers.fx import BinaryFxNode
 from mvpa2.misc.errorfx import mean_mismatch_error
 
@@ -123,6 +125,36 @@ class SVMKernelTests(unittest.TestCase):
             ok_(~ck._recomputed)
             ok_(terr == terr_)
 
+    def test_cached_kernel_auto(self):
+        skip_if_no_external('shogun', ver_dep='shogun:rev', min_version=4455)
+
+        k  = LinearSGKernel(normalizer_cls=False)
+        ck = CachedKernel(LinearSGKernel(normalizer_cls=False))
+
+        clf = sgSVM(svm_impl='libsvm', kernel=k, C=-1)
+        clf_ = sgSVM(svm_impl='libsvm', kernel=ck, C=-1)
+
+        cvte = CrossValidation(clf, NFoldPartitioner())
+        cvte_ = CrossValidation(clf_, NFoldPartitioner())
+
+        ds = datasets['uni2medium'].copy(deep=False)
+        # count how often the kernel gets computed
+        ncached = []
+        cache = ck._cache
+        ck._cache = lambda *args: (ncached.append(1), cache(*args))
+
+        # no need to pre-compute the kernel
+        assert_array_equal(cvte(ds), cvte_(ds))
+        assert_equal(len(ncached), 1)
+        # input dataset was not modified
+        ok_(not 'origids' in ds.sa)
+
+        # a single kernel for all permutations
+        null = MCNullDist(AttributePermutator('targets', count=4),
+                          measure=cvte_)
+        null.fit(None, ds)
+        assert_equal(len(ncached), 2)
+
     def test_vstack_and_origids_issue(self):
         # That is actually what swaroop hit
         skip_if_no_external('shogun', ver_dep='shogun:rev', min_version=4455)
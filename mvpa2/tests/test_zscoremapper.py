@@ -203,4 +203,18 @@ def test_zscore_withoutchunks():
     zscore(ds, chunks_attr=None)
     assert(np.any(ds.samples != np.arange(32).reshape((8,-1))))
     ds_summary = ds.summary()
-    assert(ds_summary is not None)
\ No newline at end of file
+    assert(ds_summary is not None)
+
+def test_zscore_blocks():
+    ds = dataset_wizard(np.random.normal(size=(30, 5)) * 3 + 2,
+                        targets=1, chunks=np.repeat([0, 1], 15))
+    ds.samples[:, 2] = 4                # invariant feature
+    for chunks_attr in (None, 'chunks'):
+        zm = ZScoreMapper(chunks_attr=chunks_attr, auto_train=True)
+        mds = zm(ds)
+        # a few samples at a time yields the same
+        zm_blocks = ZScoreMapper(chunks_attr=chunks_attr, auto_train=True)
+        zm_blocks._batch_nelements = 4 * ds.nfeatures
+        mds_blocks = zm_blocks(ds)
+        assert_array_almost_equal(mds_blocks.samples, mds.samples)
+        assert_array_equal(mds_blocks.samples[:, 2], 0)